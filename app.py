@@ -3,34 +3,564 @@ import logging
 import asyncpg
 import random
 import os
-from aiogram import Bot, Dispatcher, F, Router
+import sys
+import time
+import html
+import json
+import signal
+import socket
+import functools
+import contextvars
+import re
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from aiogram import Bot, Dispatcher, F, Router, BaseMiddleware
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, FSInputFile
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramNetworkError, TelegramServerError
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 
 load_dotenv()
 
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_API_URL = os.getenv("BOT_API_URL")  # lokal Bot API server yoki benchmarks/mock_bot_api.py
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+# Qo'shimcha adminlar (vergul bilan): keshbek navbatini birga ko'rib chiqish uchun
+ADMIN_IDS = {ADMIN_ID} | {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_QUERIES = int(os.getenv("DB_POOL_MAX_QUERIES", "50000"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))  # bo'sh ulanish yopilguncha, s
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))  # pooldan ulanish kutish, s
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))  # bitta so'rov, s
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# PgBouncer (transaction/statement pooling) orqali ulanganda prepared statement kesh o'chiriladi
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "0") == "1"
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "cashback-bot")
+DB_INIT_SQL = os.getenv("DB_INIT_SQL", "")  # har bir yangi ulanishda bir marta
+DB_SETUP_SQL = os.getenv("DB_SETUP_SQL", "")  # har bir acquire() da
+# Bir nechta instans (masalan, load balancer ortidagi webhook): jarayon ichidagi keshlar
+# boshqa instansdagi yozuvlarni ko'rmaydi, shuning uchun ular qisqartiriladi yoki o'chiriladi
+MULTI_INSTANCE = os.getenv("MULTI_INSTANCE", "0") == "1"
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Boshqa instansdagi o'zgarish (masalan, til) shu instansda ko'pi bilan shuncha eskirgan ko'rinadi
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "5" if MULTI_INSTANCE else "300"))
+ADMIN_USERS_PAGE_SIZE = 20
+ADMIN_SEARCH_LIMIT = 20
+# Qisqaroq qism bo'yicha LIKE ni trigram indeks bajara olmaydi (to'liq skanerlash bo'lardi)
+ADMIN_SEARCH_MIN_LENGTH = 3
+HISTORY_PAGE_SIZE = 10
+ADMIN_HISTORY_PAGE_SIZE = 20
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+# Shuncha natijadan keyin checkpoint: qulashda qayta yuboriladiganlar shu songa cheklanadi
+BROADCAST_CHECKPOINT_SIZE = int(os.getenv("BROADCAST_CHECKPOINT_SIZE", "25"))
+# Broadcastni bajarayotgan instansning "ijarasi": yangilanmasa, boshqa instans davom ettiradi
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", "60"))
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+STATS_ROLLUP_INTERVAL = float(os.getenv("STATS_ROLLUP_INTERVAL", "60"))
+CASHBACK_CLAIM_TIMEOUT = int(os.getenv("CASHBACK_CLAIM_TIMEOUT", "600"))
+CASHBACK_BULK_SIZE = int(os.getenv("CASHBACK_BULK_SIZE", "50"))
+CASHBACK_BULK_THRESHOLD = int(os.getenv("CASHBACK_BULK_THRESHOLD", "500000"))
+CASHBACK_BULK_MAX = int(os.getenv("CASHBACK_BULK_MAX", "1000"))
+FSM_TTL = int(os.getenv("FSM_TTL", "86400"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "5000"))
+# Bir nechta instansda o'chiriladi: boshqa instans yozgan holatni eski nusxa bilan o'qimaslik uchun
+FSM_CACHE_TTL = 0.0 if MULTI_INSTANCE else float(os.getenv("FSM_CACHE_TTL", "2"))
+FSM_CLEANUP_INTERVAL = float(os.getenv("FSM_CLEANUP_INTERVAL", "600"))
+# Ro'yxatdan o'tish shuncha vaqt davom etmasa - tashlab ketilgan deb, tanlangan til yoziladi
+REGISTRATION_ABANDON_TIMEOUT = int(os.getenv("REGISTRATION_ABANDON_TIMEOUT", "900"))
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling yoki webhook
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "100"))
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "50"))  # bir vaqtda bajariladigan update'lar
+SCHEDULER_USER_QUEUE = int(os.getenv("SCHEDULER_USER_QUEUE", "5"))  # bitta foydalanuvchi navbatining chegarasi
+# Anti-flood: foydalanuvchi boshiga token bucket (update/s va burst)
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "6"))
+# Handler bo'yicha alohida limitlar: "cmd_start=0.5/3,history_handler=1/4"
+THROTTLE_HANDLER_LIMITS = os.getenv("THROTTLE_HANDLER_LIMITS", "")
+THROTTLE_MAX_KEYS = int(os.getenv("THROTTLE_MAX_KEYS", "100000"))
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # tashqi manzil, masalan https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") == "1"
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "127.0.0.1")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+DB_PROFILE = os.getenv("DB_PROFILE", "0") == "1"  # so'rovlar profili + sekin so'rovlar logi
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_SLOW_QUERY_LOG = os.getenv("DB_SLOW_QUERY_LOG")  # fayl; bo'lmasa umumiy log
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 - o'chirilgan
 
 logging.basicConfig(level=logging.INFO)
 
 # Global pool variable
 db_pool = None
 
+# ==================== CACHE ====================
+class TTLCache:
+    """Jarayon ichidagi LRU + TTL kesh"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits / total * 100) if total else 0.0,
+        }
+
+# users jadvalidagi ustunlar (UserRecord maydonlari)
+USER_COLUMNS = (
+    'user_id', 'username', 'first_name', 'last_name', 'name', 'phone',
+    'language', 'registered', 'cashback_balance', 'referred_by',
+    'referrals_count', 'created_at'
+)
+
+class UserRecord:
+    """users jadvalidagi bitta foydalanuvchi (pozitsion tuple o'rniga nomli maydonlar)
+    
+    So'rov faqat kerakli ustunlarni o'qiydi - qolgan maydonlar None.
+    """
+
+    __slots__ = USER_COLUMNS
+
+    def __init__(self, **fields):
+        for column in USER_COLUMNS:
+            setattr(self, column, fields.get(column))
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(**dict(row))
+
+    def __repr__(self):
+        return f"UserRecord(user_id={self.user_id}, name={self.name!r}, language={self.language!r})"
+
+class UserCache(TTLCache):
+    """Foydalanuvchi yozuvlari uchun kesh (get_user_language va anti-flood javoblari oldida)
+    
+    Yozuvchi funksiyalar keshdagi yozuvni yangilamaydi, o'chiradi (invalidate). Bazadan
+    o'qish loading() ichida bo'ladi: o'qish davomida shu foydalanuvchi uchun invalidate()
+    chaqirilsa, o'qilgan (eskirgan bo'lishi mumkin) qiymat keshga yozilmaydi.
+    Kesh jarayon ichida: boshqa instansdagi yozuvlar bu yerga yetib bormaydi, ularning
+    eskirishi USER_CACHE_TTL bilan cheklanadi (MULTI_INSTANCE=1 da standart 5 s).
+    """
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self._loading = {}  # user_id -> [davom etayotgan o'qishlar, avlod]
+
+    def invalidate(self, user_id):
+        super().invalidate(user_id)
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            loading[1] += 1
+
+    @contextmanager
+    def loading(self, user_id):
+        """Bazadan o'qish oralig'i: store(qiymat) - oraliqda invalidate() bo'lmagan bo'lsa keshga"""
+        loading = self._loading.setdefault(user_id, [0, 0])
+        loading[0] += 1
+        generation = loading[1]
+        
+        def store(value):
+            if loading[1] == generation:
+                self.set(user_id, value)
+        
+        try:
+            yield store
+        finally:
+            loading[0] -= 1
+            if not loading[0]:
+                self._loading.pop(user_id, None)
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# ==================== METRICS ====================
+class Histogram:
+    """Kumulyativ bo'lmagan bucket'li oddiy gistogramma (soniyalarda)"""
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # oxirgisi: +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Taxminiy kvantil: q ga yetgan bucket'ning yuqori chegarasi"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, bound in enumerate(self.buckets):
+            seen += self.counts[i]
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class LabeledHistograms(dict):
+    """Yorliq (handler / so'rov nomi) bo'yicha gistogrammalar"""
+
+    def __missing__(self, label):
+        histogram = self[label] = Histogram()
+        return histogram
+
+
+class LabeledCounters(dict):
+    """Yorliq bo'yicha hisoblagichlar"""
+
+    def __missing__(self, label):
+        return 0
+
+    def inc(self, label):
+        self[label] += 1
+
+
+HANDLER_LATENCY = LabeledHistograms()
+HANDLER_ERRORS = LabeledCounters()
+QUERY_LATENCY = LabeledHistograms()
+QUERY_ERRORS = LabeledCounters()
+
+# Hozir bajarilayotgan ma'lumotlar funksiyasi nomi (so'rovlar shu nom bilan o'lchanadi)
+current_query = contextvars.ContextVar('current_query', default='other')
+
+def db_query(func):
+    """Ma'lumotlar funksiyasi ichidagi barcha so'rovlarni shu funksiya nomi bilan belgilash"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_query.set(func.__qualname__)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            current_query.reset(token)
+    return wrapper
+
+
+SINGLE_FLIGHT_CALLS = LabeledCounters()
+SINGLE_FLIGHT_COALESCED = LabeledCounters()
+
+def single_flight(func):
+    """Bir xil argumentli parallel chaqiruvlar bitta so'rovni va uning natijasini bo'lishadi
+    
+    Faqat o'quvchi funksiyalar uchun (opt-in). Natija umumiy obyekt - chaqiruvchilar
+    uni o'zgartirmasligi kerak. Birinchi chaqiruvchi bekor qilinsa ham so'rov
+    boshqalar uchun davom etadi (alohida task + shield).
+    """
+    in_flight = {}
+    name = func.__qualname__
+
+    def finish(key, task):
+        in_flight.pop(key, None)
+        # Hamma chaqiruvchi bekor qilingan bo'lsa ham xato "olinmagan" bo'lib qolmasin
+        if not task.cancelled():
+            task.exception()
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        SINGLE_FLIGHT_CALLS.inc(name)
+        task = in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            in_flight[key] = task
+            task.add_done_callback(lambda done: finish(key, done))
+        else:
+            SINGLE_FLIGHT_COALESCED.inc(name)
+        return await asyncio.shield(task)
+    return wrapper
+
+# Shu kontekstdagi oxirgi db_pool.acquire() kutish vaqti (profil uchun)
+current_pool_wait = contextvars.ContextVar('current_pool_wait', default=0.0)
+
+slow_query_logger = logging.getLogger('slow_query')
+if DB_SLOW_QUERY_LOG:
+    slow_query_handler = logging.FileHandler(DB_SLOW_QUERY_LOG)
+    slow_query_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_query_logger.addHandler(slow_query_handler)
+    slow_query_logger.propagate = False
+
+SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|(?<![$\w])\d+(?:\.\d+)?\b")
+
+def query_shape(query):
+    """So'rov shakli: bo'shliqlar qisqartirilgan, literallar ? bilan almashtirilgan"""
+    return SQL_LITERAL_RE.sub('?', ' '.join(query.split()))
+
+def redact_params(args):
+    """Parametrlarni logga qiymatsiz yozish: faqat turi (va uzunligi)"""
+    redacted = []
+    for i, value in enumerate(args, 1):
+        if value is None:
+            redacted.append(f"${i}=NULL")
+        elif isinstance(value, (str, bytes, list, tuple, dict)):
+            redacted.append(f"${i}=<{type(value).__name__}:{len(value)}>")
+        else:
+            redacted.append(f"${i}=<{type(value).__name__}>")
+    return ', '.join(redacted)
+
+def status_rows(status):
+    """execute() status satridagi qatorlar soni ("UPDATE 3" -> 3, "CREATE TABLE" -> 0)"""
+    last = status.rsplit(' ', 1)[-1]
+    return int(last) if last.isdigit() else 0
+
+def row_found(row):
+    """fetchrow()/fetchval(): qator bor bo'lsa 1, aks holda 0"""
+    return 0 if row is None else 1
+
+
+class QueryProfile:
+    """So'rov shakllari bo'yicha yig'ilgan profil (DB_PROFILE=1 bo'lganda)"""
+
+    def __init__(self):
+        self.shapes = {}
+
+    def record(self, name, query, duration, rows, pool_wait):
+        key = (name, query_shape(query))
+        item = self.shapes.get(key)
+        if item is None:
+            item = self.shapes[key] = {
+                'name': name, 'shape': key[1], 'count': 0, 'total': 0.0,
+                'max': 0.0, 'rows': 0, 'pool_wait': 0.0
+            }
+        item['count'] += 1
+        item['total'] += duration
+        item['max'] = max(item['max'], duration)
+        item['rows'] += rows
+        item['pool_wait'] += pool_wait
+
+    def top(self, n=10):
+        """Eng sekin (maksimal vaqt bo'yicha) n ta so'rov shakli"""
+        return sorted(self.shapes.values(), key=lambda item: item['max'], reverse=True)[:n]
+
+    def clear(self):
+        self.shapes.clear()
+
+query_profile = QueryProfile()
+
+# Yoqilgan bo'lsa - bajarilgan (so'rov, parametrlar) shu ro'yxatga yoziladi
+query_capture = contextvars.ContextVar('query_capture', default=None)
+
+@contextmanager
+def capture_queries():
+    """Blok ichida bajarilgan so'rovlarni yig'ish (EXPLAIN va benchmarklar uchun)"""
+    captured = []
+    token = query_capture.set(captured)
+    try:
+        yield captured
+    finally:
+        query_capture.reset(token)
+
+
+class TimedConnection(asyncpg.Connection):
+    """Har bir so'rov vaqtini QUERY_LATENCY ga yozadigan ulanish (DB_PROFILE=1 da - profilga ham)"""
+
+    async def _timed(self, method, query, args, kwargs, count_rows):
+        name = current_query.get()
+        captured = query_capture.get()
+        if captured is not None:
+            captured.append((name, query, args))
+        started = time.perf_counter()
+        rows = 0
+        try:
+            result = await method(query, *args, **kwargs)
+            rows = count_rows(result)
+            return result
+        except Exception:
+            QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            QUERY_LATENCY[name].observe(duration)
+            if DB_PROFILE:
+                self._profile(name, query, args, duration, rows)
+
+    def _profile(self, name, query, args, duration, rows):
+        pool_wait = current_pool_wait.get()
+        query_profile.record(name, query, duration, rows, pool_wait)
+        if duration * 1000 >= DB_SLOW_QUERY_MS:
+            slow_query_logger.warning(
+                f"{name}: {duration * 1000:.1f} ms, rows={rows}, pool_wait={pool_wait * 1000:.1f} ms, "
+                f"params=[{redact_params(args)}] sql={query_shape(query)}"
+            )
+
+    async def execute(self, query, *args, **kwargs):
+        return await self._timed(super().execute, query, args, kwargs, status_rows)
+
+    async def executemany(self, command, args, **kwargs):
+        # Har bir parametrlar to'plami - bitta buyruq
+        return await self._timed(super().executemany, command, (args,), kwargs, lambda _: len(args))
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self._timed(super().fetch, query, args, kwargs, len)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self._timed(super().fetchrow, query, args, kwargs, row_found)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self._timed(super().fetchval, query, args, kwargs, row_found)
+
+
+class InstrumentedPool:
+    """asyncpg pool ustidagi o'ram: acquire() kutish vaqti, band/bo'sh ulanishlar, timeoutlar"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.acquire_wait = Histogram()
+        self.acquires = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.in_use = 0
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            conn = await self._pool.acquire(timeout=timeout or DB_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+            wait = time.perf_counter() - started
+            self.acquire_wait.observe(wait)
+        
+        self.acquires += 1
+        self.in_use += 1
+        # Kutish vaqti faqat shu ulanishdagi so'rovlarga tegishli - chiqishda qaytariladi
+        token = current_pool_wait.set(wait)
+        try:
+            yield conn
+        finally:
+            current_pool_wait.reset(token)
+            self.in_use -= 1
+            await self._pool.release(conn)
+
+    async def close(self):
+        await self._pool.close()
+
+    def stats(self):
+        return {
+            'size': self._pool.get_size(),
+            'min_size': self._pool.get_min_size(),
+            'max_size': self._pool.get_max_size(),
+            'idle': self._pool.get_idle_size(),
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'acquires': self.acquires,
+            'timeouts': self.timeouts,
+            'wait': self.acquire_wait.stats(),
+        }
+
 # ==================== DATABASE ====================
+async def init_connection(conn):
+    """Yangi ulanish ochilganda (pool init hook)"""
+    if DB_INIT_SQL:
+        await conn.execute(DB_INIT_SQL)
+
+async def setup_connection(conn):
+    """Har bir acquire() da (pool setup hook)"""
+    await conn.execute(DB_SETUP_SQL)
+
+async def create_db_pool():
+    """Sozlamalardan asyncpg pool yaratish"""
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_queries=DB_POOL_MAX_QUERIES,
+        max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        statement_cache_size=0 if DB_PGBOUNCER else DB_STATEMENT_CACHE_SIZE,
+        server_settings={'application_name': DB_APPLICATION_NAME},
+        init=init_connection,
+        setup=setup_connection if DB_SETUP_SQL else None,
+        connection_class=TimedConnection,
+    )
+    return InstrumentedPool(pool)
+
 async def init_db():
     """PostgreSQL bazasini ishga tushirish"""
     global db_pool
     
     try:
-        db_pool = await asyncpg.create_pool(DATABASE_URL)
+        db_pool = await create_db_pool()
         logging.info("PostgreSQL bazasiga ulanish muvaffaqiyatli!")
         
         async with db_pool.acquire() as conn:
@@ -66,118 +596,573 @@ async def init_db():
                 )
             ''')
             
+            # Broadcast vazifalari (restartdan keyin davom ettirish uchun)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                    id SERIAL PRIMARY KEY,
+                    admin_id BIGINT,
+                    message_type TEXT,
+                    content TEXT,
+                    caption TEXT,
+                    status TEXT DEFAULT 'draft',
+                    total INTEGER DEFAULT 0,
+                    sent INTEGER DEFAULT 0,
+                    blocked INTEGER DEFAULT 0,
+                    deactivated INTEGER DEFAULT 0,
+                    errors INTEGER DEFAULT 0,
+                    last_user_id BIGINT DEFAULT NULL,
+                    status_chat_id BIGINT DEFAULT NULL,
+                    status_message_id BIGINT DEFAULT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP DEFAULT NULL,
+                    finished_at TIMESTAMP DEFAULT NULL
+                )
+            ''')
+            
+            # Qaysi instans broadcastni yuborayotgani va ijarasi qachon tugashi
+            await conn.execute('''
+                ALTER TABLE broadcast_jobs
+                ADD COLUMN IF NOT EXISTS owner TEXT DEFAULT NULL,
+                ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP DEFAULT NULL
+            ''')
+            
+            # Har bir oluvchiga yuborish natijasi
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                    job_id INTEGER REFERENCES broadcast_jobs(id) ON DELETE CASCADE,
+                    user_id BIGINT,
+                    status TEXT,
+                    PRIMARY KEY (job_id, user_id)
+                )
+            ''')
+            
+            # Keshbek so'rovlari navbati (bir nechta admin uchun)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS cashback_requests (
+                    id SERIAL PRIMARY KEY,
+                    user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                    amount INTEGER NOT NULL,
+                    photo_file_id TEXT,
+                    idempotency_key TEXT UNIQUE,
+                    status TEXT DEFAULT 'pending',
+                    claimed_by BIGINT DEFAULT NULL,
+                    claimed_at TIMESTAMP DEFAULT NULL,
+                    percent INTEGER DEFAULT NULL,
+                    cashback INTEGER DEFAULT NULL,
+                    decided_by BIGINT DEFAULT NULL,
+                    decided_at TIMESTAMP DEFAULT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_cashback_requests_open 
+                ON cashback_requests(created_at, id) WHERE status IN ('pending', 'claimed')
+            ''')
+            
+            # FSM holatlari (MemoryStorage o'rniga, restart va bir nechta worker uchun)
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    bot_id BIGINT,
+                    chat_id BIGINT,
+                    user_id BIGINT,
+                    state TEXT,
+                    data JSONB NOT NULL DEFAULT '{}',
+                    expires_at TIMESTAMP NOT NULL,
+                    PRIMARY KEY (bot_id, chat_id, user_id)
+                )
+            ''')
+            
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_fsm_storage_expires 
+                ON fsm_storage(expires_at)
+            ''')
+            
             # Indexlar yaratish (tezlik uchun)
             await conn.execute('''
                 CREATE INDEX IF NOT EXISTS idx_cashback_history_user_id 
                 ON cashback_history(user_id)
             ''')
             
+            # Tarix sahifalari uchun keyset pagination indexi
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_cashback_history_user_created 
+                ON cashback_history(user_id, created_at DESC, id DESC)
+            ''')
+            
             await conn.execute('''
                 CREATE INDEX IF NOT EXISTS idx_users_registered 
                 ON users(registered) WHERE registered = 1
             ''')
             
+            # Admin ro'yxati uchun keyset pagination indexi
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_registered_created 
+                ON users(created_at DESC, user_id DESC) WHERE registered = 1
+            ''')
+            
+            # Admin qidiruvi uchun trigram indexlar (telefon va ism bo'yicha)
+            try:
+                await conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                await conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_users_phone_trgm 
+                    ON users USING gin (phone gin_trgm_ops)
+                ''')
+                await conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_users_name_trgm 
+                    ON users USING gin (name gin_trgm_ops)
+                ''')
+            except Exception as e:
+                logging.error(f"pg_trgm indexlarini yaratishda xato (qidiruv sekin bo'ladi): {e}")
+            
+            await init_statistics(conn)
+            
             logging.info("Jadvallar yaratildi!")
             
     except Exception as e:
         logging.error(f"Bazaga ulanishda xato: {e}")
         raise
 
+# Statistika ustunlari (daily_stats va stats_deltas uchun bir xil)
+STATS_COLUMNS = (
+    'signups', 'registered', 'balance', 'transactions', 'cashback_total',
+    'purchases', 'cashback_issued', 'bonuses', 'deductions'
+)
+
+# stats_totals (bitta qator) ni daily_stats dan qayta hisoblash
+STATS_TOTALS_FROM_DAILY = (
+    f"INSERT INTO stats_totals (id, {', '.join(STATS_COLUMNS)}) "
+    f"SELECT TRUE, {', '.join(f'COALESCE(SUM({column}), 0)' for column in STATS_COLUMNS)} FROM daily_stats "
+    f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{column} = EXCLUDED.{column}' for column in STATS_COLUMNS)}"
+)
+
+async def init_statistics(conn):
+    """Kunlik statistika jadvallari va ularni yangilab turuvchi triggerlar
+    
+    users va cashback_history ga har bir yozuv stats_deltas ga kichik qator qo'shadi
+    (faqat INSERT - qulflar va deadlocklar yo'q). rollup_statistics() ularni
+    daily_stats ga va umumiy yig'indilar qatori stats_totals ga qo'shadi.
+    Hisoblar foydalanuvchi/tranzaksiya yaratilgan kunga yoziladi.
+    """
+    is_new = await conn.fetchval("SELECT to_regclass('daily_stats') IS NULL")
+    totals_new = await conn.fetchval("SELECT to_regclass('stats_totals') IS NULL")
+    
+    columns = ", ".join(f"{column} BIGINT NOT NULL DEFAULT 0" for column in STATS_COLUMNS)
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day DATE PRIMARY KEY,
+            {columns}
+        )
+    ''')
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS stats_deltas (
+            id BIGSERIAL PRIMARY KEY,
+            day DATE NOT NULL,
+            {columns}
+        )
+    ''')
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            {columns}
+        )
+    ''')
+    if totals_new and not is_new:
+        await conn.execute(STATS_TOTALS_FROM_DAILY)
+    
+    await conn.execute('''
+        CREATE OR REPLACE FUNCTION stats_users_delta() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO stats_deltas (day, signups, registered, balance)
+                VALUES (
+                    COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date,
+                    1,
+                    (COALESCE(NEW.registered, 0) = 1)::int,
+                    COALESCE(NEW.cashback_balance, 0)
+                );
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO stats_deltas (day, registered, balance)
+                VALUES (
+                    COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date,
+                    (COALESCE(NEW.registered, 0) = 1)::int - (COALESCE(OLD.registered, 0) = 1)::int,
+                    COALESCE(NEW.cashback_balance, 0) - COALESCE(OLD.cashback_balance, 0)
+                );
+            ELSE
+                INSERT INTO stats_deltas (day, signups, registered, balance)
+                VALUES (
+                    COALESCE(OLD.created_at, CURRENT_TIMESTAMP)::date,
+                    -1,
+                    -(COALESCE(OLD.registered, 0) = 1)::int,
+                    -COALESCE(OLD.cashback_balance, 0)
+                );
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    
+    await conn.execute('''
+        CREATE OR REPLACE FUNCTION stats_history_delta() RETURNS TRIGGER AS $$
+        DECLARE
+            r RECORD;
+            k INTEGER;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                r := NEW;
+                k := 1;
+            ELSE
+                r := OLD;
+                k := -1;
+            END IF;
+            INSERT INTO stats_deltas (day, transactions, cashback_total, purchases, cashback_issued, bonuses, deductions)
+            VALUES (
+                COALESCE(r.created_at, CURRENT_TIMESTAMP)::date,
+                k,
+                k * COALESCE(r.cashback, 0),
+                k * (CASE WHEN r.type = 'purchase' THEN 1 ELSE 0 END),
+                k * (CASE WHEN r.type = 'purchase' THEN COALESCE(r.cashback, 0) ELSE 0 END),
+                k * (CASE WHEN r.type IN ('referral', 'admin_bonus') THEN COALESCE(r.cashback, 0) ELSE 0 END),
+                k * (CASE WHEN r.type = 'admin_deduct' THEN -COALESCE(r.cashback, 0) ELSE 0 END)
+            );
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    
+    await conn.execute('''
+        DROP TRIGGER IF EXISTS users_stats_insert_delete ON users;
+        CREATE TRIGGER users_stats_insert_delete
+            AFTER INSERT OR DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION stats_users_delta();
+        
+        DROP TRIGGER IF EXISTS users_stats_update ON users;
+        CREATE TRIGGER users_stats_update
+            AFTER UPDATE OF registered, cashback_balance ON users
+            FOR EACH ROW
+            WHEN (OLD.registered IS DISTINCT FROM NEW.registered 
+                  OR OLD.cashback_balance IS DISTINCT FROM NEW.cashback_balance)
+            EXECUTE FUNCTION stats_users_delta();
+        
+        DROP TRIGGER IF EXISTS cashback_history_stats ON cashback_history;
+        CREATE TRIGGER cashback_history_stats
+            AFTER INSERT OR DELETE ON cashback_history
+            FOR EACH ROW EXECUTE FUNCTION stats_history_delta();
+    ''')
+    
+    if is_new:
+        await rebuild_statistics(conn)
+
+@db_query
+async def rollup_statistics(conn):
+    """Yig'ilib qolgan stats_deltas qatorlarini daily_stats va stats_totals ga qo'shish (bitta so'rov)"""
+    sums = ", ".join(f"SUM({column}) AS {column}" for column in STATS_COLUMNS)
+    totals = ", ".join(f"COALESCE(SUM({column}), 0) AS {column}" for column in STATS_COLUMNS)
+    updates = ", ".join(f"{column} = daily_stats.{column} + EXCLUDED.{column}" for column in STATS_COLUMNS)
+    totals_updates = ", ".join(f"{column} = stats_totals.{column} + moved_total.{column}" for column in STATS_COLUMNS)
+    await conn.execute(f'''
+        WITH moved AS (
+            DELETE FROM stats_deltas RETURNING *
+        ), per_day AS (
+            SELECT day, {sums} FROM moved GROUP BY day
+        ), totals AS (
+            UPDATE stats_totals SET {totals_updates}
+            FROM (SELECT {totals} FROM per_day) moved_total
+        )
+        INSERT INTO daily_stats (day, {", ".join(STATS_COLUMNS)})
+        SELECT day, {", ".join(STATS_COLUMNS)} FROM per_day
+        ON CONFLICT (day) DO UPDATE SET {updates}
+    ''')
+
+@db_query
+async def rebuild_statistics(conn):
+    """daily_stats ni users va cashback_history dan qaytadan hisoblash (backfill)"""
+    async with conn.transaction():
+        # Qayta hisoblash paytida yozuvlarni to'xtatib turish
+        await conn.execute('LOCK TABLE users, cashback_history IN SHARE MODE')
+        await conn.execute('DELETE FROM stats_deltas')
+        await conn.execute('DELETE FROM daily_stats')
+        await conn.execute('''
+            INSERT INTO daily_stats (day, signups, registered, balance)
+            SELECT COALESCE(created_at, CURRENT_TIMESTAMP)::date,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE registered = 1),
+                   COALESCE(SUM(cashback_balance), 0)
+            FROM users
+            GROUP BY 1
+        ''')
+        await conn.execute('''
+            INSERT INTO daily_stats (day, transactions, cashback_total, purchases, cashback_issued, bonuses, deductions)
+            SELECT COALESCE(created_at, CURRENT_TIMESTAMP)::date,
+                   COUNT(*),
+                   COALESCE(SUM(cashback), 0),
+                   COUNT(*) FILTER (WHERE type = 'purchase'),
+                   COALESCE(SUM(cashback) FILTER (WHERE type = 'purchase'), 0),
+                   COALESCE(SUM(cashback) FILTER (WHERE type IN ('referral', 'admin_bonus')), 0),
+                   COALESCE(-SUM(cashback) FILTER (WHERE type = 'admin_deduct'), 0)
+            FROM cashback_history
+            GROUP BY 1
+            ON CONFLICT (day) DO UPDATE SET
+                transactions = EXCLUDED.transactions,
+                cashback_total = EXCLUDED.cashback_total,
+                purchases = EXCLUDED.purchases,
+                cashback_issued = EXCLUDED.cashback_issued,
+                bonuses = EXCLUDED.bonuses,
+                deductions = EXCLUDED.deductions
+        ''')
+        await conn.execute(STATS_TOTALS_FROM_DAILY)
+    logging.info("Statistika qaytadan hisoblandi")
+
+async def stats_rollup_loop():
+    """Fonda: stats_deltas ni muntazam ravishda daily_stats ga yig'ish"""
+    global db_pool
+    while True:
+        await asyncio.sleep(STATS_ROLLUP_INTERVAL)
+        try:
+            async with db_pool.acquire() as conn:
+                await rollup_statistics(conn)
+        except Exception as e:
+            logging.error(f"Statistikani yig'ishda xato: {e}")
+
+async def backfill_statistics():
+    """CLI: python app.py backfill-stats"""
+    await init_db()
+    try:
+        async with db_pool.acquire() as conn:
+            await rebuild_statistics(conn)
+    finally:
+        await close_db()
+
 async def close_db():
     """Bazani yopish"""
     global db_pool
     if db_pool:
         await db_pool.close()
 
-async def get_user(user_id):
-    """Foydalanuvchi ma'lumotlarini olish"""
+@db_query
+async def get_user_profile(user_id):
+    """Profil ko'rinishi uchun (ism, telefon, til, balans): faqat shu ustunlar"""
     global db_pool
     async with db_pool.acquire() as conn:
-        row = await conn.fetchrow('SELECT * FROM users WHERE user_id = $1', user_id)
-        if row:
-            return tuple(row.values())
-        return None
-
-async def get_all_users():
-    """Barcha foydalanuvchilarni olish (admin uchun)"""
+        row = await conn.fetchrow('''
+            SELECT user_id, first_name, last_name, name, phone, language, cashback_balance 
+            FROM users 
+            WHERE user_id = $1
+        ''', user_id)
+    return UserRecord.from_row(row) if row else None
+
+@db_query
+async def get_user_language(user_id):
+    """Faqat foydalanuvchi tili (ko'p handlerlarga shu yetarli): keshdan yoki bitta ustun"""
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached.language or 'uz'
+    return await load_user_language(user_id)
+
+@single_flight
+async def load_user_language(user_id):
+    """Keshda yo'q foydalanuvchi tilini bazadan o'qish (bir xil o'qishlar birlashtiriladi)"""
+    global db_pool
+    with user_cache.loading(user_id) as store:
+        async with db_pool.acquire() as conn:
+            row = await conn.fetchrow('SELECT language FROM users WHERE user_id = $1', user_id)
+        if row is None:
+            return 'uz'
+        store(UserRecord(user_id=user_id, language=row['language']))
+    return row['language'] or 'uz'
+
+@db_query
+async def get_users_page(cursor=None, direction='next', limit=ADMIN_USERS_PAGE_SIZE):
+    """Foydalanuvchilar sahifasi (keyset pagination: created_at, user_id bo'yicha)
+    
+    cursor - (created_at, user_id) juftligi, direction - 'next' yoki 'prev'.
+    Sahifa va yana yozuvlar bor-yo'qligini qaytaradi.
+    """
+    global db_pool
+    async with db_pool.acquire() as conn:
+        if cursor is None:
+            rows = await conn.fetch('''
+                SELECT user_id, name, phone, cashback_balance, first_name, last_name, created_at 
+                FROM users 
+                WHERE registered = 1 
+                ORDER BY created_at DESC, user_id DESC
+                LIMIT $1
+            ''', limit + 1)
+        elif direction == 'prev':
+            rows = await conn.fetch('''
+                SELECT user_id, name, phone, cashback_balance, first_name, last_name, created_at 
+                FROM users 
+                WHERE registered = 1 AND (created_at, user_id) > ($1, $2)
+                ORDER BY created_at ASC, user_id ASC
+                LIMIT $3
+            ''', cursor[0], cursor[1], limit + 1)
+        else:
+            rows = await conn.fetch('''
+                SELECT user_id, name, phone, cashback_balance, first_name, last_name, created_at 
+                FROM users 
+                WHERE registered = 1 AND (created_at, user_id) < ($1, $2)
+                ORDER BY created_at DESC, user_id DESC
+                LIMIT $3
+            ''', cursor[0], cursor[1], limit + 1)
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if cursor is not None and direction == 'prev':
+        rows.reverse()
+    return rows, has_more
+
+@db_query
+async def search_users(query, limit=ADMIN_SEARCH_LIMIT):
+    """Foydalanuvchilarni ID, telefon yoki ism qismi bo'yicha qidirish (admin uchun)
+    
+    ADMIN_SEARCH_MIN_LENGTH dan qisqa so'rov faqat aniq ID bo'yicha qidiriladi
+    (primary key) - "%5%" kabi naqsh indeksdan foydalana olmaydi.
+    """
     global db_pool
+    query = query.strip()
+    digits = query.lstrip('+').replace(' ', '').replace('-', '')
+    user_id = int(digits) if digits.isdigit() and len(digits) <= 18 else None
+    
+    if len(digits if digits.isdigit() else query) < ADMIN_SEARCH_MIN_LENGTH:
+        if user_id is None:
+            return []
+        async with db_pool.acquire() as conn:
+            return await conn.fetch('''
+                SELECT user_id, name, phone, cashback_balance, first_name, last_name 
+                FROM users 
+                WHERE user_id = $1
+            ''', user_id)
+    
+    # LIKE maxsus belgilarini ekranlash
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f"%{escaped}%"
+    phone_pattern = f"%{digits}%" if digits.isdigit() else pattern
+    
     async with db_pool.acquire() as conn:
         rows = await conn.fetch('''
             SELECT user_id, name, phone, cashback_balance, first_name, last_name 
             FROM users 
-            WHERE registered = 1 
+            WHERE user_id = $1 OR phone LIKE $2 OR name ILIKE $3
             ORDER BY created_at DESC
-        ''')
-        return [tuple(row.values()) for row in rows]
+            LIMIT $4
+        ''', user_id, phone_pattern, pattern, limit)
+        return rows
 
+@db_query
 async def reset_user_data(user_id):
-    """Foydalanuvchi balansini va tarixini tozalash"""
+    """Foydalanuvchi balansini va tarixini tozalash (bitta atomar so'rov)"""
     global db_pool
     async with db_pool.acquire() as conn:
         try:
-            # Tarixni tozalash
-            await conn.execute('DELETE FROM cashback_history WHERE user_id = $1', user_id)
-            # Balansni 0 ga tushirish
-            await conn.execute('UPDATE users SET cashback_balance = 0 WHERE user_id = $1', user_id)
+            await conn.execute('''
+                WITH cleared AS (
+                    DELETE FROM cashback_history WHERE user_id = $1
+                )
+                UPDATE users SET cashback_balance = 0 WHERE user_id = $1
+            ''', user_id)
+            user_cache.invalidate(user_id)
             return True
         except Exception as e:
             logging.error(f"Foydalanuvchi ma'lumotlarini tozalashda xato: {e}")
             return False
 
+@db_query
 async def add_bonus_to_user(user_id, percent):
-    """Foydalanuvchiga foiz ko'rinishida bonus qo'shish"""
+    """Foydalanuvchiga foiz ko'rinishida bonus qo'shish
+    
+    Balansni o'qish, yangilash va tarixga yozish bitta atomar so'rovda.
+    (eski balans, yangi balans, bonus) qaytaradi.
+    """
     global db_pool
     async with db_pool.acquire() as conn:
         try:
-            async with conn.transaction():
-                # Joriy balansni olish
-                row = await conn.fetchrow(
-                    'SELECT cashback_balance FROM users WHERE user_id = $1', 
-                    user_id
-                )
-                
-                if not row:
-                    return None, 0
-                
-                current_balance = row['cashback_balance']
-                
-                # Bonus miqdorini hisoblash
-                bonus_amount = int(current_balance * percent / 100)
-                
-                if bonus_amount <= 0:
-                    return current_balance, 0
-                
-                # Yangi balans
-                new_balance = current_balance + bonus_amount
-                
-                # Balansni yangilash
-                await conn.execute(
-                    'UPDATE users SET cashback_balance = $1 WHERE user_id = $2',
-                    new_balance, user_id
-                )
-                
-                # Tarixga yozish
-                await conn.execute('''
+            row = await conn.fetchrow('''
+                WITH current AS (
+                    SELECT user_id, cashback_balance,
+                           (cashback_balance::BIGINT * $2 / 100)::INTEGER AS bonus
+                    FROM users 
+                    WHERE user_id = $1 
+                    FOR UPDATE
+                ),
+                updated AS (
+                    UPDATE users u 
+                    SET cashback_balance = u.cashback_balance + c.bonus
+                    FROM current c 
+                    WHERE u.user_id = c.user_id AND c.bonus > 0
+                    RETURNING u.cashback_balance
+                ),
+                history AS (
                     INSERT INTO cashback_history (user_id, amount, percent, cashback, type) 
-                    VALUES ($1, $2, $3, $4, $5)
-                ''', user_id, current_balance, percent, bonus_amount, 'admin_bonus')
-                
-                return new_balance, bonus_amount
+                    SELECT user_id, cashback_balance, $2, bonus, 'admin_bonus' 
+                    FROM current 
+                    WHERE bonus > 0
+                )
+                SELECT c.cashback_balance AS old_balance,
+                       COALESCE((SELECT cashback_balance FROM updated), c.cashback_balance) AS new_balance,
+                       GREATEST(c.bonus, 0) AS bonus
+                FROM current c
+            ''', user_id, percent)
+            
+            if not row:
+                return None, None, 0
+            
+            user_cache.invalidate(user_id)
+            return row['old_balance'], row['new_balance'], row['bonus']
                 
         except Exception as e:
             logging.error(f"Bonus qo'shishda xato: {e}")
-            return None, 0
+            return None, None, 0
 
-async def create_user(user_id, username, first_name, last_name, referred_by=None):
-    """Yangi foydalanuvchi yaratish"""
+@db_query
+async def start_user(user_id, username, first_name, last_name, referred_by=None):
+    """/start uchun bitta so'rov: foydalanuvchini yaratish, referral bonusini berish
+    va ikkala tomonning tilini hamda yangi balansni qaytarish"""
     global db_pool
     async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO users (user_id, username, first_name, last_name, referred_by)
-            VALUES ($1, $2, $3, $4, $5)
-            ON CONFLICT (user_id) DO NOTHING
+        row = await conn.fetchrow('''
+            WITH existing AS (
+                SELECT language, registered FROM users WHERE user_id = $1
+            ),
+            inserted AS (
+                INSERT INTO users (user_id, username, first_name, last_name, referred_by)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (user_id) DO NOTHING
+                RETURNING language, registered
+            ),
+            referrer AS (
+                SELECT user_id, language, cashback_balance / 100 AS bonus
+                FROM users
+                WHERE user_id = $5 AND EXISTS (SELECT 1 FROM inserted)
+            ),
+            credited AS (
+                UPDATE users u
+                SET cashback_balance = u.cashback_balance + r.bonus,
+                    referrals_count = u.referrals_count + 1
+                FROM referrer r
+                WHERE u.user_id = r.user_id AND r.bonus > 0
+                RETURNING u.cashback_balance, r.bonus
+            ),
+            history AS (
+                INSERT INTO cashback_history (user_id, amount, percent, cashback, type)
+                SELECT $5, bonus, 1, bonus, 'referral' FROM credited
+            )
+            SELECT
+                EXISTS (SELECT 1 FROM inserted) AS is_new,
+                COALESCE((SELECT language FROM existing), (SELECT language FROM inserted), 'uz') AS language,
+                COALESCE((SELECT registered FROM existing), (SELECT registered FROM inserted), 0) AS registered,
+                (SELECT COALESCE(language, 'uz') FROM referrer) AS referrer_language,
+                COALESCE((SELECT bonus FROM credited), 0) AS bonus,
+                (SELECT cashback_balance FROM credited) AS referrer_balance
         ''', user_id, username, first_name, last_name, referred_by)
-
+    
+    result = dict(row)
+    if result['is_new']:
+        user_cache.invalidate(user_id)
+    if result['bonus']:
+        user_cache.invalidate(referred_by)
+    return result
+
+@db_query
 async def update_language(user_id, language):
     """Tilni yangilash"""
     global db_pool
@@ -186,79 +1171,55 @@ async def update_language(user_id, language):
             'UPDATE users SET language = $1 WHERE user_id = $2',
             language, user_id
         )
+    user_cache.invalidate(user_id)
 
-async def update_name(user_id, name):
-    """Ismni yangilash"""
+@db_query
+async def complete_registration(user_id, language, name, phone):
+    """Ro'yxatdan o'tishni bitta yozuv bilan yakunlash (til, ism, telefon FSM da yig'ilgan)"""
     global db_pool
     async with db_pool.acquire() as conn:
-        await conn.execute(
-            'UPDATE users SET name = $1 WHERE user_id = $2',
-            name, user_id
-        )
-
-async def update_phone(user_id, phone):
-    """Telefon raqamini yangilash va ro'yxatdan o'tkazish"""
-    global db_pool
-    async with db_pool.acquire() as conn:
-        await conn.execute(
-            'UPDATE users SET phone = $1, registered = 1 WHERE user_id = $2',
-            phone, user_id
-        )
-
-async def add_referral_bonus(user_id, amount):
-    """Referral bonus qo'shish (1%)"""
-    global db_pool
-    async with db_pool.acquire() as conn:
-        try:
-            async with conn.transaction():
-                # Balansni yangilash
-                await conn.execute('''
-                    UPDATE users 
-                    SET cashback_balance = cashback_balance + $1,
-                        referrals_count = referrals_count + 1
-                    WHERE user_id = $2
-                ''', amount, user_id)
-                
-                # Tarixga yozish
-                await conn.execute('''
-                    INSERT INTO cashback_history (user_id, amount, percent, cashback, type) 
-                    VALUES ($1, $2, $3, $4, $5)
-                ''', user_id, amount, 1, amount, 'referral')
-                
-                # Yangi balansni qaytarish
-                row = await conn.fetchrow(
-                    'SELECT cashback_balance FROM users WHERE user_id = $1',
-                    user_id
-                )
-                return row['cashback_balance'] if row else 0
-                
-        except Exception as e:
-            logging.error(f"Referral bonus qo'shishda xato: {e}")
-            return None
-
-async def add_cashback(user_id, amount, percent, cashback):
-    """Keshbek qo'shish va tarixga yozish"""
+        await conn.execute('''
+            INSERT INTO users (user_id, language, name, phone, registered)
+            VALUES ($1, $2, $3, $4, 1)
+            ON CONFLICT (user_id) DO UPDATE 
+            SET language = EXCLUDED.language, 
+                name = EXCLUDED.name, 
+                phone = EXCLUDED.phone, 
+                registered = 1
+        ''', user_id, language, name, phone)
+    user_cache.invalidate(user_id)
+
+@db_query
+async def deduct_balance(user_id, amount):
+    """Balansdan ayirish - faqat balans yetarli bo'lsa (shartli, nisbiy UPDATE)
+    
+    (True, yangi balans) yoki (False, joriy balans) qaytaradi.
+    Foydalanuvchi topilmasa (False, None).
+    """
     global db_pool
     async with db_pool.acquire() as conn:
-        try:
-            async with conn.transaction():
-                # Balansni yangilash
-                await conn.execute('''
-                    UPDATE users 
-                    SET cashback_balance = cashback_balance + $1 
-                    WHERE user_id = $2
-                ''', cashback, user_id)
-                
-                # Tarixga qo'shish
-                await conn.execute('''
-                    INSERT INTO cashback_history (user_id, amount, percent, cashback, type) 
-                    VALUES ($1, $2, $3, $4, $5)
-                ''', user_id, amount, percent, cashback, 'purchase')
-                
-        except Exception as e:
-            logging.error(f"Keshbek qo'shishda xato: {e}")
-            raise
+        row = await conn.fetchrow('''
+            WITH updated AS (
+                UPDATE users 
+                SET cashback_balance = cashback_balance - $2 
+                WHERE user_id = $1 AND cashback_balance >= $2
+                RETURNING user_id, cashback_balance
+            ),
+            history AS (
+                INSERT INTO cashback_history (user_id, amount, percent, cashback, type) 
+                SELECT user_id, 0, 0, -$2, 'admin_deduct' FROM updated
+            )
+            SELECT (SELECT cashback_balance FROM updated) AS new_balance,
+                   (SELECT cashback_balance FROM users WHERE user_id = $1) AS current_balance
+        ''', user_id, amount)
+    
+    if row['new_balance'] is None:
+        return False, row['current_balance']
+    
+    user_cache.invalidate(user_id)
+    return True, row['new_balance']
 
+@db_query
 async def get_cashback_balance(user_id):
     """Joriy keshbek balansini olish"""
     global db_pool
@@ -269,18 +1230,47 @@ async def get_cashback_balance(user_id):
         )
         return row['cashback_balance'] if row else 0
 
-async def get_cashback_history(user_id):
-    """Barcha keshbeklar tarixini olish"""
+@db_query
+async def get_cashback_history_page(user_id, cursor=None, direction='next', limit=HISTORY_PAGE_SIZE):
+    """Keshbek tarixining bitta sahifasi (keyset pagination: created_at, id bo'yicha)
+    
+    cursor - (created_at, id) juftligi, direction - 'next' (eskiroq) yoki 'prev' (yangiroq).
+    Sahifa va yana yozuvlar bor-yo'qligini qaytaradi.
+    """
     global db_pool
     async with db_pool.acquire() as conn:
-        rows = await conn.fetch('''
-            SELECT amount, percent, cashback, created_at, type 
-            FROM cashback_history 
-            WHERE user_id = $1 
-            ORDER BY created_at DESC
-        ''', user_id)
-        return [tuple(row.values()) for row in rows]
+        if cursor is None:
+            rows = await conn.fetch('''
+                SELECT amount, percent, cashback, created_at, type, id 
+                FROM cashback_history 
+                WHERE user_id = $1 
+                ORDER BY created_at DESC, id DESC
+                LIMIT $2
+            ''', user_id, limit + 1)
+        elif direction == 'prev':
+            rows = await conn.fetch('''
+                SELECT amount, percent, cashback, created_at, type, id 
+                FROM cashback_history 
+                WHERE user_id = $1 AND (created_at, id) > ($2, $3)
+                ORDER BY created_at ASC, id ASC
+                LIMIT $4
+            ''', user_id, cursor[0], cursor[1], limit + 1)
+        else:
+            rows = await conn.fetch('''
+                SELECT amount, percent, cashback, created_at, type, id 
+                FROM cashback_history 
+                WHERE user_id = $1 AND (created_at, id) < ($2, $3)
+                ORDER BY created_at DESC, id DESC
+                LIMIT $4
+            ''', user_id, cursor[0], cursor[1], limit + 1)
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if cursor is not None and direction == 'prev':
+        rows.reverse()
+    return rows, has_more
 
+@db_query
 async def get_referrals_count(user_id):
     """Taklif qilgan odamlar soni"""
     global db_pool
@@ -291,52 +1281,60 @@ async def get_referrals_count(user_id):
         )
         return row['referrals_count'] if row else 0
 
+@single_flight
+@db_query
 async def get_statistics():
-    """Umumiy statistika olish"""
+    """Umumiy statistika olish (stats_totals + hali yig'ilmagan stats_deltas, faqat o'qish)
+    
+    Umumiy sonlar stats_totals qatoridan, oxirgi 8 kun daily_stats dan olinadi;
+    stats_deltas bir marta o'qiladi. Hammasi bitta so'rov - rollup bilan bir
+    vaqtda ham bitta snapshot ko'riladi. Yig'ish - stats_rollup_loop ishi; bu yerda
+    yozuv yo'q, shuning uchun parallel chaqiruvlarni birlashtirish xavfsiz.
+    """
     global db_pool
     async with db_pool.acquire() as conn:
-        # Umumiy foydalanuvchilar
-        row = await conn.fetchrow(
-            'SELECT COUNT(*) FROM users WHERE registered = 1'
-        )
-        total_users = row['count']
-        
-        # Bugun qo'shilganlar
         row = await conn.fetchrow('''
-            SELECT COUNT(*) FROM users 
-            WHERE DATE(created_at) = CURRENT_DATE
-        ''')
-        today_users = row['count']
-        
-        # Umumiy cashback balansi
-        row = await conn.fetchrow(
-            'SELECT SUM(cashback_balance) FROM users'
-        )
-        total_balance = row['sum'] or 0
-        
-        # Umumiy transaksiyalar soni va summasi
-        row = await conn.fetchrow(
-            'SELECT COUNT(*), SUM(cashback) FROM cashback_history'
-        )
-        
-        # Oxirgi 7 kun statistikasi
-        rows = await conn.fetch('''
-            SELECT DATE(created_at) as date, COUNT(*) as count 
-            FROM users 
-            WHERE created_at >= CURRENT_DATE - INTERVAL '7 days'
-            GROUP BY DATE(created_at)
-            ORDER BY date DESC
+            WITH pending AS (
+                SELECT day, SUM(signups) AS signups, SUM(registered) AS registered,
+                       SUM(balance) AS balance, SUM(transactions) AS transactions,
+                       SUM(cashback_total) AS cashback_total
+                FROM stats_deltas
+                GROUP BY day
+            ), pending_total AS (
+                SELECT COALESCE(SUM(registered), 0) AS registered, COALESCE(SUM(balance), 0) AS balance,
+                       COALESCE(SUM(transactions), 0) AS transactions,
+                       COALESCE(SUM(cashback_total), 0) AS cashback_total
+                FROM pending
+            ), recent AS (
+                SELECT day, SUM(signups)::BIGINT AS signups
+                FROM (
+                    SELECT day, signups FROM daily_stats WHERE day >= CURRENT_DATE - 7
+                    UNION ALL
+                    SELECT day, signups FROM pending WHERE day >= CURRENT_DATE - 7
+                ) days
+                GROUP BY day
+            )
+            SELECT (t.registered + p.registered)::BIGINT AS total_users,
+                   COALESCE((SELECT signups FROM recent WHERE day = CURRENT_DATE), 0) AS today_users,
+                   (t.balance + p.balance)::BIGINT AS total_balance,
+                   (t.transactions + p.transactions)::BIGINT AS total_transactions,
+                   (t.cashback_total + p.cashback_total)::BIGINT AS total_cashback_given,
+                   ARRAY(SELECT day FROM recent WHERE signups > 0 ORDER BY day DESC) AS weekly_days,
+                   ARRAY(SELECT signups FROM recent WHERE signups > 0 ORDER BY day DESC) AS weekly_signups
+            FROM stats_totals t, pending_total p
         ''')
         
         return {
-            'total_users': total_users,
-            'today_users': today_users,
-            'total_balance': total_balance,
-            'total_transactions': row['count'] or 0,
-            'total_cashback_given': row['sum'] or 0,
-            'weekly_stats': [tuple(r.values()) for r in rows]
+            'total_users': row['total_users'],
+            'today_users': row['today_users'],
+            'total_balance': row['total_balance'],
+            'total_transactions': row['total_transactions'],
+            'total_cashback_given': row['total_cashback_given'],
+            # Oxirgi 7 kun statistikasi
+            'weekly_stats': list(zip(row['weekly_days'], row['weekly_signups']))
         }
 
+@db_query
 async def delete_user(user_id):
     """Foydalanuvchini butunlay o'chirish"""
     global db_pool
@@ -347,6 +1345,7 @@ async def delete_user(user_id):
                 'DELETE FROM users WHERE user_id = $1',
                 user_id
             )
+            user_cache.invalidate(user_id)
             # DELETE natijasini tekshirish (1 row affected deb qaytaradi)
             return 'DELETE 1' in result or 'DELETE' in result
         except Exception as e:
@@ -354,6 +1353,509 @@ async def delete_user(user_id):
             return False
 
 
+# ==================== BROADCAST JOBS ====================
+@db_query
+async def create_broadcast_job(admin_id, message_type, content, caption):
+    """Broadcast vazifasini qoralama sifatida saqlash"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval('''
+            INSERT INTO broadcast_jobs (admin_id, message_type, content, caption)
+            VALUES ($1, $2, $3, $4)
+            RETURNING id
+        ''', admin_id, message_type, content, caption)
+
+@db_query
+async def start_broadcast_job(job_id, status_chat_id, status_message_id, owner=INSTANCE_ID):
+    """Qoralamani ishga tushirish: oluvchilar sonini hisoblash, holatni 'running' qilish va ijarani olish
+
+    Oluvchilar get_broadcast_batch dagi chegara bilan sanaladi: qoralama yaratilgandan
+    keyin qo'shilgan foydalanuvchilar na ro'yxatga, na jami songa kiradi.
+    """
+    global db_pool
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow('''
+            UPDATE broadcast_jobs j
+            SET status = 'running',
+                total = (
+                    SELECT COUNT(*) FROM users u
+                    WHERE u.registered = 1 AND u.created_at <= j.created_at
+                ),
+                status_chat_id = $2,
+                status_message_id = $3,
+                owner = $4,
+                lease_until = CURRENT_TIMESTAMP + $5 * INTERVAL '1 second',
+                started_at = CURRENT_TIMESTAMP
+            WHERE j.id = $1 AND j.status = 'draft'
+            RETURNING *
+        ''', job_id, status_chat_id, status_message_id, owner, BROADCAST_LEASE)
+        return dict(row) if row else None
+
+@db_query
+async def cancel_broadcast_job(job_id):
+    """Qoralamani bekor qilish"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE broadcast_jobs SET status = 'cancelled' WHERE id = $1 AND status = 'draft'",
+            job_id
+        )
+
+@db_query
+async def claim_broadcast_jobs(owner=INSTANCE_ID):
+    """Egasiz qolgan (ijarasi tugagan) tugallanmagan broadcastlarni atomar olish
+
+    Bir nechta instans bir vaqtda chaqirsa ham har bir broadcastni faqat bittasi
+    oladi (FOR UPDATE SKIP LOCKED), shuning uchun xabar ikki marta yuborilmaydi.
+    """
+    global db_pool
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch('''
+            UPDATE broadcast_jobs
+            SET owner = $1, lease_until = CURRENT_TIMESTAMP + $2 * INTERVAL '1 second'
+            WHERE id IN (
+                SELECT id FROM broadcast_jobs
+                WHERE status = 'running'
+                  AND (lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP)
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        ''', owner, BROADCAST_LEASE)
+        return sorted((dict(row) for row in rows), key=lambda job: job['id'])
+
+@db_query
+async def renew_broadcast_lease(job_id, owner):
+    """Ijarani uzaytirish; broadcast boshqa instansga o'tib ketgan bo'lsa False"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        status = await conn.execute('''
+            UPDATE broadcast_jobs
+            SET lease_until = CURRENT_TIMESTAMP + $3 * INTERVAL '1 second'
+            WHERE id = $1 AND owner = $2 AND status = 'running'
+        ''', job_id, owner, BROADCAST_LEASE)
+        return status != 'UPDATE 0'
+
+@db_query
+async def release_broadcast_job(job_id, owner):
+    """To'xtatilganda (deploy) ijarani bo'shatish: boshqa instans kutmasdan davom ettiradi"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE broadcast_jobs SET lease_until = NULL WHERE id = $1 AND owner = $2",
+            job_id, owner
+        )
+
+@db_query
+async def get_broadcast_batch(job_id, after_user_id, created_before, limit):
+    """Keyingi oluvchilar to'plami (user_id bo'yicha keyset, allaqachon yuborilganlarsiz)"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch('''
+            SELECT u.user_id 
+            FROM users u
+            WHERE u.registered = 1 
+              AND u.user_id > $2
+              AND u.created_at <= $3
+              AND NOT EXISTS (
+                  SELECT 1 FROM broadcast_deliveries d 
+                  WHERE d.job_id = $1 AND d.user_id = u.user_id
+              )
+            ORDER BY u.user_id
+            LIMIT $4
+        ''', job_id, after_user_id, created_before, limit)
+        return [row['user_id'] for row in rows]
+
+@db_query
+async def save_broadcast_progress(job_id, owner, results, counters, last_user_id=None):
+    """Yuborish natijalarini va hisoblagichlarni bitta tranzaksiyada saqlash (checkpoint)
+
+    Yetkazilganlar har doim yoziladi (qayta yuborilmasin), hisoblagichlar esa faqat
+    broadcast hali shu instansniki bo'lsa. Ijara boshqa instansga o'tgan bo'lsa False.
+    """
+    global db_pool
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            if results:
+                await conn.execute('''
+                    INSERT INTO broadcast_deliveries (job_id, user_id, status)
+                    SELECT $1, user_id, status 
+                    FROM unnest($2::BIGINT[], $3::TEXT[]) AS r(user_id, status)
+                    ON CONFLICT DO NOTHING
+                ''', job_id, list(results.keys()), list(results.values()))
+            status = await conn.execute('''
+                UPDATE broadcast_jobs
+                SET sent = $2, blocked = $3, deactivated = $4, errors = $5,
+                    last_user_id = COALESCE($6, last_user_id)
+                WHERE id = $1 AND owner = $7
+            ''', job_id, counters['sent'], counters['blocked'], counters['deactivated'],
+                counters['errors'], last_user_id, owner)
+        return status != 'UPDATE 0'
+
+@db_query
+async def finish_broadcast_job(job_id, owner):
+    """Broadcastni tugallangan deb belgilash"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        await conn.execute('''
+            UPDATE broadcast_jobs
+            SET status = 'done', finished_at = CURRENT_TIMESTAMP, lease_until = NULL
+            WHERE id = $1 AND owner = $2
+        ''', job_id, owner)
+
+
+# ==================== CASHBACK REQUESTS ====================
+def open_request_condition(admin_param, timeout_param):
+    """Ochiq so'rov sharti: kutilmoqda, shu adminda, yoki boshqa adminning olishi muddati o'tgan"""
+    return f'''(
+        status = 'pending' 
+        OR (status = 'claimed' AND (
+            claimed_by = {admin_param} 
+            OR claimed_at < CURRENT_TIMESTAMP - {timeout_param} * INTERVAL '1 second'
+        ))
+    )'''
+
+@db_query
+async def create_cashback_request(user_id, amount, photo_file_id, idempotency_key):
+    """Keshbek so'rovini navbatga qo'yish; shu kalit bilan allaqachon bo'lsa None"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval('''
+            INSERT INTO cashback_requests (user_id, amount, photo_file_id, idempotency_key)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (idempotency_key) DO NOTHING
+            RETURNING id
+        ''', user_id, amount, photo_file_id, idempotency_key)
+
+@db_query
+async def count_open_cashback_requests(max_amount=None):
+    """Ko'rib chiqilmagan so'rovlar soni (max_amount berilsa - shu summagacha bo'lganlari)"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval('''
+            SELECT COUNT(*) FROM cashback_requests 
+            WHERE status IN ('pending', 'claimed') AND ($1::INTEGER IS NULL OR amount <= $1)
+        ''', max_amount)
+
+@db_query
+async def claim_next_cashback_request(admin_id):
+    """Navbatdagi so'rovni shu adminga biriktirish (FOR UPDATE SKIP LOCKED)
+    
+    Bir vaqtda bir nechta admin olsa ham, har biri boshqa so'rov oladi.
+    """
+    global db_pool
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(f'''
+            WITH next AS (
+                SELECT id FROM cashback_requests
+                WHERE {open_request_condition('$1', '$2')}
+                ORDER BY created_at, id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            ),
+            claimed AS (
+                UPDATE cashback_requests r
+                SET status = 'claimed', claimed_by = $1, claimed_at = CURRENT_TIMESTAMP
+                FROM next 
+                WHERE r.id = next.id
+                RETURNING r.id, r.user_id, r.amount, r.photo_file_id
+            )
+            SELECT c.id, c.user_id, c.amount, c.photo_file_id, u.name, u.first_name, u.last_name, u.phone
+            FROM claimed c
+            LEFT JOIN users u ON u.user_id = c.user_id
+        ''', admin_id, CASHBACK_CLAIM_TIMEOUT)
+        return dict(row) if row else None
+
+@db_query
+async def approve_cashback_request(request_id, admin_id, percent):
+    """So'rovni tasdiqlash: holat, balans va tarix bitta tranzaksiyada
+    
+    Qator band bo'lsa (SKIP LOCKED) yoki allaqachon ko'rib chiqilgan bo'lsa None -
+    shuning uchun ikki marta bosish ikki marta keshbek bermaydi.
+    """
+    global db_pool
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(f'''
+            WITH req AS (
+                SELECT id FROM cashback_requests
+                WHERE id = $1 AND {open_request_condition('$2', '$3')}
+                FOR UPDATE SKIP LOCKED
+            ),
+            decided AS (
+                UPDATE cashback_requests r
+                SET status = 'approved', 
+                    percent = $4::INTEGER,
+                    cashback = (r.amount::BIGINT * $4::INTEGER / 100)::INTEGER,
+                    decided_by = $2, 
+                    decided_at = CURRENT_TIMESTAMP
+                FROM req 
+                WHERE r.id = req.id
+                RETURNING r.user_id, r.amount, r.cashback
+            ),
+            updated AS (
+                UPDATE users u 
+                SET cashback_balance = u.cashback_balance + d.cashback
+                FROM decided d 
+                WHERE u.user_id = d.user_id
+                RETURNING u.user_id, u.cashback_balance, COALESCE(u.language, 'uz') AS language
+            ),
+            history AS (
+                INSERT INTO cashback_history (user_id, amount, percent, cashback, type) 
+                SELECT user_id, amount, $4::INTEGER, cashback, 'purchase' FROM decided
+            )
+            SELECT d.user_id, d.amount, d.cashback, u.cashback_balance, u.language
+            FROM decided d 
+            JOIN updated u ON u.user_id = d.user_id
+        ''', request_id, admin_id, CASHBACK_CLAIM_TIMEOUT, percent)
+    
+    if not row:
+        return None
+    user_cache.invalidate(row['user_id'])
+    return dict(row)
+
+@db_query
+async def approve_cashback_requests_bulk(admin_id, limit, max_amount=None):
+    """Bir nechta so'rovni bitta tranzaksiyada tasdiqlash
+    
+    Eng eski `limit` ta ochiq so'rov (max_amount berilsa - shu summagacha bo'lganlari)
+    tanlanadi; boshqa admin band qilganlari o'tkazib yuboriladi. Foydalanuvchi qatorlari
+    user_id tartibida qulflanadi - ikki parallel ommaviy tasdiqlash deadlock bermaydi.
+    Barcha tarix qatorlari bitta INSERT, balanslar esa foydalanuvchi bo'yicha bitta
+    UPDATE bilan yoziladi. Har bir so'rov uchun shu so'rovdan keyingi balans qaytariladi.
+    """
+    global db_pool
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            decided = await conn.fetch(f'''
+                WITH picked AS (
+                    SELECT id, (1 + floor(random() * 5))::INTEGER AS percent
+                    FROM cashback_requests
+                    WHERE {open_request_condition('$1', '$2')}
+                      AND ($4::INTEGER IS NULL OR amount <= $4)
+                    ORDER BY created_at, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT $3
+                )
+                UPDATE cashback_requests r
+                SET status = 'approved', 
+                    percent = p.percent,
+                    cashback = (r.amount::BIGINT * p.percent / 100)::INTEGER,
+                    decided_by = $1, 
+                    decided_at = CURRENT_TIMESTAMP
+                FROM picked p 
+                WHERE r.id = p.id
+                RETURNING r.id, r.user_id
+            ''', admin_id, CASHBACK_CLAIM_TIMEOUT, limit, max_amount)
+            if not decided:
+                return []
+            
+            # UPDATE ... FROM qatorlarni ixtiyoriy tartibda qulflaydi - avval tartib bilan
+            await conn.execute('''
+                SELECT user_id FROM users 
+                WHERE user_id = ANY($1::BIGINT[]) 
+                ORDER BY user_id 
+                FOR UPDATE
+            ''', sorted({row['user_id'] for row in decided}))
+            
+            rows = await conn.fetch('''
+                WITH decided AS (
+                    SELECT id, user_id, amount, percent, cashback 
+                    FROM cashback_requests WHERE id = ANY($1::INTEGER[])
+                ),
+                totals AS (
+                    SELECT user_id, SUM(cashback) AS total FROM decided GROUP BY user_id
+                ),
+                updated AS (
+                    UPDATE users u 
+                    SET cashback_balance = u.cashback_balance + t.total
+                    FROM totals t 
+                    WHERE u.user_id = t.user_id
+                    RETURNING u.user_id, u.cashback_balance, COALESCE(u.language, 'uz') AS language
+                ),
+                history AS (
+                    INSERT INTO cashback_history (user_id, amount, percent, cashback, type) 
+                    SELECT user_id, amount, percent, cashback, 'purchase' FROM decided ORDER BY id
+                )
+                SELECT d.id, d.user_id, d.amount, d.percent, d.cashback, u.language,
+                       u.cashback_balance - COALESCE(SUM(d.cashback) OVER (
+                           PARTITION BY d.user_id ORDER BY d.id 
+                           ROWS BETWEEN 1 FOLLOWING AND UNBOUNDED FOLLOWING
+                       ), 0) AS balance
+                FROM decided d 
+                JOIN updated u ON u.user_id = d.user_id
+                ORDER BY d.id
+            ''', [row['id'] for row in decided])
+    
+    results = [dict(row) for row in rows]
+    for row in results:
+        user_cache.invalidate(row['user_id'])
+    return results
+
+@db_query
+async def reject_cashback_request(request_id, admin_id):
+    """So'rovni rad etish; allaqachon ko'rib chiqilgan bo'lsa None"""
+    global db_pool
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow(f'''
+            WITH req AS (
+                SELECT id FROM cashback_requests
+                WHERE id = $1 AND {open_request_condition('$2', '$3')}
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE cashback_requests r
+            SET status = 'rejected', decided_by = $2, decided_at = CURRENT_TIMESTAMP
+            FROM req, users u
+            WHERE r.id = req.id AND u.user_id = r.user_id
+            RETURNING r.user_id, COALESCE(u.language, 'uz') AS language
+        ''', request_id, admin_id, CASHBACK_CLAIM_TIMEOUT)
+        return dict(row) if row else None
+
+
+# ==================== FSM STORAGE ====================
+class PostgresStorage(BaseStorage):
+    """FSM holatlarini PostgreSQL da saqlash (db_pool orqali)
+    
+    Har bir (bot, chat, user) uchun bitta qator: state, JSONB data va expires_at.
+    Tez-tez o'qiladigan kalitlar qisqa muddat jarayon ichidagi keshda turadi
+    (har bir update da aiogram get_state chaqiradi). Bu kesh faqat bitta instans uchun
+    to'g'ri: MULTI_INSTANCE=1 da u o'chiriladi (cache_ttl=0) va har bir o'qish bazadan,
+    aks holda bir instans boshqasi allaqachon almashtirgan holatni berib, FSM qadami
+    orqaga ketishi mumkin edi.
+    """
+
+    def __init__(self, ttl=FSM_TTL, cache_size=FSM_CACHE_SIZE, cache_ttl=FSM_CACHE_TTL):
+        self.ttl = ttl
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    @staticmethod
+    def _key(key):
+        return key.bot_id, key.chat_id, key.user_id
+
+    @db_query
+    async def _load(self, key):
+        """(state, data) ni keshdan yoki bazadan olish"""
+        cache_key = self._key(key)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        async with db_pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT state, data FROM fsm_storage 
+                WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 
+                  AND expires_at > (NOW() AT TIME ZONE 'UTC')
+            ''', *cache_key)
+        
+        record = (row['state'], json.loads(row['data'])) if row else (None, {})
+        self.cache.set(cache_key, record)
+        return record
+
+    @db_query
+    async def _delete(self, cache_key):
+        async with db_pool.acquire() as conn:
+            await conn.execute(
+                'DELETE FROM fsm_storage WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3',
+                *cache_key
+            )
+        self.cache.set(cache_key, (None, {}))
+
+    @db_query
+    async def set_state(self, key, state=None):
+        cache_key = self._key(key)
+        state = state.state if isinstance(state, State) else state
+        cached = self.cache.get(cache_key)
+        
+        # state.clear() - ma'lumot ham bo'sh bo'lsa qatorni o'chirib yuboramiz
+        if state is None and cached is not None and not cached[1]:
+            await self._delete(cache_key)
+            return
+        
+        async with db_pool.acquire() as conn:
+            data = await conn.fetchval('''
+                INSERT INTO fsm_storage (bot_id, chat_id, user_id, state, expires_at)
+                VALUES ($1, $2, $3, $4, (NOW() AT TIME ZONE 'UTC') + $5 * INTERVAL '1 second')
+                ON CONFLICT (bot_id, chat_id, user_id) DO UPDATE 
+                SET state = EXCLUDED.state,
+                    data = CASE WHEN fsm_storage.expires_at > (NOW() AT TIME ZONE 'UTC') 
+                                THEN fsm_storage.data ELSE '{}' END,
+                    expires_at = EXCLUDED.expires_at
+                RETURNING data
+            ''', *cache_key, state, self.ttl)
+        self.cache.set(cache_key, (state, json.loads(data)))
+
+    async def get_state(self, key):
+        state, _ = await self._load(key)
+        return state
+
+    @db_query
+    async def set_data(self, key, data):
+        cache_key = self._key(key)
+        data = dict(data)
+        cached = self.cache.get(cache_key)
+        
+        if not data and cached is not None and cached[0] is None:
+            await self._delete(cache_key)
+            return
+        
+        async with db_pool.acquire() as conn:
+            state = await conn.fetchval('''
+                INSERT INTO fsm_storage (bot_id, chat_id, user_id, data, expires_at)
+                VALUES ($1, $2, $3, $4::jsonb, (NOW() AT TIME ZONE 'UTC') + $5 * INTERVAL '1 second')
+                ON CONFLICT (bot_id, chat_id, user_id) DO UPDATE 
+                SET data = EXCLUDED.data,
+                    state = CASE WHEN fsm_storage.expires_at > (NOW() AT TIME ZONE 'UTC') 
+                                 THEN fsm_storage.state END,
+                    expires_at = EXCLUDED.expires_at
+                RETURNING state
+            ''', *cache_key, json.dumps(data), self.ttl)
+        self.cache.set(cache_key, (state, data))
+
+    async def get_data(self, key):
+        _, data = await self._load(key)
+        return dict(data)
+
+    async def close(self):
+        self.cache.clear()
+
+@db_query
+async def flush_abandoned_registrations(conn):
+    """Tashlab ketilgan ro'yxatdan o'tishlar: FSM dagi tanlangan tilni users ga yozish
+    
+    Til endi faqat telefon kelganda (complete_registration) yoziladi. Oxirgi FSM
+    yozuvidan REGISTRATION_ABANDON_TIMEOUT o'tgan bo'lsa, til baribir saqlanadi.
+    """
+    rows = await conn.fetch('''
+        UPDATE users u 
+        SET language = f.data->>'language'
+        FROM fsm_storage f
+        WHERE f.user_id = u.user_id
+          AND f.state LIKE 'Registration:%'
+          AND f.data ? 'language'
+          AND f.expires_at < (NOW() AT TIME ZONE 'UTC') + ($1 - $2) * INTERVAL '1 second'
+          AND u.registered = 0
+          AND u.language IS DISTINCT FROM f.data->>'language'
+        RETURNING u.user_id
+    ''', FSM_TTL, REGISTRATION_ABANDON_TIMEOUT)
+    for row in rows:
+        user_cache.invalidate(row['user_id'])
+
+async def fsm_cleanup_loop():
+    """Fonda: tashlab ketilgan ro'yxatdan o'tishlar tilini saqlash, muddati o'tgan va bo'sh FSM qatorlarini o'chirish"""
+    global db_pool
+    while True:
+        await asyncio.sleep(FSM_CLEANUP_INTERVAL)
+        try:
+            async with db_pool.acquire() as conn:
+                await flush_abandoned_registrations(conn)
+                await conn.execute('''
+                    DELETE FROM fsm_storage 
+                    WHERE expires_at < (NOW() AT TIME ZONE 'UTC') 
+                       OR (state IS NULL AND data = '{}')
+                ''')
+        except Exception as e:
+            logging.error(f"FSM qatorlarini tozalashda xato: {e}")
+
+
 # ==================== TEXTS ====================
 TEXTS = {
     'uz': {
@@ -411,6 +1913,11 @@ Biz orqali qilgan har bir xaridingiz sizga foyda keltiradi.
         'admin_delete_success': "✅ Foydalanuvchi muvaffaqiyatli o'chirildi!",
         'admin_delete_error': "❌ O'chirishda xatolik yuz berdi!",
         'admin_delete_cancel': "❌ O'chirish bekor qilindi.",
+        
+        # Admin Search
+        'admin_search_title': "🔍 <b>Foydalanuvchini qidirish</b>\n\nTelefon raqami, ism qismi yoki ID kiriting:\nMisol: <code>90123</code>, <code>Aziz</code>\n\n❌ Bekor qilish uchun /cancel",
+        'admin_search_short': "❌ Kamida 3 ta belgi kiriting:",
+        'admin_search_results': "🔍 <b>Qidiruv natijalari</b>: <code>{query}</code>\n\nTopildi: <b>{count}</b> ta",
         # Admin Stats
         'admin_stats_title': "📊 <b>Umumiy Statistika</b>",
         'admin_stats_weekly': "📈 Oxirgi 7 kun:",
@@ -418,7 +1925,8 @@ Biz orqali qilgan har bir xaridingiz sizga foyda keltiradi.
         # Admin Broadcast
         'admin_broadcast_title': "📢 <b>Barcha foydalanuvchilarga xabar yuborish</b>\n\nXabaringizni kiriting (matn, rasm yoki video):\n\n❌ Bekor qilish uchun /cancel",
         'admin_broadcast_confirm': "❓Ushbu xabarni barcha foydalanuvchilarga yuborishni xohlaysizmi?",
-        'admin_broadcast_sent': "✅ <b>Yuborildi!</b>\n\n✔️ Muvaffaqiyatli: <b>{sent}</b> ta\n❌ Muvaffaqiyatsiz: <b>{failed}</b> ta",
+        'admin_broadcast_sent': "✅ <b>Yuborildi!</b>\n\n✔️ Muvaffaqiyatli: <b>{sent}</b> ta\n❌ Muvaffaqiyatsiz: <b>{failed}</b> ta\n\n🚫 Bloklagan: <b>{blocked}</b>\n👻 O'chirilgan akkaunt: <b>{deactivated}</b>\n⚠️ Boshqa xatolar: <b>{errors}</b>\n⏱ Vaqt: <b>{elapsed}</b> s",
+        'admin_broadcast_progress': "⏳ <b>Yuborilmoqda...</b>\n\n📨 {processed} / {total}\n⚡️ {rate} xabar/s",
         'admin_broadcast_cancel': "❌ Xabar yuborish bekor qilindi.",
         
         # Admin Deduct
@@ -478,6 +1986,9 @@ Siz hali xarid amalga oshirmagansiz.""",
         'type_referral': "👤 Referral bonus",
         'type_admin_bonus': "🎁 Admin bonus",
         'type_admin_deduct': "➖ Admin ayirish",
+        'page_prev': "⬅️ Oldingi",
+        'page_next': "Keyingi ➡️",
+        'slow_down': "⏳ Juda tez! Iltimos, biroz kuting.",
     },
     
     'ru': {
@@ -536,6 +2047,11 @@ Siz hali xarid amalga oshirmagansiz.""",
         'admin_delete_error': "❌ Ошибка при удалении!",
         'admin_delete_cancel': "❌ Удаление отменено.",
         
+        # Admin Search
+        'admin_search_title': "🔍 <b>Поиск пользователя</b>\n\nВведите номер телефона, часть имени или ID:\nПример: <code>90123</code>, <code>Aziz</code>\n\n❌ Отменить /cancel",
+        'admin_search_short': "❌ Введите минимум 3 символа:",
+        'admin_search_results': "🔍 <b>Результаты поиска</b>: <code>{query}</code>\n\nНайдено: <b>{count}</b>",
+        
         # Admin Stats
         'admin_stats_title': "📊 <b>Общая статистика</b>",
         'admin_stats_weekly': "📈 Последние 7 дней:",
@@ -543,7 +2059,8 @@ Siz hali xarid amalga oshirmagansiz.""",
         # Admin Broadcast
         'admin_broadcast_title': "📢 <b>Отправить сообщение всем пользователям</b>\n\nВведите сообщение (текст, фото или видео):\n\n❌ Отменить /cancel",
         'admin_broadcast_confirm': "❓Отправить это сообщение всем пользователям?",
-        'admin_broadcast_sent': "✅ <b>Отправлено!</b>\n\n✔️ Успешно: <b>{sent}</b>\n❌ Неудачно: <b>{failed}</b>",
+        'admin_broadcast_sent': "✅ <b>Отправлено!</b>\n\n✔️ Успешно: <b>{sent}</b>\n❌ Неудачно: <b>{failed}</b>\n\n🚫 Заблокировали: <b>{blocked}</b>\n👻 Удалённые аккаунты: <b>{deactivated}</b>\n⚠️ Другие ошибки: <b>{errors}</b>\n⏱ Время: <b>{elapsed}</b> с",
+        'admin_broadcast_progress': "⏳ <b>Отправка...</b>\n\n📨 {processed} / {total}\n⚡️ {rate} сообщ./с",
         'admin_broadcast_cancel': "❌ Отправка отменена.",
         
         # Admin Deduct
@@ -603,6 +2120,9 @@ Siz hali xarid amalga oshirmagansiz.""",
         'type_referral': "👤 Реферальный бонус",
         'type_admin_bonus': "🎁 Бонус от админа",
         'type_admin_deduct': "➖ Вычет админа",
+        'page_prev': "⬅️ Предыдущие",
+        'page_next': "Следующие ➡️",
+        'slow_down': "⏳ Слишком часто! Пожалуйста, подождите.",
     }
 }
 
@@ -643,6 +2163,9 @@ class BroadcastState(StatesGroup):
 class AdminDeductState(StatesGroup):
     waiting_for_amount = State()
 
+class AdminSearchState(StatesGroup):
+    waiting_for_query = State()
+
 # ==================== KEYBOARDS ====================
 def language_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -701,32 +2224,107 @@ def admin_main_keyboard():
     """Admin paneli uchun menyu"""
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="👥 Foydalanuvchilar", callback_data="admin_panel_users")],
+        [InlineKeyboardButton(text="🔍 Qidirish", callback_data="admin_search")],
+        [InlineKeyboardButton(text="🧾 Keshbek navbati", callback_data="admin_cashback_queue")],
+        [InlineKeyboardButton(text="📊 Statistika", callback_data="admin_stats")],
         [InlineKeyboardButton(text="📢 Xabar yuborish", callback_data="admin_broadcast")],
     ])
 
-async def admin_users_keyboard():
-    """Admin panel - foydalanuvchilar ro'yxati"""
-    users = await get_all_users()
-    buttons = []
+EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(created_at, row_id):
+    """Keyset kursorini callback_data uchun qisqa satrga aylantirish"""
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1)}_{row_id}"
+
+def decode_cursor(value):
+    """callback_data dagi kursorni (created_at, id) ga qaytarish"""
+    micros, row_id = value.split("_")
+    return EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+
+def page_flags(cursor, direction, has_more):
+    """Sahifa uchun (oldingi bor, keyingi bor) juftligi"""
+    if cursor is not None and direction == 'prev':
+        return has_more, True
+    return cursor is not None, has_more
+
+def page_nav_row(prefix, first_cursor, last_cursor, has_prev, has_next, prev_text="⬅️ Oldingi", next_text="Keyingi ➡️"):
+    """Sahifalash tugmalari: {prefix}prev_{kursor} va {prefix}next_{kursor}"""
+    nav_buttons = []
+    if has_prev:
+        nav_buttons.append(InlineKeyboardButton(text=prev_text, callback_data=f"{prefix}prev_{first_cursor}"))
+    if has_next:
+        nav_buttons.append(InlineKeyboardButton(text=next_text, callback_data=f"{prefix}next_{last_cursor}"))
+    return nav_buttons
+
+def admin_user_button(user_id, name, phone, balance, first_name, last_name):
+    """Admin ro'yxatlari uchun bitta foydalanuvchi tugmasi"""
+    display_name = name if name else f"{first_name} {last_name if last_name else ''}".strip()
+    if not display_name:
+        display_name = f"User {user_id}"
     
-    for user in users:
-        user_id, name, phone, balance, first_name, last_name = user
-        display_name = name if name else f"{first_name} {last_name if last_name else ''}".strip()
-        if not display_name:
-            display_name = f"User {user_id}"
-        
-        buttons.append([InlineKeyboardButton(
-            text=f"{display_name} | {format_number(balance)} so'm",
-            callback_data=f"admin_user_{user_id}"
-        )])
+    return InlineKeyboardButton(
+        text=f"{display_name} | {format_number(balance)} so'm",
+        callback_data=f"admin_user_{user_id}"
+    )
+
+def admin_search_results_keyboard(users):
+    """Admin - qidiruv natijalari"""
+    buttons = [[admin_user_button(*user)] for user in users]
+    
+    if not buttons:
+        buttons.append([InlineKeyboardButton(text="❌ Hech narsa topilmadi", callback_data="admin_empty")])
+    
+    buttons.append([InlineKeyboardButton(text="🔍 Yangi qidiruv", callback_data="admin_search")])
+    buttons.append([InlineKeyboardButton(text="◀️ Asosiy menyu", callback_data="admin_main_menu")])
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def admin_users_keyboard(cursor=None, direction='next'):
+    """Admin panel - foydalanuvchilar ro'yxati (sahifalab)"""
+    users, has_more = await get_users_page(cursor, direction)
+    
+    if not users and cursor is not None:
+        # Kursor eskirgan bo'lsa (masalan, foydalanuvchilar o'chirilgan) - birinchi sahifa
+        cursor = None
+        users, has_more = await get_users_page()
+    
+    has_prev, has_next = page_flags(cursor, direction, has_more)
+    
+    buttons = [[admin_user_button(*user[:6])] for user in users]
     
     if not buttons:
         buttons.append([InlineKeyboardButton(text="❌ Foydalanuvchilar yo'q", callback_data="admin_empty")])
     
+    if users:
+        nav_buttons = page_nav_row(
+            "admin_users_",
+            encode_cursor(users[0][6], users[0][0]),
+            encode_cursor(users[-1][6], users[-1][0]),
+            has_prev, has_next
+        )
+        if nav_buttons:
+            buttons.append(nav_buttons)
+    
     buttons.append([InlineKeyboardButton(text="◀️ Asosiy menyu", callback_data="admin_main_menu")])
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+def history_keyboard(lang, history, has_prev, has_next):
+    """Xaridlar tarixi - sahifalash va orqaga tugmalari"""
+    buttons = []
+    if history:
+        nav_buttons = page_nav_row(
+            "history_",
+            encode_cursor(history[0][3], history[0][5]),
+            encode_cursor(history[-1][3], history[-1][5]),
+            has_prev, has_next,
+            TEXTS[lang]['page_prev'], TEXTS[lang]['page_next']
+        )
+        if nav_buttons:
+            buttons.append(nav_buttons)
+    buttons.append([InlineKeyboardButton(text=TEXTS[lang]['back'], callback_data='main_menu')])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
 def admin_user_actions_keyboard(user_id, lang='uz'):
     """Admin - foydalanuvchi ma'lumotlari va amallar"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -749,12 +2347,577 @@ def stats_keyboard():
         [InlineKeyboardButton(text="◀️ Orqaga", callback_data="admin_main_menu")]
     ])
 
+# ==================== BROADCAST ENGINE ====================
+class TokenBucket:
+    """Token-bucket limiter: retry_after kelganda to'xtaydi va tezlikni kamaytiradi"""
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def backoff(self, retry_after):
+        """Telegram retry_after qaytarganda: hammani to'xtatish va tezlikni kamaytirish"""
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        self._tokens = 0
+        self.rate = max(1.0, self.rate * 0.8)
+
+    def recover(self):
+        """Muvaffaqiyatli yuborishdan keyin tezlikni asta-sekin tiklash"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + 0.05)
+
+# Bot nomidan boshqa foydalanuvchilarga yuboriladigan BARCHA xabarlar uchun bitta limiter:
+# bir vaqtda ishlayotgan broadcastlar va bildirishnomalar birgalikda ~30 xabar/s chegarasidan
+# oshmasin, bittasiga kelgan 429 qolganlarini ham sekinlashtirsin.
+outbound_limiter = TokenBucket(BROADCAST_RATE)
+
+
+async def send_broadcast_message(bot, chat_id, data):
+    """Bitta foydalanuvchiga broadcast xabarini yuborish"""
+    if data['message_type'] == 'text':
+        await bot.send_message(chat_id, data['content'])
+    elif data['message_type'] == 'photo':
+        await bot.send_photo(chat_id, data['content'], caption=data.get('caption'))
+    elif data['message_type'] == 'video':
+        await bot.send_video(chat_id, data['content'], caption=data.get('caption'))
+
+
+class BroadcastLeaseLost(Exception):
+    """Broadcast ijarasi boshqa instansga o'tgan: bu instans yuborishni to'xtatadi"""
+
+
+class Broadcast:
+    """Fon rejimida ishlaydigan broadcast: bir nechta parallel yuboruvchi + umumiy limiter.
+    
+    Oluvchilar bazadan to'plam-to'plam o'qiladi. Har checkpoint_size ta natijadan
+    keyin ular broadcast_deliveries ga yoziladi (checkpoint), shuning uchun qulashdan
+    keyin ko'pi bilan shuncha (va yo'ldagi) xabar qayta yuboriladi.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, bot, job, concurrency=BROADCAST_CONCURRENCY, limiter=None,
+                 batch_size=BROADCAST_BATCH_SIZE, checkpoint_size=BROADCAST_CHECKPOINT_SIZE):
+        self.bot = bot
+        self.job_id = job['id']
+        self.owner = job['owner']
+        self.data = {
+            'message_type': job['message_type'],
+            'content': job['content'],
+            'caption': job['caption']
+        }
+        self.created_at = job['created_at']
+        self.last_user_id = job['last_user_id'] or 0
+        self.status_chat_id = job['status_chat_id']
+        self.status_message_id = job['status_message_id']
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.checkpoint_size = checkpoint_size
+        self.limiter = limiter or outbound_limiter
+        self.total = job['total']
+        self.sent = job['sent']
+        self.blocked = job['blocked']
+        self.deactivated = job['deactivated']
+        self.errors = job['errors']
+        self.retries = 0
+        self._save_lock = asyncio.Lock()
+        self._processed_at_start = self.processed
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def processed(self):
+        return self.sent + self.blocked + self.deactivated + self.errors
+
+    @property
+    def failed(self):
+        return self.blocked + self.deactivated + self.errors
+
+    def counters(self):
+        return {
+            'sent': self.sent,
+            'blocked': self.blocked,
+            'deactivated': self.deactivated,
+            'errors': self.errors
+        }
+
+    def rate(self):
+        return (self.processed - self._processed_at_start) / max(self.elapsed(), 0.001)
+
+    async def _send(self, chat_id):
+        """Bitta oluvchiga yuborish, natija: sent / blocked / deactivated / error"""
+        for attempt in range(self.MAX_ATTEMPTS):
+            await self.limiter.acquire()
+            try:
+                await send_broadcast_message(self.bot, chat_id, self.data)
+                self.limiter.recover()
+                return 'sent'
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                self.limiter.backoff(e.retry_after)
+            except TelegramForbiddenError as e:
+                if 'deactivated' in e.message:
+                    return 'deactivated'
+                return 'blocked'
+            except (TelegramNetworkError, TelegramServerError) as e:
+                self.retries += 1
+                logging.error(f"Xabar yuborishda vaqtinchalik xato {chat_id}: {e}")
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logging.error(f"Xabar yuborishda xato {chat_id}: {e}")
+                return 'error'
+        return 'error'
+
+    def _count(self, status):
+        if status == 'sent':
+            self.sent += 1
+        elif status == 'blocked':
+            self.blocked += 1
+        elif status == 'deactivated':
+            self.deactivated += 1
+        else:
+            self.errors += 1
+
+    async def _worker(self, queue, results):
+        while True:
+            chat_id = await queue.get()
+            try:
+                status = await self._send(chat_id)
+                self._count(status)
+                results[chat_id] = status
+                if self.checkpoint_size and len(results) >= self.checkpoint_size:
+                    await self._checkpoint(results)
+            finally:
+                queue.task_done()
+
+    async def _checkpoint(self, results, last_user_id=None):
+        """Yig'ilgan natijalarni saqlash (results bo'shatiladi); ijara yo'qolgan bo'lsa BroadcastLeaseLost"""
+        # Natijalar va hisoblagichlar bir paytda olinadi - ular bir-biriga mos keladi
+        pending = dict(results)
+        results.clear()
+        counters = self.counters()
+        async with self._save_lock:
+            owned = await save_broadcast_progress(self.job_id, self.owner, pending, counters, last_user_id)
+        if not owned:
+            raise BroadcastLeaseLost(f"Broadcast #{self.job_id} boshqa instansga o'tgan")
+
+    async def _run_batch(self, user_ids, results):
+        queue = asyncio.Queue()
+        for chat_id in user_ids:
+            queue.put_nowait(chat_id)
+        
+        workers = [asyncio.create_task(self._worker(queue, results)) for _ in range(self.concurrency)]
+        joined = asyncio.create_task(queue.join())
+        try:
+            # Ishchi faqat xato bilan tugaydi (checkpoint, ijara) - unda butun to'plam to'xtaydi
+            await asyncio.wait([joined, *workers], return_when=asyncio.FIRST_COMPLETED)
+            for worker in workers:
+                if worker.done():
+                    worker.result()
+        finally:
+            joined.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(joined, *workers, return_exceptions=True)
+
+    async def run(self):
+        self.started_at = time.monotonic()
+        try:
+            while True:
+                user_ids = await get_broadcast_batch(
+                    self.job_id, self.last_user_id, self.created_at, self.batch_size
+                )
+                if not user_ids:
+                    break
+                
+                results = {}
+                try:
+                    await self._run_batch(user_ids, results)
+                except asyncio.CancelledError:
+                    # To'xtatilganda (deploy) - yuborilganlarni saqlab, ijarani bo'shatish
+                    await self._checkpoint(results)
+                    await release_broadcast_job(self.job_id, self.owner)
+                    raise
+                
+                self.last_user_id = user_ids[-1]
+                await self._checkpoint(results, self.last_user_id)
+            
+            await finish_broadcast_job(self.job_id, self.owner)
+        finally:
+            self.finished_at = time.monotonic()
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+async def send_notifications(bot, messages, concurrency=BROADCAST_CONCURRENCY, limiter=None):
+    """Har xil foydalanuvchilarga shaxsiy xabarlarni parallel yuborish
+    
+    messages: [(chat_id, text), ...]. Broadcast bilan bir xil (umumiy) limiter va
+    qayta urinish qoidalari ishlatiladi. Natija: yuborilganlar soni.
+    """
+    limiter = limiter or outbound_limiter
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def send(chat_id, text):
+        async with semaphore:
+            for attempt in range(Broadcast.MAX_ATTEMPTS):
+                await limiter.acquire()
+                try:
+                    await bot.send_message(chat_id, text, parse_mode='HTML')
+                    limiter.recover()
+                    return True
+                except TelegramRetryAfter as e:
+                    limiter.backoff(e.retry_after)
+                except TelegramForbiddenError:
+                    return False
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    logging.error(f"Xabar yuborishda vaqtinchalik xato {chat_id}: {e}")
+                    await asyncio.sleep(2 ** attempt)
+                except Exception as e:
+                    logging.error(f"Xabar yuborishda xato {chat_id}: {e}")
+                    return False
+            return False
+    
+    results = await asyncio.gather(*(send(chat_id, text) for chat_id, text in messages))
+    return sum(results)
+
+# Fonda ishlayotgan vazifalar (GC ularni yo'qotmasligi uchun)
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# ==================== UPDATE SCHEDULER ====================
+class UserScheduler(BaseMiddleware):
+    """Update'larni bitta foydalanuvchi (chat) uchun ketma-ket, turli foydalanuvchilar uchun parallel bajarish
+    
+    Dispatcher darajasidagi outer middleware, FSM middleware'idan OLDIN turadi
+    (build_dispatcher ga qarang). Bir foydalanuvchining tez-tez bosishlari kelish
+    tartibida navbatga turadi (asyncio.Lock FIFO) va FSM holati qulf olingandan keyin
+    o'qiladi, shuning uchun FSM o'tishlari (masalan, summa -> rasm) bir-biri bilan
+    poyga qilmaydi. Umumiy semafor bir vaqtda bajariladigan update'lar sonini cheklaydi;
+    navbati max_queue ga yetgan foydalanuvchining yangi update'lari tashlab yuboriladi
+    (callback'ga "sekinroq" javobi beriladi, aks holda tugma "yuklanish"da qoladi).
+    """
+
+    def __init__(self, concurrency=SCHEDULER_CONCURRENCY, max_queue=SCHEDULER_USER_QUEUE):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._queues = {}  # kalit -> [lock, navbatdagi + bajarilayotgan update'lar soni]
+        self.running = 0
+        self.waiting = 0
+        self.dropped = 0
+        self.wait = Histogram()
+
+    @staticmethod
+    def _key(data):
+        user = data.get('event_from_user')
+        chat = data.get('event_chat')
+        if user is None and chat is None:
+            return None
+        return chat.id if chat else None, user.id if user else None
+
+    async def __call__(self, handler, event, data):
+        key = self._key(data)
+        if key is None:
+            return await handler(event, data)
+        
+        entry = self._queues.get(key)
+        if entry is None:
+            entry = self._queues[key] = [asyncio.Lock(), 0]
+        if entry[1] >= self.max_queue:
+            self.dropped += 1
+            await self._answer_dropped(event, data)
+            return None
+        
+        entry[1] += 1
+        self.waiting += 1
+        started = time.perf_counter()
+        acquired = False
+        try:
+            async with entry[0], self.semaphore:
+                self.waiting -= 1
+                acquired = True
+                self.wait.observe(time.perf_counter() - started)
+                self.running += 1
+                try:
+                    return await handler(event, data)
+                finally:
+                    self.running -= 1
+        finally:
+            if not acquired:
+                self.waiting -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._queues[key]
+
+    @staticmethod
+    async def _answer_dropped(event, data):
+        callback = getattr(event, 'callback_query', None)
+        if callback is None:
+            return
+        try:
+            await callback.answer(TEXTS[cached_language(data['event_from_user'])]['slow_down'])
+        except Exception as e:
+            logging.error(f"Tashlangan callback'ga javob berishda xato: {e}")
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'running': self.running,
+            'waiting': self.waiting,
+            'active_users': len(self._queues),
+            'dropped': self.dropped,
+        }
+
+def cached_language(user):
+    """Bazaga bormasdan til: keshdan yoki Telegram language_code dan"""
+    cached = user_cache.get(user.id)
+    if cached is not None and cached.language:
+        return cached.language
+    return 'ru' if (user.language_code or '').startswith('ru') else 'uz'
+
+update_scheduler = UserScheduler()
+
+def build_dispatcher(storage=None, routers=None, scheduler=None):
+    """Dispatcher: PostgreSQL FSM, foydalanuvchi bo'yicha navbat va router
+    
+    aiogram FSM middleware'ni odatda o'zi ro'yxatdan o'tkazadi va u holatni har qanday
+    keyingi outer middleware'dan oldin o'qiydi. Shuning uchun u o'chirilib, navbatdan
+    KEYIN qayta qo'shiladi: holat foydalanuvchi qulfi ostida o'qiladi.
+    """
+    dp = Dispatcher(storage=storage or PostgresStorage(), disable_fsm=True)
+    dp.update.outer_middleware(scheduler or update_scheduler)
+    dp.update.outer_middleware(dp.fsm)
+    dp.include_routers(*(routers or (router,)))
+    return dp
+
+# ==================== THROTTLING ====================
+# Bazaga og'ir boradigan handlerlar uchun standart limitlar: (update/s, burst)
+DEFAULT_HANDLER_LIMITS = {
+    'cmd_start': (0.5, 3),
+    'history_handler': (1, 4),
+    'history_page_handler': (2, 6),
+    'referral_handler': (1, 4),
+}
+
+def parse_handler_limits(text):
+    """Limitlar satrini ("nom=rate/burst,...") {nom: (rate, burst)} ga aylantirish"""
+    limits = dict(DEFAULT_HANDLER_LIMITS)
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, limit = part.partition('=')
+        rate, _, burst = limit.partition('/')
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+THROTTLED = LabeledCounters()
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Foydalanuvchi (va handler) bo'yicha token bucket anti-flood
+    
+    Limitdan oshgan callback arzon answer() bilan, xabar esa bir marta ogohlantirish
+    bilan javob oladi - handler ham, baza ham chaqirilmaydi. Adminlar cheklanmaydi.
+    Holat LRU tartibida saqlanadi: to'liq to'lgan (uzoq vaqt jim turgan) bucket'lar
+    hech qanday ma'lumot saqlamaydi va o'chiriladi, umumiy hajm max_keys dan oshmaydi.
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST,
+                 handler_limits=None, max_keys=THROTTLE_MAX_KEYS):
+        self.default_limit = (rate, burst)
+        self.handler_limits = parse_handler_limits(THROTTLE_HANDLER_LIMITS) if handler_limits is None else handler_limits
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # (user_id, limit nomi) -> [tokens, updated, warned, idle_after]
+
+    def _evict(self, now):
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and now - bucket[1] < bucket[3]:
+                break
+            self._buckets.popitem(last=False)
+
+    def allow(self, user_id, handler_name):
+        """Token bo'lsa True; yo'q bo'lsa False va shu oraliqda birinchi rad etishmi"""
+        name = handler_name if handler_name in self.handler_limits else 'default'
+        rate, burst = self.handler_limits.get(name, self.default_limit)
+        key = (user_id, name)
+        now = time.monotonic()
+        
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now, False, burst / rate]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        self._evict(now)
+        
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True, False
+        first_rejection = not bucket[2]
+        bucket[2] = True
+        return False, first_rejection
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None or is_admin(user.id):
+            return await handler(event, data)
+        
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        allowed, first_rejection = self.allow(user.id, name)
+        if allowed:
+            return await handler(event, data)
+        
+        THROTTLED.inc(name)
+        text = TEXTS[cached_language(user)]['slow_down']
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif first_rejection:
+                await event.answer(text)
+        except Exception as e:
+            logging.error(f"Throttling javobida xato: {e}")
+        return None
+
+    def stats(self):
+        return {'keys': len(self._buckets)}
+
+throttling_middleware = ThrottlingMiddleware()
+
+# ==================== HANDLER METRICS ====================
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Har bir handler (cmd_start, history_handler, ...) uchun ishlash vaqti va xatolar"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY[name].observe(time.perf_counter() - started)
+
+
+def prometheus_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_histograms(lines, metric, label, histograms):
+    """Gistogrammalarni Prometheus text formatida yozish (kumulyativ bucket'lar)"""
+    lines.append(f"# TYPE {metric} histogram")
+    for name, histogram in sorted(histograms.items()):
+        label_value = f'{label}="{prometheus_escape(name)}",' if label else ''
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{label_value}le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{label_value}le="+Inf"}} {histogram.count}')
+        labels = f'{{{label_value.rstrip(",")}}}' if label else ''
+        lines.append(f"{metric}_sum{labels} {histogram.sum}")
+        lines.append(f"{metric}_count{labels} {histogram.count}")
+
+def render_counters(lines, metric, label, counters):
+    lines.append(f"# TYPE {metric} counter")
+    for name, value in sorted(counters.items()):
+        lines.append(f'{metric}{{{label}="{prometheus_escape(name)}"}} {value}')
+
+def render_metrics():
+    """Barcha metrikalar Prometheus text (0.0.4) formatida"""
+    lines = []
+    render_histograms(lines, 'bot_handler_duration_seconds', 'handler', HANDLER_LATENCY)
+    render_counters(lines, 'bot_handler_errors_total', 'handler', HANDLER_ERRORS)
+    render_histograms(lines, 'bot_db_query_duration_seconds', 'query', QUERY_LATENCY)
+    render_counters(lines, 'bot_db_query_errors_total', 'query', QUERY_ERRORS)
+    
+    if db_pool is not None:
+        stats = db_pool.stats()
+        for key in ('size', 'max_size', 'idle', 'in_use', 'waiting'):
+            lines.append(f"# TYPE bot_db_pool_{key} gauge")
+            lines.append(f"bot_db_pool_{key} {stats[key]}")
+        for key in ('acquires', 'timeouts'):
+            lines.append(f"# TYPE bot_db_pool_{key}_total counter")
+            lines.append(f"bot_db_pool_{key}_total {stats[key]}")
+        render_histograms(lines, 'bot_db_pool_acquire_seconds', None, {'': db_pool.acquire_wait})
+    
+    render_counters(lines, 'bot_single_flight_calls_total', 'function', SINGLE_FLIGHT_CALLS)
+    render_counters(lines, 'bot_single_flight_coalesced_total', 'function', SINGLE_FLIGHT_COALESCED)
+    render_counters(lines, 'bot_throttled_total', 'handler', THROTTLED)
+    lines.append("# TYPE bot_throttle_keys gauge")
+    lines.append(f"bot_throttle_keys {throttling_middleware.stats()['keys']}")
+    
+    scheduler = update_scheduler.stats()
+    for key in ('concurrency', 'running', 'waiting', 'active_users'):
+        lines.append(f"# TYPE bot_scheduler_{key} gauge")
+        lines.append(f"bot_scheduler_{key} {scheduler[key]}")
+    lines.append("# TYPE bot_scheduler_dropped_total counter")
+    lines.append(f"bot_scheduler_dropped_total {scheduler['dropped']}")
+    render_histograms(lines, 'bot_scheduler_wait_seconds', None, {'': update_scheduler.wait})
+    
+    cache = user_cache.stats()
+    lines.append("# TYPE bot_user_cache_size gauge")
+    lines.append(f"bot_user_cache_size {cache['size']}")
+    for key in ('hits', 'misses', 'evictions'):
+        lines.append(f"# TYPE bot_user_cache_{key}_total counter")
+        lines.append(f"bot_user_cache_{key}_total {cache[key]}")
+    
+    return "\n".join(lines) + "\n"
+
+async def metrics_handler(request):
+    return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
+
+async def start_metrics_server():
+    """Lokal /metrics endpoint (Prometheus uchun); METRICS_PORT=0 bo'lsa ishga tushmaydi"""
+    if not METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=METRICS_HOST, port=METRICS_PORT).start()
+    logging.info(f"Metrikalar: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
 # ==================== ROUTER ====================
 router = Router()
+router.message.middleware(throttling_middleware)
+router.callback_query.middleware(throttling_middleware)
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
 
 def is_admin(user_id):
     """Foydalanuvchi admin ekanligini tekshirish"""
-    return user_id == ADMIN_ID
+    return user_id in ADMIN_IDS
 
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext, bot: Bot):
@@ -782,37 +2945,21 @@ async def cmd_start(message: Message, state: FSMContext, bot: Bot):
         except:
             referred_by = None
     
-    user_data = await get_user(user.id)
+    result = await start_user(user.id, user.username, user.first_name, user.last_name, referred_by)
     
-    if not user_data:
-        await create_user(user.id, user.username, user.first_name, user.last_name, referred_by)
+    if result['is_new'] and result['referrer_language']:
+        if result['bonus'] > 0:
+            referrer_lang = result['referrer_language']
+            inviter_text = TEXTS[referrer_lang]['referral_success_inviter'].format(
+                bonus=format_number(result['bonus']),
+                balance=format_number(result['referrer_balance'])
+            )
+            run_in_background(send_notifications(bot, [(referred_by, inviter_text)]))
         
-        if referred_by and await get_user(referred_by):
-            referrer_balance = await get_cashback_balance(referred_by)
-            bonus = int(referrer_balance * 0.01)
-            
-            if bonus > 0:
-                new_balance = await add_referral_bonus(referred_by, bonus)
-                
-                if new_balance is not None:
-                    referrer_lang = (await get_user(referred_by))[6] if await get_user(referred_by) else 'uz'
-                    try:
-                        await bot.send_message(
-                            referred_by,
-                            TEXTS[referrer_lang]['referral_success_inviter'].format(
-                                bonus=format_number(bonus),
-                                balance=format_number(new_balance)
-                            ),
-                            parse_mode='HTML'
-                        )
-                    except Exception as e:
-                        logging.error(f"Referral xabar yuborishda xato: {e}")
-            
-            user_lang = (await get_user(user.id))[6] if await get_user(user.id) else 'uz'
-            await message.answer(TEXTS[user_lang]['referral_success_user'])
+        await message.answer(TEXTS[result['language']]['referral_success_user'])
     
-    if user_data and user_data[7] == 1:
-        lang = user_data[6]
+    if result['registered'] == 1:
+        lang = result['language']
         await message.answer(
             TEXTS[lang]['welcome'], 
             reply_markup=main_menu_inline(lang),
@@ -820,11 +2967,79 @@ async def cmd_start(message: Message, state: FSMContext, bot: Bot):
         )
         return
     
-    if not user_data or user_data[7] == 0:
-        await state.set_state(Registration.language)
-        await message.answer(TEXTS['uz']['choose_language'], reply_markup=language_keyboard())
+    await state.set_state(Registration.language)
+    await message.answer(TEXTS['uz']['choose_language'], reply_markup=language_keyboard())
 
 # ==================== ADMIN HANDLERS ====================
+@router.message(Command("cache"))
+async def admin_cache_stats(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    
+    stats = user_cache.stats()
+    await message.answer(
+        f"""🗄 <b>Foydalanuvchi keshi</b>
+
+📦 Hajm: <b>{stats['size']}</b> / {stats['maxsize']}
+✅ Hit: <b>{stats['hits']}</b>
+❌ Miss: <b>{stats['misses']}</b>
+♻️ Chiqarilgan: <b>{stats['evictions']}</b>
+🎯 Hit rate: <b>{stats['hit_rate']:.1f}%</b>""",
+        parse_mode='HTML'
+    )
+
+@router.message(Command("pool"))
+async def admin_pool_stats(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    
+    stats = db_pool.stats()
+    wait = stats['wait']
+    await message.answer(
+        f"""🔌 <b>Baza ulanishlari (pool)</b>
+
+📦 Ulanishlar: <b>{stats['size']}</b> ({stats['min_size']}–{stats['max_size']})
+🟢 Band: <b>{stats['in_use']}</b>
+⚪️ Bo'sh: <b>{stats['idle']}</b>
+⏳ Navbatda: <b>{stats['waiting']}</b>
+⛔️ Timeout: <b>{stats['timeouts']}</b> / {stats['acquires']}
+
+⏱ Kutish: o'rtacha {wait['avg'] * 1000:.1f} ms, p95 {wait['p95'] * 1000:.1f} ms, p99 {wait['p99'] * 1000:.1f} ms, max {wait['max'] * 1000:.1f} ms""",
+        parse_mode='HTML'
+    )
+
+@router.message(Command("slow"))
+async def admin_slow_queries(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    
+    if not DB_PROFILE:
+        await message.answer("ℹ️ Profil o'chirilgan. Yoqish uchun: <code>DB_PROFILE=1</code>", parse_mode='HTML')
+        return
+    
+    parts = message.text.split()
+    limit = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
+    top = query_profile.top(min(limit, 30))
+    if not top:
+        await message.answer("ℹ️ Hali so'rovlar yo'q")
+        return
+    
+    text = f"🐢 <b>Eng sekin so'rovlar</b> (sekin chegara: {DB_SLOW_QUERY_MS:.0f} ms)\n"
+    for i, item in enumerate(top, 1):
+        entry = (
+            f"\n<b>{i}. {html.escape(item['name'])}</b>\n"
+            f"max {item['max'] * 1000:.1f} ms, o'rtacha {item['total'] / item['count'] * 1000:.1f} ms, "
+            f"{item['count']} marta, {item['rows'] / item['count']:.1f} qator, "
+            f"pool {item['pool_wait'] / item['count'] * 1000:.1f} ms\n"
+            f"<code>{html.escape(item['shape'][:300])}</code>\n"
+        )
+        # Telegram xabari 4096 belgidan oshmasligi kerak
+        if len(text) + len(entry) > 4000:
+            break
+        text += entry
+    
+    await message.answer(text, parse_mode='HTML')
+
 @router.callback_query(F.data == "admin_main_menu")
 async def admin_main_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
@@ -855,6 +3070,22 @@ async def admin_panel_handler(callback: CallbackQuery, state: FSMContext):
         parse_mode='HTML'
     )
 
+@router.callback_query(F.data.startswith("admin_users_next_") | F.data.startswith("admin_users_prev_"))
+async def admin_users_page_handler(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
+        return
+    
+    direction, value = callback.data.replace("admin_users_", "").split("_", 1)
+    
+    await callback.answer()
+    
+    await callback.message.edit_text(
+        "👥 <b>Foydalanuvchilar ro'yxati:</b>",
+        reply_markup=await admin_users_keyboard(decode_cursor(value), direction),
+        parse_mode='HTML'
+    )
+
 @router.callback_query(F.data.startswith("admin_user_"))
 async def admin_user_details(callback: CallbackQuery):
     if not is_admin(callback.from_user.id):
@@ -862,7 +3093,7 @@ async def admin_user_details(callback: CallbackQuery):
         return
     
     user_id = int(callback.data.replace("admin_user_", ""))
-    user = await get_user(user_id)
+    user = await get_user_profile(user_id)
     
     if not user:
         await callback.answer("Foydalanuvchi topilmadi!", show_alert=True)
@@ -870,15 +3101,13 @@ async def admin_user_details(callback: CallbackQuery):
     
     await callback.answer()
     
-    _, username, first_name, last_name, name, phone, lang, registered, balance, referred_by, referrals_count, created_at = user
-    
-    display_name = name if name else f"{first_name} {last_name if last_name else ''}".strip()
-    display_phone = phone if phone else "Telefon kiritilmagan"
+    display_name = user.name if user.name else f"{user.first_name} {user.last_name if user.last_name else ''}".strip()
+    display_phone = user.phone if user.phone else "Telefon kiritilmagan"
     
     text = TEXTS['uz']['admin_user_info'].format(
         name=display_name,
         phone=display_phone,
-        balance=format_number(balance),
+        balance=format_number(user.cashback_balance),
         user_id=user_id
     )
     
@@ -987,36 +3216,102 @@ async def admin_bonus_process(message: Message, state: FSMContext):
         await message.answer(TEXTS['uz']['admin_invalid_percent'])
         return
     
-    data = await state.get_data()
-    target_user_id = data.get('target_user_id')
-    
-    if not target_user_id:
-        await message.answer("❌ Xatolik! Foydalanuvchi topilmadi.")
+    data = await state.get_data()
+    target_user_id = data.get('target_user_id')
+    
+    if not target_user_id:
+        await message.answer("❌ Xatolik! Foydalanuvchi topilmadi.")
+        await state.clear()
+        return
+    
+    old_balance, new_balance, bonus_amount = await add_bonus_to_user(target_user_id, percent)
+    
+    if new_balance is not None:
+        text = TEXTS['uz']['admin_bonus_success'].format(
+            old_balance=format_number(old_balance),
+            percent=percent,
+            bonus=format_number(bonus_amount),
+            new_balance=format_number(new_balance)
+        )
+        await message.answer(text, parse_mode='HTML')
+        
+        await message.answer(
+            "👇 Admin panelga qaytish:",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text=TEXTS['uz']['admin_back_to_users'], callback_data=f"admin_user_{target_user_id}")]
+            ])
+        )
+    else:
+        await message.answer(TEXTS['uz']['admin_bonus_error'])
+    
+    await state.clear()
+
+# ==================== ADMIN STATS ====================
+@router.callback_query(F.data == "admin_stats")
+async def admin_stats_handler(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
+        return
+    
+    await callback.answer()
+    stats = await get_statistics()
+    
+    text = f"""{TEXTS['uz']['admin_stats_title']}
+
+👥 Jami foydalanuvchilar: <b>{format_number(stats['total_users'])}</b>
+🆕 Bugun qo'shilganlar: <b>{format_number(stats['today_users'])}</b>
+💰 Umumiy balans: <b>{format_number(stats['total_balance'])} so'm</b>
+🧾 Tranzaksiyalar: <b>{format_number(stats['total_transactions'])}</b> ta
+💸 Berilgan cashback: <b>{format_number(stats['total_cashback_given'])} so'm</b>
+
+{TEXTS['uz']['admin_stats_weekly']}
+"""
+    for day, count in stats['weekly_stats']:
+        text += f"🗓 {day.strftime('%d.%m.%Y')}: <b>{count}</b>\n"
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=stats_keyboard(),
+        parse_mode='HTML'
+    )
+
+# ==================== ADMIN SEARCH ====================
+@router.callback_query(F.data == "admin_search")
+async def admin_search_start(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
+        return
+    
+    await state.set_state(AdminSearchState.waiting_for_query)
+    await callback.answer()
+    await callback.message.edit_text(
+        TEXTS['uz']['admin_search_title'],
+        parse_mode='HTML'
+    )
+
+@router.message(AdminSearchState.waiting_for_query)
+async def admin_search_process(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+    
+    if message.text == "/cancel":
+        await message.answer("Bekor qilindi.", reply_markup=admin_main_keyboard())
         await state.clear()
         return
     
-    old_balance = await get_cashback_balance(target_user_id)
-    new_balance, bonus_amount = await add_bonus_to_user(target_user_id, percent)
-    
-    if new_balance is not None:
-        text = TEXTS['uz']['admin_bonus_success'].format(
-            old_balance=format_number(old_balance),
-            percent=percent,
-            bonus=format_number(bonus_amount),
-            new_balance=format_number(new_balance)
-        )
-        await message.answer(text, parse_mode='HTML')
-        
-        await message.answer(
-            "👇 Admin panelga qaytish:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=TEXTS['uz']['admin_back_to_users'], callback_data=f"admin_user_{target_user_id}")]
-            ])
-        )
-    else:
-        await message.answer(TEXTS['uz']['admin_bonus_error'])
+    query = (message.text or "").strip()
+    if len(query) < ADMIN_SEARCH_MIN_LENGTH and not query.isdigit():
+        await message.answer(TEXTS['uz']['admin_search_short'])
+        return
     
+    users = await search_users(query)
     await state.clear()
+    
+    await message.answer(
+        TEXTS['uz']['admin_search_results'].format(query=html.escape(query), count=len(users)),
+        reply_markup=admin_search_results_keyboard(users),
+        parse_mode='HTML'
+    )
 
 # ==================== ADMIN BROADCAST ====================
 @router.callback_query(F.data == "admin_broadcast")
@@ -1054,11 +3349,8 @@ async def admin_broadcast_confirm(message: Message, state: FSMContext):
         content = message.video.file_id
         caption = message.caption
     
-    await state.update_data(
-        message_type=message_type,
-        content=content,
-        caption=caption
-    )
+    job_id = await create_broadcast_job(message.from_user.id, message_type, content, caption)
+    await state.update_data(job_id=job_id)
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -1076,39 +3368,109 @@ async def admin_broadcast_send(callback: CallbackQuery, state: FSMContext, bot:
         return
     
     data = await state.get_data()
-    users = await get_all_users()
-    
-    await callback.message.edit_text("⏳ Yuborilmoqda...")
+    await state.clear()
     
-    sent = 0
-    failed = 0
+    job = await start_broadcast_job(data.get('job_id'), callback.message.chat.id, callback.message.message_id)
+    if not job:
+        await callback.answer("❌ Xabar topilmadi!", show_alert=True)
+        return
     
-    for user in users:
-        try:
-            if data['message_type'] == 'text':
-                await bot.send_message(user[0], data['content'])
-            elif data['message_type'] == 'photo':
-                await bot.send_photo(user[0], data['content'], caption=data.get('caption'))
-            elif data['message_type'] == 'video':
-                await bot.send_video(user[0], data['content'], caption=data.get('caption'))
-            sent += 1
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            failed += 1
-            logging.error(f"Xabar yuborishda xato {user[0]}: {e}")
+    broadcast = Broadcast(bot, job)
     
+    await callback.answer()
     await callback.message.edit_text(
-        TEXTS['uz']['admin_broadcast_sent'].format(sent=sent, failed=failed),
-        reply_markup=admin_main_keyboard(),
+        TEXTS['uz']['admin_broadcast_progress'].format(processed=0, total=broadcast.total, rate=0),
         parse_mode='HTML'
     )
-    await state.clear()
+    
+    run_in_background(broadcast_progress(broadcast))
+
+async def resume_broadcasts(bot):
+    """Egasiz qolgan (restart, qulagan instans) broadcastlarni olib, checkpointdan davom ettirish"""
+    for job in await claim_broadcast_jobs():
+        logging.info(f"Broadcast #{job['id']} davom ettirilmoqda (oxirgi user_id: {job['last_user_id']})")
+        run_in_background(broadcast_progress(Broadcast(bot, job)))
+
+async def broadcast_resume_loop(bot):
+    """Fonda: ijarasi tugagan broadcastlarni muntazam tekshirish (boshqa instans qulagan bo'lsa)"""
+    while True:
+        try:
+            await resume_broadcasts(bot)
+        except Exception as e:
+            logging.error(f"Broadcastlarni davom ettirishda xato: {e}")
+        await asyncio.sleep(BROADCAST_LEASE / 2)
+
+async def broadcast_progress(broadcast):
+    """Broadcastni ishga tushirish va admin xabarida holatni yangilab borish"""
+    bot = broadcast.bot
+    task = asyncio.create_task(broadcast.run())
+    
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=5)
+            if task.done():
+                break
+            try:
+                owned = await renew_broadcast_lease(broadcast.job_id, broadcast.owner)
+            except Exception as e:
+                logging.error(f"Broadcast ijarasini yangilashda xato: {e}")
+                owned = True
+            if not owned:
+                logging.error(f"Broadcast #{broadcast.job_id} boshqa instansga o'tgan, bu yerda to'xtatildi")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return
+            try:
+                await bot.edit_message_text(
+                    TEXTS['uz']['admin_broadcast_progress'].format(
+                        processed=broadcast.processed,
+                        total=broadcast.total,
+                        rate=int(broadcast.rate())
+                    ),
+                    chat_id=broadcast.status_chat_id,
+                    message_id=broadcast.status_message_id,
+                    parse_mode='HTML'
+                )
+            except Exception as e:
+                logging.error(f"Broadcast holatini yangilashda xato: {e}")
+    except asyncio.CancelledError:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+    
+    try:
+        task.result()
+    except Exception as e:
+        logging.error(f"Broadcastda xato: {e}")
+        return
+    
+    try:
+        await bot.edit_message_text(
+            TEXTS['uz']['admin_broadcast_sent'].format(
+                sent=broadcast.sent,
+                failed=broadcast.failed,
+                blocked=broadcast.blocked,
+                deactivated=broadcast.deactivated,
+                errors=broadcast.errors,
+                elapsed=int(broadcast.elapsed())
+            ),
+            chat_id=broadcast.status_chat_id,
+            message_id=broadcast.status_message_id,
+            reply_markup=admin_main_keyboard(),
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        logging.error(f"Broadcast natijasini yuborishda xato: {e}")
 
 @router.callback_query(F.data == "cancel_broadcast")
 async def admin_broadcast_cancel(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         return
     
+    data = await state.get_data()
+    if data.get('job_id'):
+        await cancel_broadcast_job(data['job_id'])
+    
     await callback.message.edit_text(TEXTS['uz']['admin_broadcast_cancel'], reply_markup=admin_main_keyboard())
     await state.clear()
 
@@ -1123,7 +3485,7 @@ async def admin_deduct_start(callback: CallbackQuery, state: FSMContext):
     current_balance = await get_cashback_balance(user_id)
     
     await state.set_state(AdminDeductState.waiting_for_amount)
-    await state.update_data(target_user_id=user_id, current_balance=current_balance)
+    await state.update_data(target_user_id=user_id)
     
     await callback.message.edit_text(
         TEXTS['uz']['admin_deduct_title'].format(balance=format_number(current_balance)),
@@ -1150,41 +3512,35 @@ async def admin_deduct_process(message: Message, state: FSMContext):
     
     data = await state.get_data()
     target_user_id = data['target_user_id']
-    current_balance = data['current_balance']
     
-    if amount > current_balance:
-        await message.answer(f"❌ Xatolik! Balansda yetarli mablag' yo'q.\nJoriy: {format_number(current_balance)} so'm")
+    try:
+        ok, balance = await deduct_balance(target_user_id, amount)
+    except Exception as e:
+        logging.error(f"Ayirishda xato: {e}")
+        await message.answer("❌ Xatolik yuz berdi!")
+        await state.clear()
         return
     
-    new_balance = current_balance - amount
+    if balance is None:
+        await message.answer("❌ Xatolik! Foydalanuvchi topilmadi.")
+        await state.clear()
+        return
     
-    global db_pool
-    async with db_pool.acquire() as conn:
-        try:
-            async with conn.transaction():
-                await conn.execute(
-                    'UPDATE users SET cashback_balance = $1 WHERE user_id = $2',
-                    new_balance, target_user_id
-                )
-                await conn.execute('''
-                    INSERT INTO cashback_history (user_id, amount, percent, cashback, type) 
-                    VALUES ($1, $2, $3, $4, $5)
-                ''', target_user_id, 0, 0, -amount, 'admin_deduct')
-                
-                await message.answer(
-                    TEXTS['uz']['admin_deduct_success'].format(
-                        old_balance=format_number(current_balance),
-                        amount=format_number(amount),
-                        new_balance=format_number(new_balance)
-                    ),
-                    parse_mode='HTML',
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="◀️ Orqaga", callback_data=f"admin_user_{target_user_id}")]
-                    ])
-                )
-        except Exception as e:
-            logging.error(f"Ayirishda xato: {e}")
-            await message.answer("❌ Xatolik yuz berdi!")
+    if not ok:
+        await message.answer(f"❌ Xatolik! Balansda yetarli mablag' yo'q.\nJoriy: {format_number(balance)} so'm")
+        return
+    
+    await message.answer(
+        TEXTS['uz']['admin_deduct_success'].format(
+            old_balance=format_number(balance + amount),
+            amount=format_number(amount),
+            new_balance=format_number(balance)
+        ),
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="◀️ Orqaga", callback_data=f"admin_user_{target_user_id}")]
+        ])
+    )
     
     await state.clear()
 
@@ -1196,21 +3552,48 @@ async def admin_user_history(callback: CallbackQuery):
         return
     
     user_id = int(callback.data.replace("admin_history_", ""))
-    history = await get_cashback_history(user_id)
+    await admin_show_history_page(callback, user_id)
+
+@router.callback_query(F.data.startswith("ahist_"))
+async def admin_user_history_page(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
+        return
+    
+    # ahist_{user_id}_{next|prev}_{kursor}
+    _, user_id, direction, value = callback.data.split("_", 3)
+    await admin_show_history_page(callback, int(user_id), decode_cursor(value), direction)
+
+async def admin_show_history_page(callback, user_id, cursor=None, direction='next'):
+    """Admin - foydalanuvchi tranzaksiyalari sahifasi"""
+    history, has_more = await get_cashback_history_page(user_id, cursor, direction, ADMIN_HISTORY_PAGE_SIZE)
+    has_prev, has_next = page_flags(cursor, direction, has_more)
+    
+    await callback.answer()
     
+    buttons = []
     if not history:
         text = "📜 <b>Tranzaksiyalar tarixi bo'sh</b>"
     else:
         text = f"📜 <b>Tranzaksiyalar tarixi</b> (User: {user_id})\n\n"
-        for amount, percent, cashback, date, type_tx in history[:20]:
+        for amount, percent, cashback, date, type_tx, _ in history:
             emoji = "🟢" if cashback > 0 else "🔴"
             type_key = f"type_{type_tx}"
             type_text = TEXTS['uz'].get(type_key, type_tx)
             text += f"{emoji} {format_date(date)}: <b>{format_number(abs(cashback))}</b> so'm ({type_text})\n"
+        
+        nav_buttons = page_nav_row(
+            f"ahist_{user_id}_",
+            encode_cursor(history[0][3], history[0][5]),
+            encode_cursor(history[-1][3], history[-1][5]),
+            has_prev, has_next
+        )
+        if nav_buttons:
+            buttons.append(nav_buttons)
+    
+    buttons.append([InlineKeyboardButton(text="◀️ Orqaga", callback_data=f"admin_user_{user_id}")])
     
-    await callback.message.edit_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Orqaga", callback_data=f"admin_user_{user_id}")]
-    ]))
+    await callback.message.edit_text(text, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
 
 @router.callback_query(F.data == "admin_empty")
 async def admin_empty_handler(callback: CallbackQuery):
@@ -1220,9 +3603,8 @@ async def admin_empty_handler(callback: CallbackQuery):
 async def process_language(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     lang = callback.data.split('_')[1]
-    user_id = callback.from_user.id
     
-    await update_language(user_id, lang)
+    # Bazaga hozir yozilmaydi: til, ism va telefon bitta yozuv bilan saqlanadi (process_phone)
     await state.update_data(language=lang)
     
     await state.set_state(Registration.name)
@@ -1230,8 +3612,7 @@ async def process_language(callback: CallbackQuery, state: FSMContext):
 
 @router.message(Registration.name)
 async def process_name(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    name = message.text.strip()
+    name = (message.text or "").strip()
     
     if len(name) < 2:
         data = await state.get_data()
@@ -1239,8 +3620,7 @@ async def process_name(message: Message, state: FSMContext):
         await message.answer("❌ Ism juda qisqa!" if lang == 'uz' else "❌ Имя слишком короткое!")
         return
     
-    await update_name(user_id, name)
-    data = await state.get_data()
+    data = await state.update_data(name=name)
     lang = data.get('language', 'uz')
     
     await state.set_state(Registration.phone)
@@ -1251,9 +3631,9 @@ async def process_phone(message: Message, state: FSMContext):
     user_id = message.from_user.id
     phone = message.contact.phone_number
     
-    await update_phone(user_id, phone)
     data = await state.get_data()
     lang = data.get('language', 'uz')
+    await complete_registration(user_id, lang, data.get('name'), phone)
     
     await state.clear()
     
@@ -1275,8 +3655,7 @@ async def invalid_phone(message: Message, state: FSMContext):
 async def main_menu_handler(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
     await state.clear()
-    user = await get_user(callback.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(callback.from_user.id)
     
     await callback.message.delete()
     await callback.message.answer(
@@ -1289,8 +3668,7 @@ async def main_menu_handler(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data == 'referral')
 async def referral_handler(callback: CallbackQuery, bot: Bot):
     await callback.answer()
-    user = await get_user(callback.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(callback.from_user.id)
     
     balance = await get_cashback_balance(callback.from_user.id)
     count = await get_referrals_count(callback.from_user.id)
@@ -1314,8 +3692,7 @@ async def referral_handler(callback: CallbackQuery, bot: Bot):
 async def change_language_main_handler(callback: CallbackQuery):
     await callback.answer()
     
-    user = await get_user(callback.from_user.id)
-    current_lang = user[6] if user else 'uz'
+    current_lang = await get_user_language(callback.from_user.id)
     
     new_lang = 'ru' if current_lang == 'uz' else 'uz'
     
@@ -1331,8 +3708,7 @@ async def change_language_main_handler(callback: CallbackQuery):
 @router.callback_query(F.data == 'cashback')
 async def cashback_handler(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    user = await get_user(callback.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(callback.from_user.id)
     
     await state.set_state(CashbackState.waiting_for_amount)
     
@@ -1344,11 +3720,10 @@ async def cashback_handler(callback: CallbackQuery, state: FSMContext):
 
 @router.message(CashbackState.waiting_for_amount)
 async def process_cashback_amount(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    user = await get_user(user_id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(message.from_user.id)
     
-    text = message.text.strip()
+    # Rasm yoki boshqa matnsiz xabar - noto'g'ri summa kabi
+    text = (message.text or "").strip()
     cleaned = text.replace(" ", "").replace("so'm", "").replace("sum", "").replace("сум", "").replace(",", "").replace(".", "")
     
     try:
@@ -1369,30 +3744,10 @@ async def process_cashback_amount(message: Message, state: FSMContext):
     )
     await state.set_state(CashbackState.waiting_for_photo)
 
-@router.message(CashbackState.waiting_for_photo, F.photo)
-async def process_cashback_photo(message: Message, state: FSMContext, bot: Bot):
-    user_id = message.from_user.id
-    user = await get_user(user_id)
-    lang = user[6] if user else 'uz'
-    data = await state.get_data()
-    amount = data.get('amount')
-    
-    photo_file_id = message.photo[-1].file_id
-    
-    user_info = f"{user[4] if user[4] else message.from_user.full_name}" if user else message.from_user.full_name
-    phone = user[5] if user and user[5] else "Telefon kiritilmagan"
-    
-    admin_text = f"""🆕 <b>Yangi Cashback So'rovi</b>
-
-👤 Foydalanuvchi: <b>{user_info}</b>
-🆔 ID: <code>{user_id}</code>
-📱 Telefon: <code>{phone}</code>
-💵 Xarid summasi: <b>{format_number(amount)} so'm</b>
-
-❓ Tasdiqlaysizmi?"""
-    
+def cashback_request_caption(user_info, user_id, phone, amount, lang='uz'):
+    """Admin uchun keshbek so'rovi matni"""
     if lang == 'ru':
-        admin_text = f"""🆕 <b>Новый запрос на кешбэк</b>
+        return f"""🆕 <b>Новый запрос на кешбэк</b>
 
 👤 Пользователь: <b>{user_info}</b>
 🆔 ID: <code>{user_id}</code>
@@ -1401,89 +3756,316 @@ async def process_cashback_photo(message: Message, state: FSMContext, bot: Bot):
 
 ❓ Подтверждаете?"""
     
-    admin_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    return f"""🆕 <b>Yangi Cashback So'rovi</b>
+
+👤 Foydalanuvchi: <b>{user_info}</b>
+🆔 ID: <code>{user_id}</code>
+📱 Telefon: <code>{phone}</code>
+💵 Xarid summasi: <b>{format_number(amount)} so'm</b>
+
+❓ Tasdiqlaysizmi?"""
+
+def cashback_request_keyboard(request_id, lang='uz'):
+    """So'rovni tasdiqlash/bekor qilish tugmalari"""
+    return InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(
                 text="✅ Tasdiqlash" if lang == 'uz' else "✅ Подтвердить", 
-                callback_data=f"ccf_{user_id}_{amount}"
+                callback_data=f"ccf_{request_id}"
             ),
             InlineKeyboardButton(
                 text="❌ Bekor qilish" if lang == 'uz' else "❌ Отменить", 
-                callback_data=f"ccx_{user_id}_{amount}"
+                callback_data=f"ccx_{request_id}"
             )
         ]
     ])
+
+@router.message(CashbackState.waiting_for_photo, F.photo)
+async def process_cashback_photo(message: Message, state: FSMContext, bot: Bot):
+    user_id = message.from_user.id
+    user = await get_user_profile(user_id)
+    lang = (user.language or 'uz') if user else 'uz'
+    data = await state.get_data()
+    amount = data.get('amount')
+    
+    photo_file_id = message.photo[-1].file_id
+    
+    user_info = user.name if user and user.name else message.from_user.full_name
+    phone = user.phone if user and user.phone else "Telefon kiritilmagan"
     
     try:
-        await bot.send_photo(
-            ADMIN_ID, 
-            photo_file_id, 
-            caption=admin_text, 
-            reply_markup=admin_keyboard,
-            parse_mode='HTML'
-        )
-        
-        await message.answer(
-            "✅ <b>So'rovingiz adminga yuborildi!</b>\n\nIltimos, tasdiqlashini kuting..." 
-            if lang == 'uz' 
-            else "✅ <b>Ваш запрос отправлен администратору!</b>\n\nПожалуйста, ожидайте подтверждения...",
-            parse_mode='HTML'
+        # Bir xil xabar qayta kelsa (retry), so'rov ikkinchi marta yaratilmaydi
+        request_id = await create_cashback_request(
+            user_id, amount, photo_file_id, f"{message.chat.id}:{message.message_id}"
         )
     except Exception as e:
-        logging.error(f"Admin ga yuborishda xato: {e}")
+        logging.error(f"Keshbek so'rovini saqlashda xato: {e}")
         await message.answer(
             "❌ Xatolik yuz berdi. Iltimos keyinroq qayta urinib ko'ring." 
             if lang == 'uz' 
             else "❌ Произошла ошибка. Попробуйте позже.",
             parse_mode='HTML'
         )
+        await state.clear()
+        return
+    
+    if request_id is None:
+        await state.clear()
+        return
     
+    await message.answer(
+        "✅ <b>So'rovingiz adminga yuborildi!</b>\n\nIltimos, tasdiqlashini kuting..." 
+        if lang == 'uz' 
+        else "✅ <b>Ваш запрос отправлен администратору!</b>\n\nПожалуйста, ожидайте подтверждения...",
+        parse_mode='HTML'
+    )
     await state.clear()
+    
+    # So'rov bazada saqlangan: xabar yetmasa ham admin uni navbatdan topadi.
+    # Umumiy limiterni handler ichida kutmaslik uchun - fonda yuboriladi
+    admin_text = cashback_request_caption(user_info, user_id, phone, amount, lang)
+    admin_keyboard = cashback_request_keyboard(request_id, lang)
+    
+    async def notify_admins():
+        for admin_id in ADMIN_IDS:
+            try:
+                await outbound_limiter.acquire()
+                await bot.send_photo(
+                    admin_id, 
+                    photo_file_id, 
+                    caption=admin_text, 
+                    reply_markup=admin_keyboard,
+                    parse_mode='HTML'
+                )
+            except Exception as e:
+                logging.error(f"Admin {admin_id} ga yuborishda xato: {e}")
+    
+    run_in_background(notify_admins())
 
 @router.message(CashbackState.waiting_for_photo)
 async def invalid_cashback_photo(message: Message):
-    user = await get_user(message.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(message.from_user.id)
     await message.answer(
         "❌ Iltimos, faqat rasm yuboring:" if lang == 'uz' else "❌ Пожалуйста, отправьте только фото:"
     )
 
+def parse_cashback_request_id(data):
+    """ccf_{id} / ccx_{id} dan so'rov ID sini olish (eski formatdagi tugmalar uchun None)"""
+    parts = data.split("_")
+    if len(parts) != 2 or not parts[1].isdigit():
+        return None
+    return int(parts[1])
+
+@router.callback_query(F.data == "admin_cashback_queue")
+async def admin_cashback_queue_handler(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
+        return
+    
+    await callback.answer()
+    count = await count_open_cashback_requests()
+    small_count = await count_open_cashback_requests(CASHBACK_BULK_THRESHOLD)
+    
+    await callback.message.edit_text(
+        f"🧾 <b>Keshbek navbati</b>\n\nKo'rib chiqilmagan so'rovlar: <b>{format_number(count)}</b> ta\n"
+        f"{format_number(CASHBACK_BULK_THRESHOLD)} so'mgacha: <b>{format_number(small_count)}</b> ta\n\n"
+        "Boshqa son uchun: <code>/bulk N</code> yoki <code>/bulk N small</code>",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="▶️ Keyingi so'rov", callback_data="admin_cashback_next")],
+            [InlineKeyboardButton(
+                text=f"✅ Eng eski {CASHBACK_BULK_SIZE} tasini tasdiqlash",
+                callback_data=f"ccbulk_oldest_{CASHBACK_BULK_SIZE}"
+            )],
+            [InlineKeyboardButton(
+                text=f"✅ {format_number(CASHBACK_BULK_THRESHOLD)} so'mgacha hammasini",
+                callback_data=f"ccbulk_small_{CASHBACK_BULK_MAX}"
+            )],
+            [InlineKeyboardButton(text="🔄 Yangilash", callback_data="admin_cashback_queue")],
+            [InlineKeyboardButton(text="◀️ Orqaga", callback_data="admin_main_menu")],
+        ]),
+        parse_mode='HTML'
+    )
+
+@router.callback_query(F.data == "admin_cashback_next")
+async def admin_cashback_next_handler(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
+        return
+    
+    request = await claim_next_cashback_request(callback.from_user.id)
+    if not request:
+        await callback.answer("✅ Navbat bo'sh", show_alert=True)
+        return
+    
+    await callback.answer()
+    user_info = request['name'] or " ".join(
+        part for part in (request['first_name'], request['last_name']) if part
+    ) or str(request['user_id'])
+    
+    await callback.message.answer_photo(
+        request['photo_file_id'],
+        caption=cashback_request_caption(
+            user_info, request['user_id'], request['phone'] or "Telefon kiritilmagan", request['amount']
+        ),
+        reply_markup=cashback_request_keyboard(request['id']),
+        parse_mode='HTML'
+    )
+
+# Ommaviy tasdiqlash rejimlari: (standart limit, maksimal summa)
+CASHBACK_BULK_MODES = {
+    'oldest': (CASHBACK_BULK_SIZE, None),
+    'small': (CASHBACK_BULK_MAX, CASHBACK_BULK_THRESHOLD),
+}
+
+def parse_bulk_callback(data):
+    """ccbulk_{mode}_{n} / ccbulkok_{mode}_{n} dan (rejim, limit); n siz eski tugmalar - standart limit"""
+    parts = data.split("_")
+    if len(parts) not in (2, 3) or parts[1] not in CASHBACK_BULK_MODES:
+        return None
+    if len(parts) == 3 and not parts[2].isdigit():
+        return None
+    limit = int(parts[2]) if len(parts) == 3 else CASHBACK_BULK_MODES[parts[1]][0]
+    return parts[1], max(1, min(limit, CASHBACK_BULK_MAX))
+
+async def bulk_cashback_prompt(mode, limit):
+    """Ommaviy tasdiqlash so'rovi matni va tugmalari; navbat bo'sh bo'lsa None"""
+    count = min(limit, await count_open_cashback_requests(CASHBACK_BULK_MODES[mode][1]))
+    if not count:
+        return None
+    
+    return (
+        f"❓ <b>{format_number(count)}</b> ta so'rov tasdiqlansinmi?",
+        InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✅ Ha", callback_data=f"ccbulkok_{mode}_{limit}"),
+                InlineKeyboardButton(text="❌ Yo'q", callback_data="admin_cashback_queue")
+            ]
+        ])
+    )
+
+@router.message(Command("bulk"))
+async def admin_bulk_cashback_command(message: Message):
+    """/bulk [N] [small] - eng eski N ta (small: faqat kichik summali) so'rovni tasdiqlash"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    parts = message.text.split()
+    mode = 'small' if 'small' in parts[1:] else 'oldest'
+    numbers = [part for part in parts[1:] if part.isdigit()]
+    limit = int(numbers[0]) if numbers else CASHBACK_BULK_MODES[mode][0]
+    limit = max(1, min(limit, CASHBACK_BULK_MAX))
+    
+    prompt = await bulk_cashback_prompt(mode, limit)
+    if not prompt:
+        await message.answer("✅ Navbat bo'sh")
+        return
+    
+    text, keyboard = prompt
+    await message.answer(text, reply_markup=keyboard, parse_mode='HTML')
+
+@router.callback_query(F.data.startswith("ccbulk_"))
+async def admin_bulk_cashback_ask(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
+        return
+    
+    parsed = parse_bulk_callback(callback.data)
+    if not parsed:
+        await callback.answer()
+        return
+    
+    prompt = await bulk_cashback_prompt(*parsed)
+    if not prompt:
+        await callback.answer("✅ Navbat bo'sh", show_alert=True)
+        return
+    
+    await callback.answer()
+    text, keyboard = prompt
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode='HTML')
+
+@router.callback_query(F.data.startswith("ccbulkok_"))
+async def admin_bulk_cashback_confirm(callback: CallbackQuery, bot: Bot):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
+        return
+    
+    parsed = parse_bulk_callback(callback.data)
+    if not parsed:
+        await callback.answer()
+        return
+    
+    mode, limit = parsed
+    max_amount = CASHBACK_BULK_MODES[mode][1]
+    start_time = time.monotonic()
+    
+    try:
+        approved = await approve_cashback_requests_bulk(callback.from_user.id, limit, max_amount)
+    except Exception as e:
+        logging.error(f"Ommaviy tasdiqlashda xato: {e}")
+        await callback.answer("❌ Xatolik yuz berdi!", show_alert=True)
+        return
+    
+    await callback.answer()
+    total_cashback = sum(row['cashback'] for row in approved)
+    await callback.message.edit_text(
+        f"✅ <b>{format_number(len(approved))}</b> ta so'rov tasdiqlandi\n"
+        f"💰 Jami cashback: <b>{format_number(total_cashback)} so'm</b>\n"
+        f"⏱ {time.monotonic() - start_time:.1f} s",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🧾 Keshbek navbati", callback_data="admin_cashback_queue")]
+        ]),
+        parse_mode='HTML'
+    )
+    
+    messages = [
+        (row['user_id'], TEXTS[row['language']]['cashback_success'].format(
+            amount=format_number(row['amount']),
+            percent=row['percent'],
+            cashback=format_number(row['cashback']),
+            balance=format_number(row['balance'])
+        ))
+        for row in approved
+    ]
+    run_in_background(send_notifications(bot, messages))
+
 @router.callback_query(F.data.startswith("ccf_"))
 async def admin_confirm_cashback(callback: CallbackQuery, bot: Bot):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
         return
     
-    parts = callback.data.split("_")
-    user_id = int(parts[1])
-    amount = int(parts[2])
+    request_id = parse_cashback_request_id(callback.data)
+    if request_id is None:
+        await callback.answer("⚠️ Bu so'rov eskirgan, navbatdan qayta oching.", show_alert=True)
+        return
     
     percent = random.randint(1, 5)
-    cashback = int(amount * percent / 100)
     
     try:
-        await add_cashback(user_id, amount, percent, cashback)
-        new_balance = await get_cashback_balance(user_id)
+        result = await approve_cashback_request(request_id, callback.from_user.id, percent)
         
-        user = await get_user(user_id)
-        user_lang = user[6] if user else 'uz'
+        if result is None:
+            await callback.answer(
+                "⚠️ So'rov allaqachon ko'rib chiqilgan yoki boshqa admin ko'rib chiqmoqda.", 
+                show_alert=True
+            )
+            return
         
-        success_text = TEXTS[user_lang]['cashback_success'].format(
-            amount=format_number(amount),
+        success_text = TEXTS[result['language']]['cashback_success'].format(
+            amount=format_number(result['amount']),
             percent=percent,
-            cashback=format_number(cashback),
-            balance=format_number(new_balance)
+            cashback=format_number(result['cashback']),
+            balance=format_number(result['cashback_balance'])
         )
         
-        await bot.send_message(user_id, success_text, parse_mode='HTML')
-        
         await callback.message.edit_caption(
-            callback.message.caption + f"\n\n✅ <b>TASDIQLANDI</b>\n💰 Cashback: {format_number(cashback)} so'm ({percent}%)",
+            caption=callback.message.caption + f"\n\n✅ <b>TASDIQLANDI</b>\n💰 Cashback: {format_number(result['cashback'])} so'm ({percent}%)",
             parse_mode='HTML'
         )
-        
         await callback.answer("✅ Tasdiqlandi va foydalanuvchiga yuborildi!", show_alert=True)
         
+        run_in_background(send_notifications(bot, [(result['user_id'], success_text)]))
+        
     except Exception as e:
         logging.error(f"Cashback tasdiqlashda xato: {e}")
         await callback.answer("❌ Xatolik yuz berdi!", show_alert=True)
@@ -1494,27 +4076,34 @@ async def admin_cancel_cashback(callback: CallbackQuery, bot: Bot):
         await callback.answer("❌ Ruxsat yo'q!", show_alert=True)
         return
     
-    parts = callback.data.split("_")
-    user_id = int(parts[1])
-    
-    user = await get_user(user_id)
-    user_lang = user[6] if user else 'uz'
-    
-    cancel_text = (
-        "❌ <b>So'rovingiz bekor qilindi</b>\n\nAdmin sizning so'rovingizni bekor qildi." 
-        if user_lang == 'uz' 
-        else "❌ <b>Ваш запрос отменен</b>\n\nАдминистратор отменил ваш запрос."
-    )
+    request_id = parse_cashback_request_id(callback.data)
+    if request_id is None:
+        await callback.answer("⚠️ Bu so'rov eskirgan, navbatdan qayta oching.", show_alert=True)
+        return
     
     try:
-        await bot.send_message(user_id, cancel_text, parse_mode='HTML')
+        result = await reject_cashback_request(request_id, callback.from_user.id)
+        
+        if result is None:
+            await callback.answer(
+                "⚠️ So'rov allaqachon ko'rib chiqilgan yoki boshqa admin ko'rib chiqmoqda.", 
+                show_alert=True
+            )
+            return
+        
+        cancel_text = (
+            "❌ <b>So'rovingiz bekor qilindi</b>\n\nAdmin sizning so'rovingizni bekor qildi." 
+            if result['language'] == 'uz' 
+            else "❌ <b>Ваш запрос отменен</b>\n\nАдминистратор отменил ваш запрос."
+        )
         
         await callback.message.edit_caption(
-            callback.message.caption + "\n\n❌ <b>BEKOR QILINDI</b>",
+            caption=callback.message.caption + "\n\n❌ <b>BEKOR QILINDI</b>",
             parse_mode='HTML'
         )
-        
         await callback.answer("❌ Bekor qilindi", show_alert=True)
+        
+        run_in_background(send_notifications(bot, [(result['user_id'], cancel_text)]))
     except Exception as e:
         logging.error(f"Bekor qilishda xatolik: {e}")
         await callback.answer("❌ Xatolik!", show_alert=True)
@@ -1524,8 +4113,7 @@ async def admin_cancel_cashback(callback: CallbackQuery, bot: Bot):
 @router.callback_query(F.data == 'balance')
 async def balance_handler(callback: CallbackQuery):
     await callback.answer()
-    user = await get_user(callback.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(callback.from_user.id)
     
     balance = await get_cashback_balance(callback.from_user.id)
     
@@ -1540,18 +4128,27 @@ async def balance_handler(callback: CallbackQuery):
 # ==================== HISTORY HANDLER ====================
 @router.callback_query(F.data == 'history')
 async def history_handler(callback: CallbackQuery):
+    await show_history_page(callback)
+
+@router.callback_query(F.data.startswith('history_next_') | F.data.startswith('history_prev_'))
+async def history_page_handler(callback: CallbackQuery):
+    direction, value = callback.data.replace('history_', '').split('_', 1)
+    await show_history_page(callback, decode_cursor(value), direction)
+
+async def show_history_page(callback, cursor=None, direction='next'):
+    """Foydalanuvchi xaridlar tarixining bitta sahifasini ko'rsatish"""
     await callback.answer()
-    user = await get_user(callback.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(callback.from_user.id)
     user_id = callback.from_user.id
     
-    history = await get_cashback_history(user_id)
+    history, has_more = await get_cashback_history_page(user_id, cursor, direction)
+    has_prev, has_next = page_flags(cursor, direction, has_more)
     
     if not history:
         text = TEXTS[lang]['history_empty']
     else:
         text = "🧾 <b>Xaridlar tarixi</b>\n\n" if lang == 'uz' else "🧾 <b>История покупок</b>\n\n"
-        for amount, percent, cashback, date, type_tx in history:
+        for amount, percent, cashback, date, type_tx, _ in history:
             type_key = f"type_{type_tx}"
             type_text = TEXTS[lang].get(type_key, type_tx)
             text += TEXTS[lang]['history_item'].format(
@@ -1564,15 +4161,14 @@ async def history_handler(callback: CallbackQuery):
     
     await callback.message.edit_text(
         text,
-        reply_markup=back_keyboard(lang),
+        reply_markup=history_keyboard(lang, history, has_prev, has_next),
         parse_mode='HTML'
     )
 
 @router.callback_query(F.data == 'location')
 async def location_handler(callback: CallbackQuery):
     await callback.answer()
-    user = await get_user(callback.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(callback.from_user.id)
     
     if lang == 'uz':
         text = """📍 <b>SPK Systems manzillari:</b>
@@ -1621,8 +4217,7 @@ async def location_handler(callback: CallbackQuery):
 @router.callback_query(F.data == 'contact')
 async def contact_handler(callback: CallbackQuery):
     await callback.answer()
-    user = await get_user(callback.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(callback.from_user.id)
     
     if lang == 'uz':
         text = """📞 <b>Biz bilan bog'lanish:</b>
@@ -1647,8 +4242,7 @@ async def contact_handler(callback: CallbackQuery):
 @router.callback_query(F.data == 'group')
 async def group_handler(callback: CallbackQuery):
     await callback.answer()
-    user = await get_user(callback.from_user.id)
-    lang = user[6] if user else 'uz'
+    lang = await get_user_language(callback.from_user.id)
     
     if lang == 'uz':
         text = """🌐 <b>Bizning guruhimiz: https://t.me/+gc0Ps6bjW8llN2Iy </b>"""
@@ -1663,20 +4257,89 @@ async def group_handler(callback: CallbackQuery):
         disable_web_page_preview=True
     )
 
+# ==================== WEBHOOK ====================
+class LimitedRequestHandler(SimpleRequestHandler):
+    """Webhook handler: Telegramga darhol javob beradi, update larni esa
+    bir vaqtda ko'pi bilan `concurrency` tasi ishlanadi"""
+
+    def __init__(self, dispatcher, bot, concurrency, **kwargs):
+        super().__init__(dispatcher=dispatcher, bot=bot, **kwargs)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def _background_feed_update(self, bot, update):
+        async with self.semaphore:
+            await super()._background_feed_update(bot, update)
+
+async def run_webhook(dp, bot):
+    """Lokal aiohttp server orqali webhook rejimida ishlash"""
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise RuntimeError("Webhook rejimi uchun WEBHOOK_URL va WEBHOOK_SECRET kerak")
+    
+    app = web.Application()
+    LimitedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        concurrency=UPDATE_CONCURRENCY,
+        secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await site.start()
+    logging.info(f"Webhook server: http://{WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+    
+    # Bir nechta instans bo'lsa, webhookni faqat bittasi ro'yxatdan o'tkazadi
+    if WEBHOOK_REGISTER:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=DROP_PENDING_UPDATES
+        )
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+
 # ==================== MAIN ====================
 async def main():
     await init_db()
     
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(router)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+    bot = Bot(token=BOT_TOKEN, session=session)
+    dp = build_dispatcher()
     
-    await bot.delete_webhook(drop_pending_updates=True)
+    run_in_background(broadcast_resume_loop(bot))
+    run_in_background(stats_rollup_loop())
+    run_in_background(fsm_cleanup_loop())
+    metrics_runner = await start_metrics_server()
     
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+            await dp.start_polling(bot, tasks_concurrency_limit=UPDATE_CONCURRENCY)
     finally:
+        # Fondagi broadcastlarni to'xtatish (natijalar checkpointga yoziladi)
+        for task in list(background_tasks):
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await close_db()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill-stats":
+        asyncio.run(backfill_statistics())
+    else:
+        asyncio.run(main())
\ No newline at end of file
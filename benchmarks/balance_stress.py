@@ -0,0 +1,188 @@
+"""Balans o'zgarishlari uchun parallel stress test (production yo'llari orqali)
+
+Har bir turda bir guruh test foydalanuvchilariga keshbek so'rovlari yaratiladi, keyin
+bir vaqtda:
+  - bir nechta admin so'rovlarni birma-bir tasdiqlaydi (approve_cashback_request)
+    va rad etadi (reject_cashback_request);
+  - adminlar ommaviy tasdiqlaydi (approve_cashback_requests_bulk);
+  - shu foydalanuvchilardan balans ayiriladi (deduct_balance).
+Turdan keyin HAR BIR foydalanuvchi uchun tekshiriladi:
+  - balans manfiy emas va balans == cashback_history yig'indisi (ledger);
+  - balans == boshlang'ich + qaytarilgan tasdiqlar - muvaffaqiyatli ayirishlar;
+  - 'purchase' yozuvlari == tasdiqlangan so'rovlar (hech biri ikki marta tasdiqlanmagan);
+  - 'admin_deduct' yozuvlari == muvaffaqiyatli ayirishlar;
+  - hech bir chaqiruv xato (masalan, deadlock) bilan tugamagan.
+
+DIQQAT: DATABASE_URL dagi bazaga yozadi - faqat test bazasida ishlating.
+Test foydalanuvchilari (manfiy ID lar) oxirida o'chiriladi.
+
+Ishlatish:
+    DATABASE_URL=postgresql://localhost/spk_test python benchmarks/balance_stress.py --rounds 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+BASE_ID = -900000001
+ADMIN_BASE_ID = -910000001
+
+
+async def reset_users(user_ids, balance):
+    """Test foydalanuvchilarini qayta yaratish; boshlang'ich balans tarixda ham bor"""
+    async with app.db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM users WHERE user_id = ANY($1::BIGINT[])", user_ids)
+        await conn.execute('''
+            INSERT INTO users (user_id, first_name, registered, cashback_balance)
+            SELECT user_id, 'Stress', 1, $2 FROM unnest($1::BIGINT[]) AS user_id
+        ''', user_ids, balance)
+        await conn.execute('''
+            INSERT INTO cashback_history (user_id, amount, percent, cashback, type)
+            SELECT user_id, 0, 0, $2, 'referral' FROM unnest($1::BIGINT[]) AS user_id
+        ''', user_ids, balance)
+    for user_id in user_ids:
+        app.user_cache.invalidate(user_id)
+
+
+async def run_round(args, rng):
+    user_ids = [BASE_ID - i for i in range(args.users)]
+    admins = [ADMIN_BASE_ID - i for i in range(args.admins)]
+    await reset_users(user_ids, args.seed)
+
+    request_ids = []
+    for user_id in user_ids:
+        for n in range(args.requests):
+            request_ids.append(await app.create_cashback_request(
+                user_id, rng.randint(1, 500) * 1000, "stress", f"stress:{user_id}:{n}"
+            ))
+
+    approved = Counter()  # so'rov ID -> necha marta "tasdiqlandi" qaytdi
+    cashback = Counter()  # foydalanuvchi -> tasdiqlangan keshbek
+    deducted = Counter()  # foydalanuvchi -> muvaffaqiyatli ayirilgan summa
+    deductions = Counter()  # foydalanuvchi -> muvaffaqiyatli ayirishlar soni
+
+    async def approve(request_id, admin_id):
+        result = await app.approve_cashback_request(request_id, admin_id, rng.randint(1, 5))
+        if result:
+            approved[request_id] += 1
+            cashback[result['user_id']] += result['cashback']
+
+    async def approve_bulk(admin_id):
+        for row in await app.approve_cashback_requests_bulk(admin_id, args.bulk):
+            approved[row['id']] += 1
+            cashback[row['user_id']] += row['cashback']
+
+    async def reject(request_id, admin_id):
+        await app.reject_cashback_request(request_id, admin_id)
+
+    async def deduct(user_id, amount):
+        ok, _ = await app.deduct_balance(user_id, amount)
+        if ok:
+            deducted[user_id] += amount
+            deductions[user_id] += 1
+
+    operations = []
+    for request_id in request_ids:
+        roll = rng.random()
+        if roll < 0.5:
+            operations.append(approve(request_id, rng.choice(admins)))
+        elif roll < 0.6:
+            operations.append(reject(request_id, rng.choice(admins)))
+    for admin_id in admins:
+        operations += [approve_bulk(admin_id) for _ in range(args.bulk_calls)]
+    for _ in range(args.deducts):
+        operations.append(deduct(rng.choice(user_ids), rng.randint(1, args.deduct)))
+    rng.shuffle(operations)
+
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(*operations, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    errors = Counter(type(outcome).__name__ for outcome in outcomes if isinstance(outcome, BaseException))
+
+    async with app.db_pool.acquire() as conn:
+        rows = await conn.fetch('''
+            SELECT u.user_id, u.cashback_balance,
+                   COALESCE(SUM(h.cashback), 0) AS ledger,
+                   COUNT(*) FILTER (WHERE h.type = 'purchase') AS purchases,
+                   COUNT(*) FILTER (WHERE h.type = 'admin_deduct') AS deductions
+            FROM users u
+            LEFT JOIN cashback_history h ON h.user_id = u.user_id
+            WHERE u.user_id = ANY($1::BIGINT[])
+            GROUP BY u.user_id, u.cashback_balance
+        ''', user_ids)
+        approved_in_db = await conn.fetch('''
+            SELECT user_id, COUNT(*) AS approved FROM cashback_requests
+            WHERE user_id = ANY($1::BIGINT[]) AND status = 'approved'
+            GROUP BY user_id
+        ''', user_ids)
+
+    approved_by_user = {row['user_id']: row['approved'] for row in approved_in_db}
+    problems = [f"{name} x{count}" for name, count in errors.items()]
+    problems += [f"so'rov #{request_id} {count} marta tasdiqlandi"
+                 for request_id, count in approved.items() if count > 1]
+    for row in rows:
+        user_id, balance = row['user_id'], row['cashback_balance']
+        expected = args.seed + cashback[user_id] - deducted[user_id]
+        if balance < 0:
+            problems.append(f"{user_id}: manfiy balans {balance}")
+        if balance != row['ledger']:
+            problems.append(f"{user_id}: balans {balance} != ledger {row['ledger']}")
+        if balance != expected:
+            problems.append(f"{user_id}: balans {balance} != kutilgan {expected}")
+        if row['purchases'] != approved_by_user.get(user_id, 0):
+            problems.append(f"{user_id}: purchase {row['purchases']} != tasdiqlangan {approved_by_user.get(user_id, 0)}")
+        if row['deductions'] != deductions[user_id]:
+            problems.append(f"{user_id}: admin_deduct {row['deductions']} != ayirishlar {deductions[user_id]}")
+
+    stats = {
+        'operations': len(operations),
+        'approved': len(approved),
+        'deductions': sum(deductions.values()),
+        'elapsed': elapsed,
+    }
+    return stats, problems
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=20, help="test foydalanuvchilari")
+    parser.add_argument("--requests", type=int, default=10, help="foydalanuvchi boshiga keshbek so'rovlari")
+    parser.add_argument("--admins", type=int, default=3)
+    parser.add_argument("--bulk", type=int, default=25, help="ommaviy tasdiqlash hajmi")
+    parser.add_argument("--bulk-calls", type=int, default=2, help="har bir admin uchun ommaviy tasdiqlashlar")
+    parser.add_argument("--deducts", type=int, default=200, help="har bir turdagi ayirishlar")
+    parser.add_argument("--deduct", type=int, default=5000, help="maksimal ayirish summasi")
+    parser.add_argument("--seed", type=int, default=10000, help="boshlang'ich balans")
+    parser.add_argument("--random-seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.random_seed)
+    await app.init_db()
+    failed = 0
+    try:
+        for i in range(1, args.rounds + 1):
+            stats, problems = await run_round(args, rng)
+            status = "OK" if not problems else "XATO: " + "; ".join(problems[:5])
+            print(f"#{i:3}  amallar={stats['operations']:4}  tasdiqlandi={stats['approved']:4}  "
+                  f"ayirildi={stats['deductions']:4}  {stats['elapsed'] * 1000:7.1f} ms  {status}")
+            failed += bool(problems)
+    finally:
+        async with app.db_pool.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM users WHERE user_id <= $1 AND user_id > $2", BASE_ID, BASE_ID - args.users
+            )
+        await app.close_db()
+
+    print(f"\n{args.rounds - failed}/{args.rounds} tur izchil")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,241 @@
+"""Ma'lumotlar qatlami masshtab testi: millionlab foydalanuvchi va tarix yozuvlari
+
+Har bir --sizes o'lchami uchun:
+  1. users va cashback_history COPY (copy_records_to_table) bilan shu o'lchamgacha
+     to'ldiriladi (oldingi o'lcham ustiga qo'shiladi, statistika triggerlari
+     yuklash vaqtida o'chiriladi va keyin rebuild_statistics bilan qayta hisoblanadi);
+  2. ANALYZE;
+  3. har bir ma'lumotlar funksiyasi (get_user_profile, get_statistics, get_cashback_history_page,
+     delete_user, ...) tasodifiy foydalanuvchilar bilan bir necha marta chaqiriladi
+     va p50/p95/max vaqti yoziladi;
+  4. funksiya bajargan so'rovlar (app.capture_queries) uchun EXPLAIN (ANALYZE, BUFFERS)
+     olinadi - tranzaksiya ichida, oxirida ROLLBACK (yozuvchi so'rovlar ham o'zgarmaydi).
+
+Natijalar: <out>/timings.csv va <out>/plans/<o'lcham>/<funksiya>.txt
+
+DIQQAT: DATABASE_URL dagi bazadagi users/cashback_history va bog'liq jadvallar
+TOZALANADI (TRUNCATE). Faqat alohida test bazasida --yes bilan ishlating.
+
+Ishlatish:
+    DATABASE_URL=postgresql://localhost/spk_scale python benchmarks/data_scale.py --yes \\
+        --sizes 10000,100000,1000000 --history-per-user 50
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+FIRST_USER_ID = 1_000_000_000
+COPY_CHUNK = 100_000
+NAMES = ["Aziz", "Dilnoza", "Jasur", "Malika", "Sardor", "Nodira", "Bekzod", "Gulnora", "Timur", "Zarina",
+         "Ivan", "Olga", "Rustam", "Shahnoza", "Otabek", "Madina", "Alisher", "Kamola", "Sherzod", "Feruza"]
+USER_COLUMNS = ("user_id", "username", "first_name", "last_name", "name", "phone", "language",
+                "registered", "cashback_balance", "referred_by", "referrals_count", "created_at")
+HISTORY_COLUMNS = ("user_id", "amount", "percent", "cashback", "type", "created_at")
+EXPLAIN_PREFIXES = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+# start_user uchun yangi (generatsiya qilinganlar bilan to'qnashmaydigan) ID lar
+NEW_USER_IDS = itertools.count(-700_000_000, -1)
+
+
+def random_time(rng, start, end):
+    return start + timedelta(seconds=rng.random() * (end - start).total_seconds())
+
+
+def user_records(rng, first, last, now):
+    """Foydalanuvchilar: 95% ro'yxatdan o'tgan, 20% taklif qilingan, 2 yil ichida"""
+    start = now - timedelta(days=730)
+    for user_id in range(first, last):
+        name = rng.choice(NAMES)
+        referred_by = rng.randrange(FIRST_USER_ID, user_id) if user_id > FIRST_USER_ID and rng.random() < 0.2 else None
+        yield (
+            user_id, f"user{user_id}", name, None, f"{name} {user_id % 100000}",
+            f"+99890{user_id % 10_000_000:07d}", "uz" if rng.random() < 0.8 else "ru",
+            1 if rng.random() < 0.95 else 0, 0, referred_by, 0, random_time(rng, start, now),
+        )
+
+
+def history_records(rng, first, last, per_user, now):
+    """Tarix: foydalanuvchi boshiga eksponensial taqsimlangan (bir nechta faol, ko'pchilik kam)"""
+    start = now - timedelta(days=730)
+    for user_id in range(first, last):
+        for _ in range(int(rng.expovariate(1 / per_user))):
+            kind = rng.random()
+            if kind < 0.9:
+                amount = rng.randint(10, 5000) * 1000
+                percent = rng.randint(1, 5)
+                yield (user_id, amount, percent, amount * percent // 100, "purchase", random_time(rng, start, now))
+            elif kind < 0.97:
+                yield (user_id, 0, 0, rng.choice((5000, 10000)), "referral", random_time(rng, start, now))
+            else:
+                yield (user_id, 0, 0, -rng.randint(1, 50) * 1000, "admin_deduct", random_time(rng, start, now))
+
+
+async def copy_chunks(conn, table, columns, records):
+    total = 0
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= COPY_CHUNK:
+            await conn.copy_records_to_table(table, records=chunk, columns=columns)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        await conn.copy_records_to_table(table, records=chunk, columns=columns)
+        total += len(chunk)
+    return total
+
+
+async def grow(size, per_user, rng):
+    """users ni `size` gacha to'ldirish; qo'shilgan foydalanuvchilar uchun tarix ham yoziladi"""
+    now = datetime.now()
+    async with app.db_pool.acquire() as conn:
+        # delete_user o'lchovlari oraliqda "teshik" qoldiradi, shuning uchun MAX dan davom etamiz
+        first = await conn.fetchval("SELECT COALESCE(MAX(user_id) + 1, $1) FROM users", FIRST_USER_ID)
+        last = FIRST_USER_ID + size
+        if first >= last:
+            return 0, 0
+
+        await conn.execute("ALTER TABLE users DISABLE TRIGGER USER")
+        await conn.execute("ALTER TABLE cashback_history DISABLE TRIGGER USER")
+        try:
+            users = await copy_chunks(conn, "users", USER_COLUMNS, user_records(rng, first, last, now))
+            history = await copy_chunks(
+                conn, "cashback_history", HISTORY_COLUMNS, history_records(rng, first, last, per_user, now)
+            )
+        finally:
+            await conn.execute("ALTER TABLE users ENABLE TRIGGER USER")
+            await conn.execute("ALTER TABLE cashback_history ENABLE TRIGGER USER")
+
+        # Balans va takliflar soni tarix bilan mos bo'lsin
+        await conn.execute('''
+            UPDATE users u SET cashback_balance = h.total
+            FROM (SELECT user_id, SUM(cashback) AS total FROM cashback_history
+                  WHERE user_id >= $1 AND user_id < $2 GROUP BY user_id) h
+            WHERE u.user_id = h.user_id
+        ''', first, last)
+        await conn.execute('''
+            UPDATE users u SET referrals_count = r.total
+            FROM (SELECT referred_by, COUNT(*) AS total FROM users GROUP BY referred_by) r
+            WHERE u.user_id = r.referred_by
+        ''')
+        await app.rebuild_statistics(conn)
+        await conn.execute("ANALYZE users")
+        await conn.execute("ANALYZE cashback_history")
+        return users, history
+
+
+def scenarios(size, rng):
+    """(nomi, takrorlar, chaqiruv yaratuvchi) - har bir takrorda yangi tasodifiy foydalanuvchi"""
+    def any_user():
+        return FIRST_USER_ID + rng.randrange(size)
+
+    return [
+        ("get_user_profile", 50, lambda: app.get_user_profile(any_user())),
+        ("get_cashback_balance", 50, lambda: app.get_cashback_balance(any_user())),
+        ("get_referrals_count", 50, lambda: app.get_referrals_count(any_user())),
+        ("get_cashback_history_page", 50, lambda: app.get_cashback_history_page(any_user())),
+        ("get_users_page", 20, lambda: app.get_users_page()),
+        ("search_users:name", 10, lambda: app.search_users(rng.choice(NAMES))),
+        ("search_users:short_id", 10, lambda: app.search_users(str(rng.randrange(1, 100)))),
+        ("search_users:phone", 10, lambda: app.search_users(f"90{rng.randrange(10_000_000):07d}"[:7])),
+        ("get_statistics", 10, lambda: app.get_statistics()),
+        ("start_user:new", 20, lambda: app.start_user(next(NEW_USER_IDS), "bench", "Bench", None, any_user())),
+        ("deduct_balance", 20, lambda: app.deduct_balance(any_user(), 1000)),
+        ("delete_user", 10, lambda: app.delete_user(any_user())),
+    ]
+
+
+async def explain(captured, path):
+    """Yig'ilgan so'rovlar rejasi; ANALYZE yozuvchi so'rovlarni ham bajaradi, shuning uchun ROLLBACK"""
+    lines = []
+    async with app.db_pool.acquire() as conn:
+        for name, query, args in captured:
+            if not query.lstrip().upper().startswith(EXPLAIN_PREFIXES):
+                continue
+            lines.append(f"-- {name}\n{app.query_shape(query)}\n")
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                rows = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+                lines.extend(row[0] for row in rows)
+            except Exception as e:
+                lines.append(f"EXPLAIN xatosi: {e}")
+            finally:
+                await transaction.rollback()
+            lines.append("")
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+async def measure(size, rng, out_dir, writer):
+    plans_dir = os.path.join(out_dir, "plans", str(size))
+    os.makedirs(plans_dir, exist_ok=True)
+
+    print(f"\n{'funksiya':28} {'n':>4} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for name, repeats, make_call in scenarios(size, rng):
+        with app.capture_queries() as captured:
+            await make_call()
+        await explain(captured, os.path.join(plans_dir, f"{name.replace(':', '_')}.txt"))
+
+        durations = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            await make_call()
+            durations.append((time.perf_counter() - started) * 1000)
+
+        durations.sort()
+        p50 = statistics.median(durations)
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        print(f"{name:28} {repeats:4} {p50:10.2f} {p95:10.2f} {durations[-1]:10.2f}")
+        writer.writerow([size, name, repeats, f"{p50:.3f}", f"{p95:.3f}", f"{durations[-1]:.3f}"])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="foydalanuvchilar soni (o'sish tartibida)")
+    parser.add_argument("--history-per-user", type=float, default=50, help="o'rtacha tarix yozuvlari")
+    parser.add_argument("--out", default=os.path.join("benchmarks", "results", datetime.now().strftime("%Y%m%d-%H%M%S")))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--yes", action="store_true", help="test bazasi tozalanishiga rozilik")
+    args = parser.parse_args()
+
+    if not args.yes:
+        raise SystemExit("Bu skript bazani tozalaydi. Test bazasida --yes bilan ishga tushiring.")
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    rng = random.Random(args.seed)
+    # Kesh o'lchovlarni buzmasin: har bir chaqiruv bazaga boradi
+    app.user_cache.maxsize = 0
+
+    await app.init_db()
+    os.makedirs(args.out, exist_ok=True)
+    try:
+        async with app.db_pool.acquire() as conn:
+            await conn.execute("TRUNCATE users, cashback_history, cashback_requests, stats_deltas, daily_stats CASCADE")
+
+        with open(os.path.join(args.out, "timings.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["users", "function", "n", "p50_ms", "p95_ms", "max_ms"])
+            for size in sizes:
+                started = time.perf_counter()
+                users, history = await grow(size, args.history_per_user, rng)
+                print(f"\n=== {size} foydalanuvchi: +{users} users, +{history} tarix, "
+                      f"yuklash {time.perf_counter() - started:.1f} s ===")
+                await measure(size, rng, args.out, writer)
+                f.flush()
+        print(f"\nNatijalar: {args.out}")
+    finally:
+        await app.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,385 @@
+"""Dispatcher orqali to'liq yuklama testi (router + handlerlar + PostgreSQL)
+
+Sintetik Message/CallbackQuery update'lar to'g'ridan-to'g'ri Dispatcher.feed_update
+ga beriladi: tarmoq va Telegram yo'q, Bot API jarayon ichida soxtalashtirilgan
+(har bir chaqiruv --api-latency ms kutadi) yoki --api-url bilan lokal soxta serverga
+(benchmarks/mock_bot_api.py) yuboriladi. Baza va FSM (PostgresStorage) - haqiqiy.
+
+Har bir "sessiya" - bitta foydalanuvchining ketma-ket update'lari (FSM tartibi
+buzilmasligi uchun). --concurrency ta sessiya parallel ishlaydi, barcha update'lar
+umumiy --rate (update/s) chegarasidan o'tadi.
+
+Sessiya turlari (--mix bilan og'irliklari):
+  register      /start -> til -> ism -> telefon (yangi foydalanuvchi)
+  register_ref  xuddi shunday, /start ref_<id> deep link bilan
+  start         ro'yxatdan o'tgan foydalanuvchi /start
+  balance       balans tugmasi
+  history       tarix + keyingi sahifa
+  cashback      keshbek -> summa -> rasm
+  admin         navbatdagi so'rovlarni tasdiqlash (ccf_<id>)
+
+Standart holatda anti-flood (ThrottlingMiddleware) va foydalanuvchi navbati chegarasi
+(UserScheduler max_queue) o'chiriladi - aks holda tashlab yuborilgan yoki cheklangan
+update'lar ham "bajarilgan" deb sanalardi. --production-limits bilan production
+chegaralari qoldiriladi; har ikki holatda bajarilgan, navbatdan tashlangan,
+cheklangan va handlersiz update'lar alohida chiqariladi.
+
+Natija: update/s va har bir handler uchun p50/p95/p99.
+
+DIQQAT: DATABASE_URL dagi bazaga yozadi - faqat test bazasida ishlating.
+Test foydalanuvchilari (manfiy ID lar) oxirida o'chiriladi.
+
+Ishlatish:
+    DATABASE_URL=postgresql://localhost/spk_test python benchmarks/load_dispatcher.py \\
+        --sessions 2000 --rate 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+TOKEN = "123456:TEST"
+BOT_ID = 123456
+# Test foydalanuvchilari: BASE_ID, BASE_ID - 1, ... (haqiqiy foydalanuvchilar bilan to'qnashmaydi)
+BASE_ID = -800000000
+ADMIN_ID = BASE_ID - 999999
+DEFAULT_MIX = "register=10,register_ref=5,start=15,balance=25,history=20,cashback=20,admin=5"
+
+
+class FakeSession(BaseSession):
+    """Bot API ni jarayon ichida soxtalashtirish: har bir metodga mos javob qaytaradi"""
+
+    TRUE_METHODS = {"answerCallbackQuery", "deleteMessage", "setWebhook", "deleteWebhook"}
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if name == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif name in self.TRUE_METHODS:
+            result = True
+        else:
+            chat_id = getattr(method, "chat_id", None) or 1
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+
+        response = self.check_response(bot, method, 200, json.dumps({"ok": True, "result": result}))
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class UpdateFactory:
+    """Sintetik update'lar (Bot ga bog'langan holda)"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Bench{-user_id}"}
+
+    def _chat(self, user_id):
+        return {"id": user_id, "type": "private"}
+
+    def _update(self, **payload):
+        return Update.model_validate({"update_id": next(self._ids), **payload}, context={"bot": self.bot})
+
+    def message(self, user_id, **fields):
+        message_id = next(self._ids)
+        return self._update(message={
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": self._chat(user_id),
+            "from": self._user(user_id),
+            **fields,
+        })
+
+    def text(self, user_id, text):
+        return self.message(user_id, text=text)
+
+    def contact(self, user_id):
+        return self.message(user_id, contact={
+            "phone_number": f"+99890{-user_id % 10000000:07d}", "first_name": "Bench", "user_id": user_id
+        })
+
+    def photo(self, user_id):
+        return self.message(user_id, photo=[{
+            "file_id": f"bench-photo-{user_id}", "file_unique_id": f"u{user_id}", "width": 800, "height": 600
+        }])
+
+    def callback(self, user_id, data, caption=None):
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": self._chat(user_id),
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"},
+        }
+        if caption is None:
+            message["text"] = "bench"
+        else:
+            message["caption"] = caption
+            message["photo"] = [{"file_id": "bench", "file_unique_id": "bench", "width": 1, "height": 1}]
+        return self._update(callback_query={
+            "id": str(next(self._ids)),
+            "from": self._user(user_id),
+            "chat_instance": "bench",
+            "message": message,
+            "data": data,
+        })
+
+
+class LoadGenerator:
+    def __init__(self, dp, bot, args):
+        self.dp = dp
+        self.bot = bot
+        self.args = args
+        self.updates = UpdateFactory(bot)
+        self.limiter = app.TokenBucket(args.rate)
+        self.latencies = []
+        self.errors = Counter()
+        self.unhandled = 0
+        self.new_user_ids = itertools.count(BASE_ID - args.users, -1)
+        self.mix = parse_mix(args.mix)
+
+    def registered_user(self):
+        return BASE_ID - random.randrange(self.args.users)
+
+    async def feed(self, update):
+        await self.limiter.acquire()
+        started = time.perf_counter()
+        try:
+            result = await self.dp.feed_update(self.bot, update)
+            if result is UNHANDLED:
+                self.unhandled += 1
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    async def session_register(self, referrer=None):
+        user_id = next(self.new_user_ids)
+        start = "/start" if referrer is None else f"/start ref_{referrer}"
+        await self.feed(self.updates.text(user_id, start))
+        await self.feed(self.updates.callback(user_id, "lang_uz"))
+        await self.feed(self.updates.text(user_id, "Bench User"))
+        await self.feed(self.updates.contact(user_id))
+
+    async def session_register_ref(self):
+        await self.session_register(referrer=self.registered_user())
+
+    async def session_start(self):
+        await self.feed(self.updates.text(self.registered_user(), "/start"))
+
+    async def session_balance(self):
+        await self.feed(self.updates.callback(self.registered_user(), "balance"))
+
+    async def session_history(self):
+        user_id = self.registered_user()
+        await self.feed(self.updates.callback(user_id, "history"))
+        cursor = app.encode_cursor(app.datetime.now(), 2 ** 31 - 1)
+        await self.feed(self.updates.callback(user_id, f"history_next_{cursor}"))
+
+    async def session_cashback(self):
+        user_id = self.registered_user()
+        await self.feed(self.updates.callback(user_id, "cashback"))
+        await self.feed(self.updates.text(user_id, str(random.randint(10, 5000) * 1000)))
+        await self.feed(self.updates.photo(user_id))
+
+    async def session_admin(self):
+        async with app.db_pool.acquire() as conn:
+            request_ids = await conn.fetch('''
+                SELECT id FROM cashback_requests
+                WHERE status = 'pending' AND user_id <= $1
+                ORDER BY id LIMIT 5
+            ''', BASE_ID)
+        for row in request_ids:
+            await self.feed(self.updates.callback(ADMIN_ID, f"ccf_{row['id']}", caption="bench"))
+
+    async def worker(self, queue):
+        while True:
+            kind = await queue.get()
+            try:
+                await getattr(self, f"session_{kind}")()
+            finally:
+                queue.task_done()
+
+    async def run(self):
+        kinds, weights = zip(*self.mix.items())
+        queue = asyncio.Queue()
+        for kind in random.choices(kinds, weights, k=self.args.sessions):
+            queue.put_nowait(kind)
+
+        started = time.perf_counter()
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(self.args.concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return time.perf_counter() - started
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if not hasattr(LoadGenerator, f"session_{kind.strip()}"):
+            raise SystemExit(f"Noma'lum sessiya turi: {kind}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def handler_recorder(durations):
+    """app.router ga qo'shiladigan middleware: handler nomi bo'yicha aniq vaqtlar"""
+    async def middleware(handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            durations[name].append(time.perf_counter() - started)
+    return middleware
+
+
+async def seed(users, history):
+    """Ro'yxatdan o'tgan test foydalanuvchilari va ularning tarixini yaratish"""
+    async with app.db_pool.acquire() as conn:
+        await conn.execute('''
+            INSERT INTO users (user_id, first_name, name, phone, language, registered, cashback_balance)
+            SELECT $1::BIGINT - i, 'Bench', 'Bench ' || i, '+99890' || LPAD(i::TEXT, 7, '0'), 'uz', 1, 100000
+            FROM generate_series(0, $2::INTEGER - 1) AS i
+            ON CONFLICT (user_id) DO NOTHING
+        ''', BASE_ID, users)
+        await conn.execute('''
+            INSERT INTO cashback_history (user_id, amount, percent, cashback, type)
+            SELECT $1::BIGINT - (i % $2::INTEGER), 100000, 3, 3000, 'purchase'
+            FROM generate_series(0, $2::INTEGER * $3::INTEGER - 1) AS i
+        ''', BASE_ID, users, history)
+
+
+async def cleanup():
+    async with app.db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM fsm_storage WHERE user_id <= $1 AND user_id >= $2", BASE_ID, ADMIN_ID)
+        await conn.execute("DELETE FROM users WHERE user_id <= $1 AND user_id >= $2", BASE_ID, ADMIN_ID)
+
+
+def percentiles(values):
+    values = sorted(x * 1000 for x in values)
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return value, value, value
+    q = statistics.quantiles(values, n=100)
+    return q[49], q[94], q[98]
+
+
+def report(elapsed, generator, durations, session, scheduler):
+    total = len(generator.latencies)
+    handled = sum(len(values) for values in durations.values())
+    throttled = sum(app.THROTTLED.values())
+    print(f"\nUpdate'lar: {total}  vaqt: {elapsed:.2f} s  tezlik: {total / elapsed:.1f} update/s")
+    print(f"Bajarilgan: {handled} ({handled / elapsed:.1f} update/s)  navbatdan tashlangan: {scheduler.dropped}  "
+          f"cheklangan (throttling): {throttled}  handlersiz: {generator.unhandled}")
+    p50, p95, p99 = percentiles(generator.latencies)
+    print(f"feed_update: p50={p50:.2f} ms  p95={p95:.2f} ms  p99={p99:.2f} ms")
+    if generator.errors:
+        print(f"Xatolar: {dict(generator.errors)}")
+
+    print(f"\n{'handler':32} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, values in sorted(durations.items(), key=lambda item: -len(item[1])):
+        p50, p95, p99 = percentiles(values)
+        print(f"{name:32} {len(values):7} {p50:9.2f} {p95:9.2f} {p99:9.2f}")
+
+    print(f"\nBot API chaqiruvlari: {dict(session.calls)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=500, help="update/s")
+    parser.add_argument("--concurrency", type=int, default=50, help="parallel sessiyalar")
+    parser.add_argument("--users", type=int, default=1000, help="oldindan yaratiladigan foydalanuvchilar")
+    parser.add_argument("--history", type=int, default=20, help="har bir foydalanuvchi uchun tarix yozuvlari")
+    parser.add_argument("--api-latency", type=float, default=0, help="soxta Bot API kechikishi, ms")
+    parser.add_argument("--api-url", help="soxta Bot API server, masalan http://127.0.0.1:8081")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--keep", action="store_true", help="test ma'lumotlarini o'chirmaslik")
+    parser.add_argument("--production-limits", action="store_true",
+                        help="anti-flood va navbat chegarasini production qiymatlarida qoldirish")
+    args = parser.parse_args()
+
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    app.ADMIN_IDS.add(ADMIN_ID)
+
+    await app.init_db()
+    if args.api_url:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(args.api_url))
+        session.calls = Counter()  # hisobni soxta server o'zi yuritadi (/_stats)
+    else:
+        session = FakeSession(args.api_latency / 1000)
+    bot = Bot(token=TOKEN, session=session)
+    if args.production_limits:
+        scheduler = app.update_scheduler
+    else:
+        scheduler = app.UserScheduler(max_queue=args.sessions * 4)
+        app.throttling_middleware.default_limit = (1e9, 1e9)
+        app.throttling_middleware.handler_limits = {}
+    dp = app.build_dispatcher(scheduler=scheduler)
+
+    durations = defaultdict(list)
+    recorder = handler_recorder(durations)
+    app.router.message.middleware(recorder)
+    app.router.callback_query.middleware(recorder)
+
+    try:
+        await cleanup()
+        await seed(args.users, args.history)
+        generator = LoadGenerator(dp, bot, args)
+        elapsed = await generator.run()
+        # Fonda qolgan yuborishlar (admin xabarlari) - Bot API hisobi to'liq bo'lsin
+        await asyncio.gather(*app.background_tasks, return_exceptions=True)
+        report(elapsed, generator, durations, session, scheduler)
+    finally:
+        if not args.keep:
+            await cleanup()
+        await session.close()
+        await app.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,250 @@
+"""Lokal soxta Telegram Bot API server (tarmoqsiz benchmark va regression testlar uchun)
+
+Telegram xatti-harakatini taqlid qiladi:
+  - har bir so'rovga aylanma kechikish (--latency ms, --jitter ms gacha tasodifiy
+    qo'shimcha): yarmi so'rov serverga yetguncha, yarmi javob qaytguncha;
+  - getUpdates long polling: push_update() bilan qo'shilgan update'lar offset/timeout
+    bo'yicha qaytariladi;
+  - umumiy chegara: soniyasiga --global-rate dan ortiq xabar -> 429 retry_after;
+  - chat bo'yicha chegara: bitta chatga soniyasiga --chat-rate dan ortiq -> 429 retry_after;
+  - --blocked ulushdagi chatlar -> 403 "bot was blocked by the user",
+    --deactivated ulushdagilar -> 403 "user is deactivated" (chat ID bo'yicha barqaror).
+Yuborilgan barcha xabarlar yoziladi: GET /_stats - hisoblagichlar, GET /_sent - xabarlar,
+POST /_reset - tozalash.
+
+Botni shu serverga yo'naltirish:
+    python benchmarks/mock_bot_api.py --port 8081 --latency 40 --blocked 0.05
+    BOT_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123456:TEST python app.py
+
+Boshqa benchmarklar MockBotAPI ni jarayon ichida ham ishga tushirishi mumkin
+(benchmarks/outbound_throughput.py ga qarang).
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Mock", "username": "mock_bot"}
+
+# Xabar yuboradigan (chat limitlariga tushadigan) metodlar
+SEND_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendAnimation",
+    "sendAudio", "sendVoice", "sendSticker", "sendLocation", "sendContact",
+    "copyMessage", "forwardMessage",
+}
+# Message qaytaradigan boshqa metodlar
+MESSAGE_METHODS = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+
+class MockBotAPI:
+    def __init__(self, latency=0.0, jitter=0.0, global_rate=30.0, chat_rate=1.0,
+                 retry_after=1, blocked=0.0, deactivated=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.retry_after = retry_after
+        self.blocked = blocked
+        self.deactivated = deactivated
+        self.seed = seed
+        self.updates = []
+        self._updates_changed = asyncio.Condition()
+        self.reset()
+
+    def reset(self):
+        self.sent = []
+        self.stats = Counter()
+        self.methods = Counter()
+        self._window = deque()  # oxirgi 1 soniyadagi yuborishlar vaqti
+        self._chat_last = {}
+        self._message_id = 0
+        self.started_at = time.monotonic()
+
+    def chat_status(self, chat_id):
+        """Chat holati ID ga bog'liq va har safar bir xil: ok / blocked / deactivated"""
+        value = random.Random(chat_id * 7919 + self.seed).random()
+        if value < self.blocked:
+            return "blocked"
+        if value < self.blocked + self.deactivated:
+            return "deactivated"
+        return "ok"
+
+    def _rate_limited(self, chat_id, now):
+        """429 kerak bo'lsa True. Umumiy - sirpanuvchi 1 soniyalik oyna, chat - minimal interval"""
+        while self._window and self._window[0] <= now - 1:
+            self._window.popleft()
+        if self.global_rate and len(self._window) >= self.global_rate:
+            return True
+        last = self._chat_last.get(chat_id)
+        if self.chat_rate and last is not None and now - last < 1 / self.chat_rate:
+            return True
+        self._window.append(now)
+        self._chat_last[chat_id] = now
+        return False
+
+    def _message(self, chat_id, data):
+        self._message_id += 1
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in data:
+            message["text"] = data["text"]
+        return message
+
+    @staticmethod
+    def error(code, description, **parameters):
+        payload = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return web.json_response(payload, status=code)
+
+    async def push_update(self, update):
+        """getUpdates (long polling) orqali beriladigan update qo'shish"""
+        async with self._updates_changed:
+            self.updates.append(update)
+            self._updates_changed.notify_all()
+
+    async def _get_updates(self, data):
+        offset = int(data.get("offset", 0) or 0)
+        timeout = float(data.get("timeout", 0) or 0)
+        async with self._updates_changed:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self._updates_changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self.updates[:100]
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        data = dict(await request.post()) if request.can_read_body else {}
+        self.methods[method] += 1
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay / 2)  # so'rov serverga yetib borishi
+        response = await self._dispatch(method, data)
+        if delay:
+            await asyncio.sleep(delay / 2)  # javob qaytishi
+        return response
+
+    async def _dispatch(self, method, data):
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": BOT_USER})
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(data)})
+
+        if method in SEND_METHODS:
+            chat_id = int(data.get("chat_id", 0))
+            status = self.chat_status(chat_id)
+            if status == "blocked":
+                self.stats["blocked"] += 1
+                return self.error(403, "Forbidden: bot was blocked by the user")
+            if status == "deactivated":
+                self.stats["deactivated"] += 1
+                return self.error(403, "Forbidden: user is deactivated")
+            if self._rate_limited(chat_id, time.monotonic()):
+                self.stats["retry_after"] += 1
+                return self.error(
+                    429, f"Too Many Requests: retry after {self.retry_after}", retry_after=self.retry_after
+                )
+
+            self.stats["sent"] += 1
+            self.sent.append({
+                "time": time.monotonic() - self.started_at,
+                "method": method,
+                "chat_id": chat_id,
+                "text": data.get("text") or data.get("caption"),
+            })
+            return web.json_response({"ok": True, "result": self._message(chat_id, data)})
+
+        if method in MESSAGE_METHODS:
+            chat_id = int(data.get("chat_id", 0) or 0)
+            return web.json_response({"ok": True, "result": self._message(chat_id, data)})
+
+        return web.json_response({"ok": True, "result": True})
+
+    async def handle_stats(self, request):
+        elapsed = time.monotonic() - self.started_at
+        return web.json_response({
+            "elapsed": elapsed,
+            "stats": dict(self.stats),
+            "methods": dict(self.methods),
+            "sent_per_second": self.stats["sent"] / elapsed if elapsed else 0.0,
+        })
+
+    async def handle_sent(self, request):
+        return web.json_response(self.sent)
+
+    async def handle_reset(self, request):
+        self.reset()
+        return web.json_response({"ok": True})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/_stats", self.handle_stats)
+        app.router.add_get("/_sent", self.handle_sent)
+        app.router.add_post("/_reset", self.handle_reset)
+        return app
+
+    async def start(self, host="127.0.0.1", port=8081):
+        """Serverni fonda ishga tushirish; to'xtatish uchun runner.cleanup()"""
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=30, help="har bir so'rovning aylanma kechikishi, ms")
+    parser.add_argument("--jitter", type=float, default=10, help="qo'shimcha tasodifiy kechikish, ms")
+    parser.add_argument("--global-rate", type=float, default=30, help="umumiy xabar/s chegarasi (0 - yo'q)")
+    parser.add_argument("--chat-rate", type=float, default=1, help="bitta chat uchun xabar/s (0 - yo'q)")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 dagi retry_after, s")
+    parser.add_argument("--blocked", type=float, default=0.02, help="botni bloklagan chatlar ulushi")
+    parser.add_argument("--deactivated", type=float, default=0.01, help="o'chirilgan akkauntlar ulushi")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def from_arguments(args):
+    return MockBotAPI(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        global_rate=args.global_rate,
+        chat_rate=args.chat_rate,
+        retry_after=args.retry_after,
+        blocked=args.blocked,
+        deactivated=args.deactivated,
+        seed=args.seed,
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    runner = await from_arguments(args).start(args.host, args.port)
+    print(f"Soxta Bot API: http://{args.host}:{args.port}  (statistika: /_stats)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
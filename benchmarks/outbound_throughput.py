@@ -0,0 +1,137 @@
+"""Chiquvchi xabarlar tezligi: broadcast va keshbek bildirishnomalari
+
+Bot lokal soxta Bot API ga (benchmarks/mock_bot_api.py) ulanadi, shuning uchun
+tarmoq va haqiqiy Telegram kerak emas. Baza ham kerak emas: broadcast uchun
+app.Broadcast ning yuborish qismi (_run_batch, checkpointsiz), bildirishnomalar uchun
+app.send_notifications to'g'ridan-to'g'ri chaqiriladi.
+
+"combined" - ikkalasi bir vaqtda, app dagidek bitta umumiy limiter bilan: jami tezlik
+--rate dan oshmasligi (429 lar soni) shu yerda ko'rinadi.
+
+Tekshiruvlar (regression): bloklanmagan har bir chat xabarni aynan bir marta oladi,
+bloklangan/o'chirilganlar "yuborildi" deb hisoblanmaydi. Xato bo'lsa chiqish kodi 1.
+
+Ishlatish:
+    python benchmarks/outbound_throughput.py --recipients 2000 --rate 25 --global-rate 30
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+from mock_bot_api import add_arguments, from_arguments  # noqa: E402
+
+TOKEN = "123456:TEST"
+PORT = 8813
+
+
+def fake_job(total):
+    return {
+        "id": 0, "owner": None, "message_type": "text", "content": "Benchmark broadcast", "caption": None,
+        "created_at": datetime.now(), "last_user_id": 0,
+        "status_chat_id": None, "status_message_id": None,
+        "total": total, "sent": 0, "blocked": 0, "deactivated": 0, "errors": 0,
+    }
+
+
+def check(api, chat_ids, delivered):
+    """Har bir 'ok' chatga aynan bitta xabar, boshqalariga - hech narsa"""
+    problems = []
+    received = Counter(item["chat_id"] for item in api.sent)
+    for chat_id in chat_ids:
+        expected = 1 if api.chat_status(chat_id) == "ok" else 0
+        if received[chat_id] != expected:
+            problems.append(f"chat {chat_id}: {received[chat_id]} ta xabar (kutilgan {expected})")
+    if delivered != sum(received.values()):
+        problems.append(f"hisoblangan {delivered} != server qabul qilgan {sum(received.values())}")
+    return problems
+
+
+def report(name, elapsed, api, extra=""):
+    stats = api.stats
+    print(f"{name:14} {elapsed:7.2f} s  yuborildi={stats['sent']:6}  {stats['sent'] / elapsed:7.1f} xabar/s  "
+          f"429={stats['retry_after']}  403={stats['blocked'] + stats['deactivated']}  {extra}")
+
+
+async def bench_broadcast(api, bot, chat_ids, args):
+    api.reset()
+    broadcast = app.Broadcast(bot, fake_job(len(chat_ids)), concurrency=args.concurrency,
+                              limiter=app.TokenBucket(args.rate), checkpoint_size=0)
+    results = {}
+    started = time.perf_counter()
+    await broadcast._run_batch(chat_ids, results)
+    elapsed = time.perf_counter() - started
+    report("broadcast", elapsed, api, f"qayta urinishlar={broadcast.retries} xato={broadcast.errors}")
+    return check(api, chat_ids, broadcast.sent)
+
+
+async def bench_notifications(api, bot, chat_ids, args):
+    api.reset()
+    messages = [(chat_id, f"✅ Cashback {chat_id}") for chat_id in chat_ids]
+    started = time.perf_counter()
+    delivered = await app.send_notifications(bot, messages, concurrency=args.concurrency,
+                                             limiter=app.TokenBucket(args.rate))
+    elapsed = time.perf_counter() - started
+    report("notifications", elapsed, api)
+    return check(api, chat_ids, delivered)
+
+
+async def bench_combined(api, bot, chat_ids, args):
+    """Broadcast va bildirishnomalar parallel, bitta limiter bilan"""
+    api.reset()
+    limiter = app.TokenBucket(args.rate)
+    half = len(chat_ids) // 2
+    broadcast_ids, notify_ids = chat_ids[:half], chat_ids[half:]
+    broadcast = app.Broadcast(bot, fake_job(len(broadcast_ids)), concurrency=args.concurrency,
+                              limiter=limiter, checkpoint_size=0)
+    messages = [(chat_id, f"✅ Cashback {chat_id}") for chat_id in notify_ids]
+    started = time.perf_counter()
+    _, delivered = await asyncio.gather(
+        broadcast._run_batch(broadcast_ids, {}),
+        app.send_notifications(bot, messages, concurrency=args.concurrency, limiter=limiter),
+    )
+    elapsed = time.perf_counter() - started
+    report("combined", elapsed, api, f"qayta urinishlar={broadcast.retries}")
+    return check(api, chat_ids, broadcast.sent + delivered)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=app.BROADCAST_CONCURRENCY, help="parallel yuboruvchilar")
+    parser.add_argument("--rate", type=float, default=app.BROADCAST_RATE, help="bot tomonidagi limiter, xabar/s")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    api = from_arguments(args)
+    runner = await api.start(port=PORT)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{PORT}"))
+    bot = Bot(token=TOKEN, session=session)
+    chat_ids = list(range(1, args.recipients + 1))
+
+    problems = []
+    try:
+        problems += await bench_broadcast(api, bot, chat_ids, args)
+        problems += await bench_notifications(api, bot, chat_ids, args)
+        problems += await bench_combined(api, bot, chat_ids, args)
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+    for problem in problems[:20]:
+        print(f"XATO: {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
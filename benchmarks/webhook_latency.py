@@ -0,0 +1,140 @@
+"""Polling va webhook rejimlarida update yetkazish kechikishini solishtirish
+
+Telegram o'rniga lokal soxta Bot API server (benchmarks/mock_bot_api.py) ishlatiladi,
+tarmoq kerak emas.
+Handler faqat qabul qilingan vaqtni yozadi - shuning uchun bu transport
+(getUpdates long polling va webhook POST) kechikishini o'lchaydi, bazani emas.
+--rtt Telegram serverigacha bo'lgan tarmoq kechikishini taqlid qiladi: polling
+har bir getUpdates uchun to'liq aylanma yo'l to'laydi, webhook esa bir tomonlama.
+
+Ishlatish:
+    python benchmarks/webhook_latency.py --updates 2000 --rate 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import web, ClientSession
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import LimitedRequestHandler  # noqa: E402
+from mock_bot_api import MockBotAPI  # noqa: E402
+
+TOKEN = "123456:TEST"
+SECRET = "benchmark-secret"
+API_PORT = 8811
+WEBHOOK_PORT = 8812
+
+
+def make_update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+            "text": repr(time.perf_counter()),
+        },
+    }
+
+
+def build_dispatcher(latencies, done, total):
+    router = Router()
+
+    @router.message()
+    async def record(message: Message):
+        latencies.append(time.perf_counter() - float(message.text))
+        if len(latencies) >= total:
+            done.set()
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def run_polling(api, bot, updates, rate):
+    latencies, done = [], asyncio.Event()
+    dp = build_dispatcher(latencies, done, updates)
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await asyncio.sleep(0.5)
+    
+    for i in range(1, updates + 1):
+        await api.push_update(make_update(i))
+        await asyncio.sleep(1 / rate)
+    
+    await asyncio.wait_for(done.wait(), 60)
+    await dp.stop_polling()
+    await polling
+    return latencies
+
+
+async def run_webhook(bot, updates, rate, concurrency, rtt):
+    latencies, done = [], asyncio.Event()
+    dp = build_dispatcher(latencies, done, updates)
+    
+    app = web.Application()
+    LimitedRequestHandler(dispatcher=dp, bot=bot, concurrency=concurrency, secret_token=SECRET).register(app, path="/webhook")
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", WEBHOOK_PORT).start()
+    
+    url = f"http://127.0.0.1:{WEBHOOK_PORT}/webhook"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    async with ClientSession() as session:
+        async def post(update):
+            await asyncio.sleep(rtt / 2)  # Telegram -> bot
+            async with session.post(url, json=update, headers=headers) as response:
+                response.raise_for_status()
+        
+        posts = []
+        for i in range(1, updates + 1):
+            posts.append(asyncio.create_task(post(make_update(i))))
+            await asyncio.sleep(1 / rate)
+        await asyncio.gather(*posts)
+    
+    await asyncio.wait_for(done.wait(), 60)
+    await runner.cleanup()
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(x * 1000 for x in latencies)
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{name:8} n={len(latencies):6}  mean={statistics.mean(latencies):7.2f} ms  "
+          f"p50={q[49]:7.2f} ms  p95={q[94]:7.2f} ms  p99={q[98]:7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=200, help="update/s")
+    parser.add_argument("--concurrency", type=int, default=100, help="webhook handler limiti")
+    parser.add_argument("--rtt", type=float, default=50, help="Telegramgacha aylanma kechikish, ms")
+    args = parser.parse_args()
+    
+    rtt = args.rtt / 1000
+    # Faqat transport kechikishi: limitlar va bloklangan chatlar yo'q
+    api = MockBotAPI(latency=rtt, global_rate=0, chat_rate=0)
+    api_runner = await api.start(port=API_PORT)
+    
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{API_PORT}"))
+    bot = Bot(token=TOKEN, session=session)
+    
+    try:
+        report("polling", await run_polling(api, bot, args.updates, args.rate))
+        report("webhook", await run_webhook(bot, args.updates, args.rate, args.concurrency, rtt))
+    finally:
+        await session.close()
+        await api_runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+import inspect
+import itertools
+import json
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+TOKEN = "123456:TEST"
+BOT_ID = 123456
+
+
+class RecordingSession(BaseSession):
+    """Bot API siz sessiya: chaqiruvlarni yozib boradi va oddiy javob qaytaradi"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.requests.append((name, method))
+        if name == "answerCallbackQuery":
+            result = True
+        else:
+            result = {
+                "message_id": len(self.requests),
+                "date": int(time.time()),
+                "chat": {"id": getattr(method, "chat_id", None) or 1, "type": "private"},
+            }
+        return self.check_response(bot, method, 200, json.dumps({"ok": True, "result": result})).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+    def called(self, name):
+        return [method for method_name, method in self.requests if method_name == name]
+
+
+class FakePool:
+    """db_pool o'rnida: so'rovlarni yozib boradi, javobni respond(method, query, args) beradi"""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.queries = []
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        yield self
+
+    async def _call(self, method, query, args):
+        self.queries.append((method, query, args))
+        result = self.respond(method, query, args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def execute(self, query, *args):
+        return await self._call("execute", query, args)
+
+    async def fetch(self, query, *args):
+        return await self._call("fetch", query, args)
+
+    async def fetchrow(self, query, *args):
+        return await self._call("fetchrow", query, args)
+
+    async def fetchval(self, query, *args):
+        return await self._call("fetchval", query, args)
+
+
+class Updates:
+    """Sintetik update'lar"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _update(self, **payload):
+        return Update.model_validate({"update_id": next(self._ids), **payload}, context={"bot": self.bot})
+
+    def _message(self, user_id, **fields):
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            **fields,
+        }
+
+    def text(self, user_id, text):
+        return self._update(message=self._message(user_id, text=text))
+
+    def callback(self, user_id, data):
+        return self._update(callback_query={
+            "id": str(next(self._ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "chat_instance": "test",
+            "message": self._message(user_id, text="test"),
+            "data": data,
+        })
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    """app.db_pool ni FakePool bilan almashtirish (va toza foydalanuvchi keshi)"""
+    def install(respond):
+        pool = FakePool(respond)
+        monkeypatch.setattr(app, "db_pool", pool)
+        return pool
+
+    monkeypatch.setattr(app, "user_cache", app.UserCache(100, 60))
+    return install
+
+
+@pytest.fixture
+def session():
+    return RecordingSession()
+
+
+@pytest.fixture
+def bot(session):
+    return Bot(token=TOKEN, session=session)
+
+
+@pytest.fixture
+def updates(bot):
+    return Updates(bot)
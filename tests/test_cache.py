@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import app
+
+
+def test_lru_eviction_keeps_recently_used():
+    cache = app.TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"  # 1 endi eng yangi
+    cache.set(3, "c")
+
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+    assert cache.evictions == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = app.TTLCache(maxsize=10, ttl=0.01)
+    cache.set(1, "a")
+    assert cache.get(1) == "a"
+    time.sleep(0.02)
+
+    assert cache.get(1) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    for cache in (app.TTLCache(maxsize=0, ttl=60), app.TTLCache(maxsize=10, ttl=0)):
+        cache.set(1, "a")
+        assert cache.get(1) is None
+
+
+def test_stats_count_hits_and_misses():
+    cache = app.TTLCache(maxsize=10, ttl=60)
+    cache.set(1, "a")
+    cache.get(1)
+    cache.get(1)
+    cache.get(2)
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert round(stats['hit_rate'], 1) == 66.7
+
+
+def test_load_stores_when_nothing_was_written():
+    cache = app.UserCache(maxsize=10, ttl=60)
+    with cache.loading(1) as store:
+        store("uz")
+    assert cache.get(1) == "uz"
+    assert not cache._loading
+
+
+def test_write_during_load_discards_loaded_value():
+    cache = app.UserCache(maxsize=10, ttl=60)
+    with cache.loading(1) as store:
+        cache.invalidate(1)
+        store("old")
+    assert cache.get(1) is None
+
+    # Keyingi o'qish yana keshga yozadi
+    with cache.loading(1) as store:
+        store("new")
+    assert cache.get(1) == "new"
+
+
+def test_write_for_other_user_does_not_discard_load():
+    cache = app.UserCache(maxsize=10, ttl=60)
+    with cache.loading(1) as store:
+        cache.invalidate(2)
+        store("uz")
+    assert cache.get(1) == "uz"
+
+
+def test_language_read_overlapping_update_is_not_cached(fake_pool):
+    read_started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def respond(method, query, args):
+        if query.startswith("SELECT language"):
+            read_started.set()
+            await release.wait()
+            return {"language": "uz"}  # UPDATE dan oldingi qiymat
+        return "UPDATE 1"
+
+    fake_pool(respond)
+
+    async def scenario():
+        read = asyncio.create_task(app.load_user_language(1))
+        await read_started.wait()
+        await app.update_language(1, "ru")
+        release.set()
+        return await read
+
+    assert asyncio.run(scenario()) == "uz"
+    assert app.user_cache.get(1) is None
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+from aiogram.fsm.storage.base import StorageKey
+
+import app
+from conftest import BOT_ID
+
+KEY = StorageKey(bot_id=BOT_ID, chat_id=42, user_id=42)
+
+
+def shared_table(fake_pool):
+    """Ikkala storage uchun umumiy fsm_storage "jadvali" (bitta baza)"""
+    rows = {}
+
+    def respond(method, query, args):
+        query = " ".join(query.split())
+        key = tuple(args[:3])
+        if query.startswith("SELECT state, data FROM fsm_storage"):
+            row = rows.get(key)
+            return {"state": row[0], "data": json.dumps(row[1])} if row else None
+        if query.startswith("INSERT INTO fsm_storage (bot_id, chat_id, user_id, state,"):
+            state, data = rows.get(key, (None, {}))
+            rows[key] = (args[3], data)
+            return json.dumps(data)
+        if query.startswith("INSERT INTO fsm_storage (bot_id, chat_id, user_id, data,"):
+            state, _ = rows.get(key, (None, {}))
+            rows[key] = (state, json.loads(args[3]))
+            return state
+        if query.startswith("DELETE FROM fsm_storage"):
+            rows.pop(key, None)
+            return "DELETE 1"
+        raise AssertionError(query)
+
+    fake_pool(respond)
+    return rows
+
+
+def test_without_cache_other_instance_write_is_seen(fake_pool):
+    shared_table(fake_pool)
+    first, second = app.PostgresStorage(cache_ttl=0), app.PostgresStorage(cache_ttl=0)
+
+    async def scenario():
+        await first.set_state(KEY, "CashbackState:waiting_for_amount")
+        assert await second.get_state(KEY) == "CashbackState:waiting_for_amount"
+        await second.set_state(KEY, "CashbackState:waiting_for_photo")
+        return await first.get_state(KEY)
+
+    assert asyncio.run(scenario()) == "CashbackState:waiting_for_photo"
+
+
+def test_local_cache_serves_own_writes(fake_pool):
+    shared_table(fake_pool)
+    storage = app.PostgresStorage(cache_ttl=60)
+
+    async def scenario():
+        await storage.set_state(KEY, "Registration:name")
+        await storage.set_data(KEY, {"language": "uz"})
+        reads_before = len(app.db_pool.queries)
+        state = await storage.get_state(KEY)
+        data = await storage.get_data(KEY)
+        return state, data, len(app.db_pool.queries) - reads_before
+
+    assert asyncio.run(scenario()) == ("Registration:name", {"language": "uz"}, 0)
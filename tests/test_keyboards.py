@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pytest
+
+import app
+
+# Telegram callback_data chegarasi - 64 bayt
+MAX_CALLBACK_DATA = 64
+
+MAX_USER_ID = -(2 ** 63)  # eng uzun BIGINT (ishora bilan)
+MAX_SERIAL = 2 ** 31 - 1
+LATEST = datetime(9999, 12, 31, 23, 59, 59, 999999)
+
+
+def callback_data(markup):
+    return [button.callback_data for row in markup.inline_keyboard for button in row if button.callback_data]
+
+
+def nav_row_markup(prefix):
+    cursor = app.encode_cursor(LATEST, MAX_SERIAL)
+    return app.InlineKeyboardMarkup(inline_keyboard=[app.page_nav_row(prefix, cursor, cursor, True, True)])
+
+
+KEYBOARDS = {
+    'language': lambda: app.language_keyboard(),
+    'main_menu': lambda: app.main_menu_inline('ru'),
+    'back': lambda: app.back_keyboard('uz'),
+    'location': lambda: app.location_keyboard('uz'),
+    'referral': lambda: app.referral_keyboard('ru', 'bot', MAX_USER_ID),
+    'admin_main': lambda: app.admin_main_keyboard(),
+    'admin_user_actions': lambda: app.admin_user_actions_keyboard(MAX_USER_ID),
+    'admin_search_results': lambda: app.admin_search_results_keyboard(
+        [(MAX_USER_ID, "Ism", "+998900000000", 10 ** 9, "Ism", None)]
+    ),
+    'history': lambda: app.history_keyboard(
+        'uz', [(0, 0, 0, LATEST, 'purchase', MAX_SERIAL)], True, True
+    ),
+    'admin_users_nav': lambda: nav_row_markup("admin_users_"),
+    'admin_history_nav': lambda: nav_row_markup(f"ahist_{MAX_USER_ID}_"),
+    'cashback_request': lambda: app.cashback_request_keyboard(MAX_SERIAL),
+    'stats': lambda: app.stats_keyboard(),
+}
+
+
+@pytest.mark.parametrize("name", sorted(KEYBOARDS))
+def test_callback_data_fits_telegram_limit(name):
+    for data in callback_data(KEYBOARDS[name]()):
+        assert len(data.encode()) <= MAX_CALLBACK_DATA, data
+
+
+def test_cursor_round_trip():
+    cursor = app.encode_cursor(LATEST, MAX_SERIAL)
+    assert app.decode_cursor(cursor) == (LATEST, MAX_SERIAL)
+
+
+def test_bulk_callback_carries_size():
+    longest = f"ccbulkok_oldest_{app.CASHBACK_BULK_MAX}"
+    assert len(longest.encode()) <= MAX_CALLBACK_DATA
+    assert app.parse_bulk_callback(longest) == ('oldest', app.CASHBACK_BULK_MAX)
+    assert app.parse_bulk_callback("ccbulk_small_5") == ('small', 5)
+    assert app.parse_bulk_callback(f"ccbulk_oldest_{app.CASHBACK_BULK_MAX * 10}")[1] == app.CASHBACK_BULK_MAX
+    # Eski tugmalar (sonsiz) - standart hajm
+    assert app.parse_bulk_callback("ccbulk_oldest") == ('oldest', app.CASHBACK_BULK_SIZE)
+    assert app.parse_bulk_callback("ccbulk_unknown_5") is None
+    assert app.parse_bulk_callback("ccbulk_oldest_x") is None
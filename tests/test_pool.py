@@ -0,0 +1,25 @@
+import asyncio
+
+import app
+
+
+class RawPool:
+    async def acquire(self, timeout=None):
+        await asyncio.sleep(0.01)
+        return object()
+
+    async def release(self, conn):
+        pass
+
+
+def test_pool_wait_is_visible_only_inside_acquire():
+    pool = app.InstrumentedPool(RawPool())
+
+    async def scenario():
+        async with pool.acquire():
+            inside = app.current_pool_wait.get()
+        return inside, app.current_pool_wait.get()
+
+    inside, after = asyncio.run(scenario())
+    assert inside >= 0.01
+    assert after == 0.0
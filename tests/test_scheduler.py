@@ -0,0 +1,97 @@
+import asyncio
+
+from aiogram import F, Router
+from aiogram.filters import StateFilter
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import app
+from conftest import BOT_ID
+
+USER_ID = 42
+
+
+def make_dispatcher(*routers, max_queue=5):
+    scheduler = app.UserScheduler(concurrency=10, max_queue=max_queue)
+    storage = MemoryStorage()
+    dp = app.build_dispatcher(storage=storage, routers=routers, scheduler=scheduler)
+    return dp, storage, scheduler
+
+
+def test_state_set_by_first_update_is_seen_by_second(bot, updates):
+    seen = []
+    router = Router()
+
+    @router.message(StateFilter("a"))
+    async def in_a(message, state):
+        await asyncio.sleep(0.05)
+        seen.append(("a", message.text))
+        await state.set_state("b")
+
+    @router.message(StateFilter("b"))
+    async def in_b(message, state):
+        seen.append(("b", message.text))
+
+    async def scenario():
+        dp, storage, _ = make_dispatcher(router)
+        key = StorageKey(bot_id=BOT_ID, chat_id=USER_ID, user_id=USER_ID)
+        await storage.set_state(key, "a")
+        await asyncio.gather(
+            dp.feed_update(bot, updates.text(USER_ID, "first")),
+            dp.feed_update(bot, updates.text(USER_ID, "second")),
+        )
+
+    asyncio.run(scenario())
+    assert seen == [("a", "first"), ("b", "second")]
+
+
+def test_same_user_in_order_other_users_in_parallel(bot, updates):
+    events = []
+    router = Router()
+
+    @router.message()
+    async def handler(message):
+        events.append(("start", message.from_user.id, message.text))
+        await asyncio.sleep(0.02)
+        events.append(("end", message.from_user.id, message.text))
+
+    async def scenario():
+        dp, _, _ = make_dispatcher(router)
+        await asyncio.gather(*(
+            dp.feed_update(bot, updates.text(user_id, str(n)))
+            for n in range(3) for user_id in (1, 2)
+        ))
+
+    asyncio.run(scenario())
+    for user_id in (1, 2):
+        own = [(kind, text) for kind, uid, text in events if uid == user_id]
+        assert own == [("start", "0"), ("end", "0"), ("start", "1"), ("end", "1"), ("start", "2"), ("end", "2")]
+    # Ikkinchi foydalanuvchi birinchisi tugashini kutmaydi
+    assert events[:2] == [("start", 1, "0"), ("start", 2, "0")]
+
+
+def test_dropped_callback_is_answered(bot, session, updates):
+    release = asyncio.Event()
+    handled = []
+    router = Router()
+
+    @router.callback_query(F.data == "slow")
+    async def slow(callback):
+        handled.append(callback.data)
+        await release.wait()
+
+    async def scenario():
+        dp, _, scheduler = make_dispatcher(router, max_queue=1)
+        first = asyncio.create_task(dp.feed_update(bot, updates.callback(USER_ID, "slow")))
+        await asyncio.sleep(0.01)
+        await dp.feed_update(bot, updates.callback(USER_ID, "slow"))
+        release.set()
+        await first
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert handled == ["slow"]
+    assert scheduler.dropped == 1
+    answers = session.called("answerCallbackQuery")
+    assert len(answers) == 1
+    assert answers[0].text == app.TEXTS["uz"]["slow_down"]
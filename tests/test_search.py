@@ -0,0 +1,27 @@
+import asyncio
+
+import app
+
+
+def test_short_number_is_only_an_id_lookup(fake_pool):
+    fake_pool(lambda method, query, args: [])
+    asyncio.run(app.search_users("5"))
+
+    [(method, query, args)] = app.db_pool.queries
+    assert "LIKE" not in query
+    assert args == (5,)
+
+
+def test_short_text_does_not_query(fake_pool):
+    fake_pool(lambda method, query, args: [])
+    assert asyncio.run(app.search_users("ab")) == []
+    assert app.db_pool.queries == []
+
+
+def test_longer_number_matches_phone(fake_pool):
+    fake_pool(lambda method, query, args: [])
+    asyncio.run(app.search_users("+998 90"))
+
+    [(method, query, args)] = app.db_pool.queries
+    assert "phone LIKE $2" in query
+    assert args[:2] == (99890, "%99890%")
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import app
+
+
+def make_reader():
+    calls = []
+    release = asyncio.Event()
+
+    @app.single_flight
+    async def read(key):
+        calls.append(key)
+        await release.wait()
+        if key == "bad":
+            raise ValueError(key)
+        return {"key": key}
+
+    return read, calls, release
+
+
+def test_concurrent_calls_share_one_read():
+    async def scenario():
+        read, calls, release = make_reader()
+        tasks = [asyncio.create_task(read("a")) for _ in range(5)]
+        other = asyncio.create_task(read("b"))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        return calls, results, await other
+
+    calls, results, other = asyncio.run(scenario())
+    assert sorted(calls) == ["a", "b"]
+    assert all(result is results[0] for result in results)
+    assert other == {"key": "b"}
+
+
+def test_next_call_after_completion_reads_again():
+    async def scenario():
+        read, calls, release = make_reader()
+        release.set()
+        await read("a")
+        await read("a")
+        return calls
+
+    assert asyncio.run(scenario()) == ["a", "a"]
+
+
+def test_error_reaches_every_caller():
+    async def scenario():
+        read, calls, release = make_reader()
+        tasks = [asyncio.create_task(read("bad")) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        return calls, await asyncio.gather(*tasks, return_exceptions=True)
+
+    calls, results = asyncio.run(scenario())
+    assert calls == ["bad"]
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_first_caller_does_not_cancel_others():
+    async def scenario():
+        read, calls, release = make_reader()
+        first = asyncio.create_task(read("a"))
+        second = asyncio.create_task(read("a"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return calls, await second
+
+    calls, result = asyncio.run(scenario())
+    assert calls == ["a"]
+    assert result == {"key": "a"}
@@ -0,0 +1,71 @@
+import asyncio
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import app
+from conftest import BOT_ID
+
+USER_ID = 42
+REFERRER_ID = 7
+
+
+def start(bot, updates, text):
+    """cmd_start ni chaqirish; natija: (FSM holati, fondagi xabarlar yuborilgandan keyin)"""
+    message = updates.text(USER_ID, text).message
+    state = FSMContext(MemoryStorage(), StorageKey(bot_id=BOT_ID, chat_id=USER_ID, user_id=USER_ID))
+
+    async def scenario():
+        await app.cmd_start(message, state, bot)
+        await asyncio.gather(*app.background_tasks)
+        return await state.get_state()
+
+    return asyncio.run(scenario())
+
+
+def start_user_row(**fields):
+    row = {
+        'is_new': False, 'language': 'uz', 'registered': 0, 'referrer_language': None,
+        'bonus': 0, 'referrer_balance': None,
+    }
+    row.update(fields)
+    return lambda method, query, args: row
+
+
+def test_returning_user_is_one_round_trip(fake_pool, bot, session, updates):
+    fake_pool(start_user_row(language='ru', registered=1))
+    state = start(bot, updates, "/start")
+
+    [(method, query, args)] = app.db_pool.queries
+    assert method == "fetchrow"
+    assert args == (USER_ID, None, "Test", None, None)
+    assert [sent.text for sent in session.called("sendMessage")] == [app.TEXTS['ru']['welcome']]
+    assert state is None
+
+
+def test_referral_signup_credits_referrer_in_one_round_trip(fake_pool, bot, session, updates):
+    fake_pool(start_user_row(is_new=True, referrer_language='ru', bonus=500, referrer_balance=50500))
+    state = start(bot, updates, f"/start ref_{REFERRER_ID}")
+
+    [(method, query, args)] = app.db_pool.queries
+    assert method == "fetchrow"
+    assert args[-1] == REFERRER_ID
+    sent = {(message.chat_id, message.text) for message in session.called("sendMessage")}
+    inviter_text = app.TEXTS['ru']['referral_success_inviter'].format(
+        bonus=app.format_number(500), balance=app.format_number(50500)
+    )
+    assert sent == {
+        (REFERRER_ID, inviter_text),
+        (USER_ID, app.TEXTS['uz']['referral_success_user']),
+        (USER_ID, app.TEXTS['uz']['choose_language']),
+    }
+    assert state == app.Registration.language.state
+
+
+def test_self_referral_is_ignored(fake_pool, bot, updates):
+    fake_pool(start_user_row(is_new=True))
+    start(bot, updates, f"/start ref_{USER_ID}")
+
+    [(method, query, args)] = app.db_pool.queries
+    assert args[-1] is None
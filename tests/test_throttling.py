@@ -0,0 +1,52 @@
+import asyncio
+
+from aiogram import F, Router
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import app
+
+USER_ID = 42
+
+
+def test_parse_handler_limits_overrides_defaults():
+    limits = app.parse_handler_limits("cmd_start=5/10, balance_handler=2")
+    assert limits['cmd_start'] == (5.0, 10.0)
+    assert limits['balance_handler'] == (2.0, 2.0)
+    assert limits['history_handler'] == app.DEFAULT_HANDLER_LIMITS['history_handler']
+
+
+def test_throttling_allows_burst_then_rejects_once():
+    throttling = app.ThrottlingMiddleware(rate=0.001, burst=3, handler_limits={})
+    results = [throttling.allow(USER_ID, 'balance_handler') for _ in range(5)]
+    assert results == [(True, False)] * 3 + [(False, True), (False, False)]
+    # Boshqa foydalanuvchining limiti alohida
+    assert throttling.allow(USER_ID + 1, 'balance_handler') == (True, False)
+
+
+def test_throttling_uses_per_handler_limits():
+    throttling = app.ThrottlingMiddleware(rate=0.001, burst=1, handler_limits={'history_handler': (0.001, 2)})
+    assert [throttling.allow(USER_ID, 'history_handler')[0] for _ in range(3)] == [True, True, False]
+    assert [throttling.allow(USER_ID, 'balance_handler')[0] for _ in range(2)] == [True, False]
+
+
+def test_throttled_callback_is_answered_without_calling_handler(bot, session, updates):
+    handled = []
+    router = Router()
+    router.callback_query.middleware(app.ThrottlingMiddleware(rate=0.001, burst=2, handler_limits={}))
+
+    @router.callback_query(F.data == "balance")
+    async def balance(callback):
+        handled.append(callback.data)
+        await callback.answer()
+
+    async def scenario():
+        dp = app.build_dispatcher(
+            storage=MemoryStorage(), routers=(router,), scheduler=app.UserScheduler(max_queue=10)
+        )
+        for _ in range(4):
+            await dp.feed_update(bot, updates.callback(USER_ID, "balance"))
+
+    asyncio.run(scenario())
+    assert handled == ["balance", "balance"]
+    answers = [answer.text for answer in session.called("answerCallbackQuery")]
+    assert answers == [None, None, app.TEXTS["uz"]["slow_down"], app.TEXTS["uz"]["slow_down"]]
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+import app
+
+
+def test_token_bucket_holds_rate():
+    async def scenario():
+        bucket = app.TokenBucket(rate=100, capacity=1)
+        started = time.monotonic()
+        for _ in range(21):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Birinchi token darhol, qolgan 20 tasi 100/s tezlikda
+    assert 0.18 <= asyncio.run(scenario()) < 0.5
+
+
+def test_token_bucket_backoff_pauses_and_slows_down():
+    async def scenario():
+        bucket = app.TokenBucket(rate=100, capacity=1)
+        await bucket.acquire()
+        bucket.backoff(0.1)
+        started = time.monotonic()
+        await bucket.acquire()
+        return bucket, time.monotonic() - started
+
+    bucket, waited = asyncio.run(scenario())
+    assert waited >= 0.1
+    assert bucket.rate == 80
+
+    for _ in range(1000):
+        bucket.recover()
+    assert bucket.rate == bucket.max_rate